@@ -0,0 +1,55 @@
+# app/beacon.py
+import json
+import zlib
+from typing import Type
+from fastapi import Request
+from fastapi.exceptions import RequestValidationError
+from pydantic import BaseModel, ValidationError
+
+# Eventos da vitrine chegam como CORS "simple request": corpo JSON com
+# Content-Type text/plain (fetch) ou blob do navigator.sendBeacon.
+# application/json continua aceito (loaders antigos em cache).
+BEACON_MAX_BYTES = 64 * 1024
+
+
+def _erro_corpo(tipo: str, msg: str) -> RequestValidationError:
+    return RequestValidationError([{"type": tipo, "loc": ("body",), "msg": msg, "input": None}])
+
+
+def _gunzip(raw: bytes, max_bytes: int) -> bytes:
+    """Descomprime gzip sem passar de max_bytes (corpo pequeno nao vira GBs)."""
+    descompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+    try:
+        corpo = descompressor.decompress(raw, max_bytes + 1)
+    except zlib.error:
+        raise _erro_corpo("gzip_invalid", "gzip invalido")
+    if len(corpo) > max_bytes or descompressor.unconsumed_tail:
+        raise _erro_corpo("too_long", "Corpo muito grande")
+    return corpo
+
+
+def beacon_payload(model: Type[BaseModel], max_bytes: int = BEACON_MAX_BYTES, allow_gzip: bool = False):
+    """
+    Dependency que le o corpo como JSON independente do Content-Type
+    e valida no model — erros viram o mesmo 422 de um body normal.
+    Com allow_gzip, ?encoding=gzip indica corpo comprimido (lotes do service worker).
+    """
+
+    async def _dependency(request: Request) -> BaseModel:
+        raw = await request.body()
+        if allow_gzip and request.query_params.get("encoding") == "gzip":
+            raw = _gunzip(raw, max_bytes)
+        if len(raw) > max_bytes:
+            raise _erro_corpo("too_long", "Corpo muito grande")
+        try:
+            data = json.loads(raw or b"null")
+        except ValueError:
+            raise _erro_corpo("json_invalid", "JSON invalido")
+        try:
+            return model.model_validate(data)
+        except ValidationError as e:
+            raise RequestValidationError([
+                {**erro, "loc": ("body", *erro["loc"])} for erro in e.errors(include_url=False)
+            ])
+
+    return _dependency
@@ -0,0 +1,111 @@
+# app/bench_render.py
+"""
+Benchmark de CPU do render do loader.js por loja.
+
+Compara o custo de CPU (time.process_time) de servir o loader.js de uma loja
+com todos os widgets ligados em tres situacoes:
+
+- loader inteiro por request: core + config + bootstrap renderizados e
+  minificados a cada request (como era antes do core compartilhado/cache)
+- miss do cache: so config JSON + bootstrap Jinja + minify + compressao;
+  o core ja esta renderizado no processo
+- hit do cache: o que a maioria dos requests faz (RenderCache.get)
+
+Os renders incluem minify e a compressao gzip/brotli do RenderedAsset.
+
+Nao abre conexao com o banco: a config da loja e um AppConfig em memoria.
+
+Uso:
+    python -m app.bench_render --numero 200 --repeticoes 5
+"""
+import argparse
+import os
+import time
+
+# So o import do engine precisa da URL; nenhuma conexao e aberta
+os.environ.setdefault("DATABASE_URL", "sqlite://")
+
+from app.models import AppConfig  # noqa: E402
+from app.render_cache import RenderCache, RenderedAsset, minify_js  # noqa: E402
+from app.routes import loader_routes as L  # noqa: E402
+
+STORE_ID = "123"
+BACKEND = "https://backend.exemplo.com"
+
+
+def _config_completa() -> AppConfig:
+    return AppConfig(
+        store_id=STORE_ID,
+        app_name="Loja Benchmark",
+        theme_color="#ff0000",
+        fab_enabled=True,
+        fab_text='Baixe "já" <app>',
+        fab_position="left",
+        fab_icon="📲",
+        fab_delay=2,
+        fab_color="#0000ff",
+        fab_size="large",
+        topbar_enabled=True,
+        topbar_text="Baixe nosso app",
+        topbar_button_text="Baixar",
+        topbar_position="top",
+        popup_enabled=True,
+        popup_image_url="https://cdn.exemplo.com/popup.png",
+        onesignal_app_id="abc-123",
+    )
+
+
+def _loader_inteiro(config: AppConfig):
+    loader_config = L.build_loader_config(STORE_ID, config)
+    features = L.loader_features(loader_config)
+    # Core sem o lru_cache: renderizado de novo, como no loader unico por loja
+    core = L._render_core.__wrapped__("prod", features)
+    config_json = L.render_loader_config(STORE_ID, config)
+    bootstrap = minify_js(L.render_loader(STORE_ID, loader_config, None, BACKEND))
+    return core, config_json, bootstrap
+
+
+def _miss_do_cache(config: AppConfig):
+    config_asset = RenderedAsset(L.render_loader_config(STORE_ID, config))
+    loader_config = L.build_loader_config(STORE_ID, config)
+    return RenderedAsset(minify_js(L.render_loader(STORE_ID, loader_config, config_asset.version, BACKEND)))
+
+
+def _medir(funcao, numero: int, repeticoes: int) -> float:
+    """Melhor tempo de CPU por chamada, em microssegundos."""
+    melhor = None
+    for _ in range(repeticoes):
+        inicio = time.process_time()
+        for _ in range(numero):
+            funcao()
+        gasto = (time.process_time() - inicio) / numero
+        melhor = gasto if melhor is None else min(melhor, gasto)
+    return melhor * 1e6
+
+
+def executar(numero: int, repeticoes: int) -> dict:
+    config = _config_completa()
+    cache = RenderCache("bench")
+    cache.get(STORE_ID, BACKEND, lambda: _miss_do_cache(config))
+
+    return {
+        "loader inteiro por request": _medir(lambda: _loader_inteiro(config), numero, repeticoes),
+        "miss do cache (config + bootstrap)": _medir(lambda: _miss_do_cache(config), numero, repeticoes),
+        "hit do cache": _medir(lambda: cache.get(STORE_ID, BACKEND, lambda: _miss_do_cache(config)), numero, repeticoes),
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="CPU por request do render do loader.js.")
+    parser.add_argument("--numero", type=int, default=200, help="renders por medicao")
+    parser.add_argument("--repeticoes", type=int, default=5, help="medicoes (vale a melhor)")
+    args = parser.parse_args(argv)
+
+    resultados = executar(args.numero, args.repeticoes)
+    base = resultados["loader inteiro por request"]
+    for nome, us in resultados.items():
+        print(f"{nome:<38} {us:10.1f} us CPU/request  ({base / us:6.1f}x)")
+
+
+if __name__ == "__main__":
+    main()
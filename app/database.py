@@ -1,4 +1,4 @@
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, text
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
 import os
@@ -23,3 +23,11 @@ def get_db():
         yield db
     finally:
         db.close()
+
+
+# ✅ Timeout por statement (Postgres) — vale so ate o fim da transacao atual,
+# entao nao vaza para o proximo uso da conexao no pool
+def set_statement_timeout(db, timeout_ms: int):
+    if db.get_bind().dialect.name != "postgresql":
+        return
+    db.execute(text(f"SET LOCAL statement_timeout = {max(1, int(timeout_ms))}"))
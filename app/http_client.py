@@ -0,0 +1,100 @@
+# app/http_client.py
+"""
+Cliente HTTP compartilhado para as chamadas ao OneSignal.
+
+Um unico httpx.AsyncClient vive enquanto o app vive (aberto no startup,
+fechado no shutdown): as conexoes TLS ficam no pool e cada push deixa de
+pagar handshake. Com o pacote h2 instalado a conexao e HTTP/2 (varias
+requisicoes multiplexadas na mesma conexao).
+
+Todo o trafego desse cliente vai para onesignal.com, entao os limites do
+pool sao, na pratica, o limite de conexoes por host.
+
+Jobs do APScheduler rodam em threads: usam run_no_loop_do_app() para
+executar a corrotina no loop do app, onde o cliente foi criado.
+"""
+import asyncio
+import contextvars
+import os
+from typing import Optional
+
+import httpx
+
+# Dependencia opcional: sem h2 o cliente fica em HTTP/1.1 (mesmo pool)
+try:
+    import h2  # noqa: F401
+    HTTP2_DISPONIVEL = True
+except ImportError:
+    HTTP2_DISPONIVEL = False
+
+ONESIGNAL_MAX_CONNECTIONS = int(os.getenv("ONESIGNAL_MAX_CONNECTIONS", "20"))
+ONESIGNAL_MAX_KEEPALIVE = int(os.getenv("ONESIGNAL_MAX_KEEPALIVE", "10"))
+ONESIGNAL_KEEPALIVE_EXPIRY = 60.0
+ONESIGNAL_TIMEOUT = httpx.Timeout(15.0, connect=5.0)
+# Espera maxima de um job do scheduler pela corrotina no loop do app
+JOB_TIMEOUT_SECONDS = 120
+
+_client: Optional[httpx.AsyncClient] = None
+_loop: Optional[asyncio.AbstractEventLoop] = None
+# Cliente temporario de quem roda fora do app (CLI, job sem loop do app)
+_client_local = contextvars.ContextVar("onesignal_client_local", default=None)
+
+
+def _novo_client() -> httpx.AsyncClient:
+    return httpx.AsyncClient(
+        http2=HTTP2_DISPONIVEL,
+        timeout=ONESIGNAL_TIMEOUT,
+        limits=httpx.Limits(
+            max_connections=ONESIGNAL_MAX_CONNECTIONS,
+            max_keepalive_connections=ONESIGNAL_MAX_KEEPALIVE,
+            keepalive_expiry=ONESIGNAL_KEEPALIVE_EXPIRY,
+        ),
+    )
+
+
+async def abrir_onesignal_client():
+    """Startup do app: cria o cliente e guarda o loop para os jobs."""
+    global _client, _loop
+    _loop = asyncio.get_running_loop()
+    if _client is None:
+        _client = _novo_client()
+        print(f"[HTTP] Cliente OneSignal aberto (http2={HTTP2_DISPONIVEL})")
+
+
+async def fechar_onesignal_client():
+    global _client, _loop
+    if _client is not None:
+        await _client.aclose()
+        print("[HTTP] Cliente OneSignal fechado.")
+    _client = None
+    _loop = None
+
+
+def onesignal_client() -> httpx.AsyncClient:
+    """Cliente para a chamada atual: o compartilhado do app ou o temporario do contexto."""
+    local = _client_local.get()
+    if local is not None:
+        return local
+    if _client is None:
+        raise RuntimeError("Cliente OneSignal nao iniciado (startup do app nao rodou)")
+    return _client
+
+
+async def _com_client_temporario(coro_factory):
+    async with _novo_client() as client:
+        token = _client_local.set(client)
+        try:
+            return await coro_factory()
+        finally:
+            _client_local.reset(token)
+
+
+def run_no_loop_do_app(coro_factory, timeout: float = JOB_TIMEOUT_SECONDS):
+    """
+    Executa coro_factory() a partir de uma thread (job do scheduler).
+    Com o app no ar, roda no loop do app e reaproveita o pool; sem ele,
+    roda num loop proprio com um cliente temporario.
+    """
+    if _loop is not None and _loop.is_running():
+        return asyncio.run_coroutine_threadsafe(coro_factory(), _loop).result(timeout)
+    return asyncio.run(_com_client_temporario(coro_factory))
@@ -0,0 +1,268 @@
+# app/icons.py
+"""
+Icones do manifest gerados no servidor a partir da logo da loja.
+
+A imagem de origem (logo_url ou o fallback) e baixada uma vez e vira
+PNG e WebP nos tamanhos do manifest, gravados em disco com nome derivado
+do hash do conteudo ({hash}-{tamanho}.{ext}). Como o nome muda junto com
+a imagem, a rota de icones serve tudo com cache imutavel.
+
+A geracao roda em background: enquanto os arquivos nao existem o manifest
+continua apontando para a URL original; quando terminam, os renders da
+loja (manifest, service worker) sao invalidados.
+"""
+import hashlib
+import ipaddress
+import os
+import socket
+import re
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
+from typing import Optional
+from urllib.parse import urljoin, urlparse
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from app.render_cache import invalidate_store
+
+# Dependencia opcional: sem Pillow o manifest segue com a URL original
+try:
+    from PIL import Image, ImageOps
+except ImportError:
+    Image = None
+
+ICONS_DIR = os.getenv("ICONS_DIR", os.path.join(tempfile.gettempdir(), "app-builder-icons"))
+ICON_SIZES = (192, 512)
+ICON_FORMATS = {"png": "image/png", "webp": "image/webp"}
+ICON_SOURCE_MAX_BYTES = int(os.getenv("ICON_SOURCE_MAX_BYTES", str(10 * 1024 * 1024)))
+ICON_SOURCE_MAX_PIXELS = 40_000_000
+ICON_FETCH_TIMEOUT = 15
+ICON_FETCH_MAX_REDIRECTS = 3
+# URL que falhou (404, nao e imagem...) so e tentada de novo depois disso
+ICON_RETRY_SECONDS = 3600
+ICON_URL_PREFIX = "/apps/app-builder/icons"
+
+ICON_NAME_RE = re.compile(r"^[0-9a-f]{16}-(%s)\.(%s)$" % (
+    "|".join(str(s) for s in ICON_SIZES), "|".join(ICON_FORMATS)
+))
+
+_executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix="icons")
+_lock = threading.Lock()
+_hashes = {}      # url de origem -> hash do conteudo
+_pendentes = {}   # url de origem -> store_ids esperando a geracao
+_falhas = {}      # url de origem -> momento da ultima falha
+
+if Image is not None:
+    Image.MAX_IMAGE_PIXELS = ICON_SOURCE_MAX_PIXELS
+
+
+def icon_path(name: str) -> str:
+    return os.path.join(ICONS_DIR, name)
+
+
+def _indice_path(source_url: str) -> str:
+    chave = hashlib.sha256(source_url.encode("utf-8")).hexdigest()[:24]
+    return os.path.join(ICONS_DIR, "sources", f"{chave}.txt")
+
+
+def _nomes(digest: str):
+    return [f"{digest}-{size}.{ext}" for size in ICON_SIZES for ext in ICON_FORMATS]
+
+
+def _gravar(path: str, data: bytes):
+    """Grava via arquivo temporario + rename: quem le nunca ve arquivo pela metade."""
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path), prefix=".tmp-")
+    with os.fdopen(fd, "wb") as f:
+        f.write(data)
+    os.replace(tmp, path)
+
+
+def icones_gerados(source_url: str) -> Optional[str]:
+    """Hash dos icones ja gerados para a URL (memoria, depois disco), ou None."""
+    digest = _hashes.get(source_url)
+    if digest:
+        return digest
+    try:
+        with open(_indice_path(source_url)) as f:
+            digest = f.read().strip()
+    except OSError:
+        return None
+    if not all(os.path.exists(icon_path(nome)) for nome in _nomes(digest)):
+        return None
+    _hashes[source_url] = digest
+    return digest
+
+
+def manifest_icons(digest: str) -> list:
+    """Entradas de icone do manifest — PNG primeiro (suporte universal), WebP depois."""
+    return [
+        {
+            "src": f"{ICON_URL_PREFIX}/{digest}-{size}.{ext}",
+            "sizes": f"{size}x{size}",
+            "type": media_type,
+        }
+        for ext, media_type in ICON_FORMATS.items()
+        for size in ICON_SIZES
+    ]
+
+
+def _validar_url(url: str) -> str:
+    """
+    logo_url vem do lojista: so https para host publico. Bloqueia rede
+    interna, loopback, link-local (metadata da cloud) etc. — SSRF.
+    Devolve o IP validado: a conexao e feita nele (ver _HostFixo).
+    """
+    partes = urlparse(url)
+    if partes.scheme != "https" or not partes.hostname:
+        raise ValueError(f"URL de icone nao permitida: {url}")
+    try:
+        enderecos = socket.getaddrinfo(partes.hostname, partes.port or 443, proto=socket.IPPROTO_TCP)
+    except socket.gaierror:
+        raise ValueError(f"Host do icone nao resolve: {partes.hostname}")
+    ips = []
+    for *_, sockaddr in enderecos:
+        ip = ipaddress.ip_address(sockaddr[0].split("%", 1)[0])
+        if not ip.is_global or ip.is_multicast:
+            raise ValueError(f"Host do icone aponta para endereco interno: {partes.hostname}")
+        ips.append(ip)
+    if not ips:
+        raise ValueError(f"Host do icone nao resolve: {partes.hostname}")
+    return str(ips[0])
+
+
+class _HostFixo(HTTPAdapter):
+    """
+    Conecta no IP ja validado em vez de deixar o requests resolver o host de
+    novo (DNS rebinding: TTL baixo troca o IP entre a validacao e a conexao).
+    SNI e verificacao do certificado continuam pelo hostname original.
+    """
+
+    def __init__(self, hostname: str):
+        self._hostname = hostname
+        super().__init__(max_retries=0)
+
+    def init_poolmanager(self, *args, **kwargs):
+        kwargs["server_hostname"] = self._hostname
+        kwargs["assert_hostname"] = self._hostname
+        super().init_poolmanager(*args, **kwargs)
+
+
+def _abrir(url: str, ip: str):
+    partes = urlparse(url)
+    host = partes.hostname if partes.port is None else f"{partes.hostname}:{partes.port}"
+    destino = f"[{ip}]" if ":" in ip else ip
+    if partes.port is not None:
+        destino += f":{partes.port}"
+
+    sessao = requests.Session()
+    sessao.mount("https://", _HostFixo(partes.hostname))
+    try:
+        resp = sessao.get(
+            partes._replace(netloc=destino).geturl(),
+            headers={"Host": host},
+            timeout=ICON_FETCH_TIMEOUT,
+            stream=True,
+            allow_redirects=False,
+        )
+    except Exception:
+        sessao.close()
+        raise
+    return sessao, resp
+
+
+def _baixar(source_url: str) -> bytes:
+    # Redirect seguido na mao: cada salto passa pela mesma validacao
+    url = source_url
+    for _ in range(ICON_FETCH_MAX_REDIRECTS + 1):
+        sessao, resp = _abrir(url, _validar_url(url))
+        if not resp.is_redirect:
+            break
+        url = urljoin(url, resp.headers.get("location", ""))
+        resp.close()
+        sessao.close()
+    else:
+        raise ValueError("redirecionamentos demais")
+
+    try:
+        with resp:
+            resp.raise_for_status()
+            data = bytearray()
+            for chunk in resp.iter_content(64 * 1024):
+                data += chunk
+                if len(data) > ICON_SOURCE_MAX_BYTES:
+                    raise ValueError("imagem de origem muito grande")
+    finally:
+        sessao.close()
+    return bytes(data)
+
+
+def _redimensionar(origem, size: int):
+    # Mantem a proporcao e centraliza num quadrado transparente
+    icone = ImageOps.contain(origem, (size, size), Image.LANCZOS)
+    canvas = Image.new("RGBA", (size, size), (0, 0, 0, 0))
+    canvas.paste(icone, ((size - icone.width) // 2, (size - icone.height) // 2))
+    return canvas
+
+
+def _codificar(imagem, ext: str) -> bytes:
+    buffer = BytesIO()
+    if ext == "png":
+        imagem.save(buffer, "PNG", optimize=True)
+    else:
+        imagem.save(buffer, "WEBP", quality=90, method=6)
+    return buffer.getvalue()
+
+
+def gerar_icones(source_url: str) -> str:
+    """Baixa a origem e grava os icones (se ainda nao existem). Devolve o hash."""
+    data = _baixar(source_url)
+    digest = hashlib.sha256(data).hexdigest()[:16]
+
+    if not all(os.path.exists(icon_path(nome)) for nome in _nomes(digest)):
+        with Image.open(BytesIO(data)) as origem:
+            origem = ImageOps.exif_transpose(origem).convert("RGBA")
+            for size in ICON_SIZES:
+                icone = _redimensionar(origem, size)
+                for ext in ICON_FORMATS:
+                    _gravar(icon_path(f"{digest}-{size}.{ext}"), _codificar(icone, ext))
+
+    _gravar(_indice_path(source_url), digest.encode("utf-8"))
+    _hashes[source_url] = digest
+    return digest
+
+
+def _gerar_e_invalidar(source_url: str):
+    try:
+        digest = gerar_icones(source_url)
+        print(f"[ICONS] Icones gerados para {source_url}: {digest}")
+    except Exception as e:
+        print(f"[ICONS] Erro ao gerar icones de {source_url}: {e}")
+        digest = None
+    with _lock:
+        store_ids = _pendentes.pop(source_url, set())
+        if not digest:
+            _falhas[source_url] = time.monotonic()
+    if digest:
+        # Manifest/SW da loja voltam a renderizar ja com os icones locais
+        for store_id in store_ids:
+            invalidate_store(store_id)
+
+
+def agendar_icones(store_id: str, source_url: str):
+    """Gera os icones em background (uma geracao por URL, mesmo com varias lojas)."""
+    if Image is None or not source_url or not source_url.startswith("https://"):
+        return
+    with _lock:
+        falhou_em = _falhas.get(source_url)
+        if falhou_em is not None and time.monotonic() - falhou_em < ICON_RETRY_SECONDS:
+            return
+        if source_url in _pendentes:
+            _pendentes[source_url].add(store_id)
+            return
+        _pendentes[source_url] = {store_id}
+    _executor.submit(_gerar_e_invalidar, source_url)
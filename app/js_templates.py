@@ -0,0 +1,24 @@
+# app/js_templates.py
+import os
+from jinja2 import Environment, FileSystemLoader, StrictUndefined
+
+TEMPLATES_DIR = os.path.join(os.path.dirname(__file__), "templates")
+
+# JS gerado a partir de templates Jinja2 (app/templates/*.js).
+# - Dados da loja entram sempre via |tojson (string JS segura, com <, > e & escapados)
+# - autoescape desligado: o escape de HTML quebraria o JS
+# - StrictUndefined: variavel faltando no render vira erro, nao string vazia
+js_env = Environment(
+    loader=FileSystemLoader(TEMPLATES_DIR),
+    autoescape=False,
+    undefined=StrictUndefined,
+    trim_blocks=True,
+    lstrip_blocks=True,
+    keep_trailing_newline=True,
+    auto_reload=False,
+)
+
+
+def load_js_template(name: str):
+    """Compila o template uma vez — chamar no import do modulo que usa."""
+    return js_env.get_template(name)
@@ -0,0 +1,107 @@
+# app/live_visitors.py
+import os
+import threading
+import time
+from collections import OrderedDict
+
+from sqlalchemy.orm import Session
+
+from app.store_keys import get_loja_id
+
+# Janela de "quem esta na loja agora"
+JANELA_SEGUNDOS = 5 * 60
+# Teto por loja: acima disso o visitante mais antigo sai antes da hora
+LIVE_MAX_VISITANTES_POR_LOJA = int(os.getenv("LIVE_MAX_VISITANTES_POR_LOJA", "20000"))
+# De quanto em quanto tempo as janelas de todas as lojas sao varridas
+LIVE_VARREDURA_SEGUNDOS = 60
+
+
+class JanelaVisitantes:
+    """
+    Visitantes ativos de uma loja nos ultimos JANELA_SEGUNDOS, em memoria.
+    O OrderedDict fica ordenado pelo ultimo acesso, entao expirar e so
+    tirar do comeco; os contadores PWA/site sao mantidos incrementalmente.
+    """
+
+    def __init__(self):
+        self._vistos = OrderedDict()  # visitor_id -> (ultimo_acesso, is_pwa)
+        self.pwa = 0
+        self.site = 0
+
+    def _descontar(self, is_pwa: bool):
+        if is_pwa:
+            self.pwa -= 1
+        else:
+            self.site -= 1
+
+    def registrar(self, visitor_id: str, is_pwa: bool, agora: float):
+        anterior = self._vistos.pop(visitor_id, None)
+        if anterior:
+            self._descontar(anterior[1])
+        self._vistos[visitor_id] = (agora, is_pwa)
+        if is_pwa:
+            self.pwa += 1
+        else:
+            self.site += 1
+        while len(self._vistos) > LIVE_MAX_VISITANTES_POR_LOJA:
+            _, (_, antigo_pwa) = self._vistos.popitem(last=False)
+            self._descontar(antigo_pwa)
+
+    def expirar(self, agora: float):
+        limite = agora - JANELA_SEGUNDOS
+        while self._vistos:
+            visitor_id, (visto_em, is_pwa) = next(iter(self._vistos.items()))
+            if visto_em >= limite:
+                break
+            self._vistos.popitem(last=False)
+            self._descontar(is_pwa)
+
+    def vazia(self) -> bool:
+        return not self._vistos
+
+
+_janelas: dict = {}
+_lock = threading.Lock()
+_ultima_varredura = 0.0
+
+
+def _varrer(agora: float):
+    """Expira todas as janelas e remove as vazias (loja que parou de receber visitas)."""
+    global _ultima_varredura
+    if agora - _ultima_varredura < LIVE_VARREDURA_SEGUNDOS:
+        return
+    _ultima_varredura = agora
+    for store_id in list(_janelas):
+        janela = _janelas[store_id]
+        janela.expirar(agora)
+        if janela.vazia():
+            del _janelas[store_id]
+
+
+def registrar_visitante(db: Session, store_id: str, visitor_id: str, is_pwa: bool):
+    """Chamado no caminho de ingestao (visitas/instalacoes)."""
+    if not store_id or not visitor_id:
+        return
+    # ✅ Ingestao e publica: store_id que nao e loja instalada nao ganha janela
+    if get_loja_id(db, store_id) is None:
+        return
+    agora = time.monotonic()
+    with _lock:
+        _varrer(agora)
+        janela = _janelas.get(store_id)
+        if janela is None:
+            janela = _janelas[store_id] = JanelaVisitantes()
+        janela.registrar(visitor_id, bool(is_pwa), agora)
+        janela.expirar(agora)
+
+
+def contar_ativos(store_id: str) -> dict:
+    """Contagem atual da loja — sem tocar no banco."""
+    agora = time.monotonic()
+    with _lock:
+        _varrer(agora)
+        janela = _janelas.get(store_id)
+        if janela is None:
+            return {"total": 0, "pwa": 0, "site": 0}
+        janela.expirar(agora)
+        return {"total": janela.pwa + janela.site, "pwa": janela.pwa, "site": janela.site}
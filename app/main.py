@@ -1,9 +1,16 @@
 import os
+from datetime import datetime, timedelta
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.staticfiles import StaticFiles
 
 from app.database import engine, Base
+from app.http_client import abrir_onesignal_client, fechar_onesignal_client
+from app.push_outbox import despachar_outbox, OUTBOX_INTERVALO_SEGUNDOS
+from app.push_stats import atualizar_push_stats, PUSH_STATS_REFRESH_SECONDS
+from app.push_subscribers import sincronizar_subscribers, SUBSCRIBERS_SYNC_SEGUNDOS
+from app.push_metrics import sincronizar_metricas_push, PUSH_METRICAS_SEGUNDOS
+from app.services import sincronizar_script_tags
 
 import psycopg2
 from psycopg2 import sql
@@ -64,6 +71,7 @@ def ensure_app_config_table_and_columns():
         "bottom_bar_icon_color": "VARCHAR DEFAULT '#6B7280'",
         "onesignal_app_id": "VARCHAR(100)",
         "onesignal_api_key": "VARCHAR(200)",
+        "sw_navigation_strategy": "VARCHAR DEFAULT 'off'",
     }
 
     cur.execute("""
@@ -126,9 +134,167 @@ def ensure_lojas_logo_column():
     print("[DB MIGRATION] lojas.logo_url OK.")
 
 
+# ✅ Tabelas de eventos, carrinho e push ganham loja_id (FK para lojas.id)
+LOJA_ID_TABLES = [
+    "visitas_app",
+    "vendas_app",
+    "variant_events",
+    "carrinhos_abandonados",
+    "push_history",
+    "push_subscriptions",
+]
+
+
+def ensure_loja_id_columns():
+    db_url = get_db_url()
+    if not db_url:
+        return
+
+    conn = psycopg2.connect(db_url)
+    conn.autocommit = True
+    cur = conn.cursor()
+
+    cur.execute("""
+        SELECT table_name FROM information_schema.tables
+        WHERE table_schema = 'public';
+    """)
+    existing_tables = {row[0] for row in cur.fetchall()}
+    if "lojas" not in existing_tables:
+        cur.close()
+        conn.close()
+        return
+
+    for table in LOJA_ID_TABLES:
+        if table not in existing_tables:
+            continue
+
+        cur.execute("""
+            SELECT column_name FROM information_schema.columns
+            WHERE table_name = %s AND table_schema = 'public';
+        """, (table,))
+        existing_cols = {row[0] for row in cur.fetchall()}
+
+        if "loja_id" not in existing_cols:
+            try:
+                cur.execute(sql.SQL(
+                    "ALTER TABLE {table} ADD COLUMN loja_id INTEGER REFERENCES lojas(id);"
+                ).format(table=sql.Identifier(table)))
+                cur.execute(sql.SQL(
+                    "CREATE INDEX IF NOT EXISTS {index} ON {table} (loja_id);"
+                ).format(
+                    index=sql.Identifier(f"ix_{table}_loja_id"),
+                    table=sql.Identifier(table),
+                ))
+                print(f"[DB MIGRATION] Coluna loja_id criada em {table}.")
+            except Exception as e:
+                print(f"[DB MIGRATION] Erro ao criar loja_id em {table}: {e}")
+                continue
+
+        # Preenche loja_id das linhas antigas a partir do store_id
+        try:
+            cur.execute(sql.SQL("""
+                UPDATE {table} AS t SET loja_id = l.id
+                FROM lojas l
+                WHERE t.loja_id IS NULL AND t.store_id = l.store_id;
+            """).format(table=sql.Identifier(table)))
+            if cur.rowcount:
+                print(f"[DB MIGRATION] {cur.rowcount} linhas de {table} com loja_id preenchido.")
+        except Exception as e:
+            print(f"[DB MIGRATION] Erro ao preencher loja_id em {table}: {e}")
+
+    cur.close()
+    conn.close()
+    print("[DB MIGRATION] loja_id OK.")
+
+
+# ✅ Passo de recuperacao de carrinho devido, aguardando o envio em lote
+def ensure_carrinho_columns():
+    db_url = get_db_url()
+    if not db_url:
+        return
+
+    conn = psycopg2.connect(db_url)
+    conn.autocommit = True
+    cur = conn.cursor()
+
+    cur.execute("""
+        SELECT column_name FROM information_schema.columns
+        WHERE table_name = 'carrinhos_abandonados' AND table_schema = 'public';
+    """)
+    existing_cols = {row[0] for row in cur.fetchall()}
+
+    # Tabela ainda nao existe: o create_all cria ja com a coluna
+    if existing_cols and "passo_pendente" not in existing_cols:
+        try:
+            cur.execute("ALTER TABLE carrinhos_abandonados ADD COLUMN passo_pendente INTEGER;")
+            cur.execute("""
+                CREATE INDEX IF NOT EXISTS ix_carrinhos_abandonados_passo_pendente
+                ON carrinhos_abandonados (passo_pendente);
+            """)
+            print("[DB MIGRATION] Coluna passo_pendente criada em carrinhos_abandonados.")
+        except Exception as e:
+            print(f"[DB MIGRATION] Erro: {e}")
+
+    cur.close()
+    conn.close()
+    print("[DB MIGRATION] carrinhos_abandonados.passo_pendente OK.")
+
+
+def ensure_push_history_columns():
+    db_url = get_db_url()
+    if not db_url:
+        return
+
+    conn = psycopg2.connect(db_url)
+    conn.autocommit = True
+    cur = conn.cursor()
+
+    cur.execute("""
+        SELECT column_name FROM information_schema.columns
+        WHERE table_name = 'push_history' AND table_schema = 'public';
+    """)
+    existing_cols = {row[0] for row in cur.fetchall()}
+
+    # notification_id: id do OneSignal gravado pela outbox depois do envio
+    if existing_cols and "notification_id" not in existing_cols:
+        try:
+            cur.execute("ALTER TABLE push_history ADD COLUMN notification_id VARCHAR;")
+            cur.execute("""
+                CREATE INDEX IF NOT EXISTS ix_push_history_notification_id
+                ON push_history (notification_id);
+            """)
+            print("[DB MIGRATION] Coluna notification_id criada em push_history.")
+        except Exception as e:
+            print(f"[DB MIGRATION] Erro: {e}")
+
+    # Metricas de entrega (job de sincronizacao com o OneSignal)
+    metric_columns = {
+        "delivered_count": "INTEGER DEFAULT 0",
+        "failed_count": "INTEGER DEFAULT 0",
+        "metrics_updated_at": "VARCHAR",
+    }
+    for col_name, col_type in metric_columns.items():
+        if existing_cols and col_name not in existing_cols:
+            alter_stmt = sql.SQL(
+                "ALTER TABLE push_history ADD COLUMN {name} {ctype};"
+            ).format(name=sql.Identifier(col_name), ctype=sql.SQL(col_type))
+            try:
+                cur.execute(alter_stmt)
+                print(f"[DB MIGRATION] Coluna {col_name} criada em push_history.")
+            except Exception as e:
+                print(f"[DB MIGRATION] Erro ao criar {col_name}: {e}")
+
+    cur.close()
+    conn.close()
+    print("[DB MIGRATION] push_history colunas do OneSignal OK.")
+
+
 def run_all_migrations():
     ensure_app_config_table_and_columns()
     ensure_lojas_logo_column()
+    ensure_loja_id_columns()
+    ensure_carrinho_columns()
+    ensure_push_history_columns()
 
 
 # IMPORT DAS ROTAS
@@ -177,6 +343,69 @@ scheduler = criar_scheduler()
 scheduler.start()
 print("[SCHEDULER] APScheduler iniciado com SQLAlchemyJobStore")
 
+# ✅ Recuperacao de carrinho sai em lotes: um push por loja/passo a cada janela
+scheduler.add_job(
+    automacao_routes.enviar_lotes_carrinho,
+    "interval",
+    seconds=automacao_routes.CARRINHO_LOTE_SEGUNDOS,
+    id="carrinho_lotes",
+    replace_existing=True,
+)
+
+# ✅ Ids do lote offline do SW (dedupe) limpos uma vez por dia
+scheduler.add_job(
+    analytics_routes.limpar_ids_lote,
+    "interval",
+    hours=24,
+    id="analytics_ids_lote",
+    replace_existing=True,
+)
+
+# ✅ Outbox de push: rotas/webhooks/lotes so enfileiram; o envio sai daqui
+scheduler.add_job(
+    despachar_outbox,
+    "interval",
+    seconds=OUTBOX_INTERVALO_SEGUNDOS,
+    id="push_outbox",
+    replace_existing=True,
+)
+
+# ✅ Stats de push do painel renovadas em background (o painel so le o cache)
+scheduler.add_job(
+    atualizar_push_stats,
+    "interval",
+    seconds=PUSH_STATS_REFRESH_SECONDS,
+    id="push_stats",
+    replace_existing=True,
+)
+
+# ✅ Espelho local dos subscribers (distribuicao por pais/dispositivo)
+scheduler.add_job(
+    sincronizar_subscribers,
+    "interval",
+    seconds=SUBSCRIBERS_SYNC_SEGUNDOS,
+    id="push_subscribers",
+    replace_existing=True,
+)
+
+# ✅ Metricas de entrega/abertura das campanhas gravadas em push_history
+scheduler.add_job(
+    sincronizar_metricas_push,
+    "interval",
+    seconds=PUSH_METRICAS_SEGUNDOS,
+    id="push_metrics",
+    replace_existing=True,
+)
+
+# ✅ Deploy pode mudar o hash do loader: re-registra o &v= das script tags uma vez
+scheduler.add_job(
+    sincronizar_script_tags,
+    "date",
+    run_date=datetime.now() + timedelta(seconds=30),
+    id="script_tags_deploy",
+    replace_existing=True,
+)
+
 app = FastAPI(
     title="App Builder Pro API",
     description="API Modular para PWAs, Push Notifications, Analytics e Automacoes.",
@@ -189,6 +418,8 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    # ✅ Preflight que ainda acontecer (rotas com JSON/Authorization) fica em cache por 24h
+    max_age=86400,
 )
 
 # Disponibiliza o scheduler para as rotas via app.state
@@ -217,12 +448,23 @@ def health_check():
     }
 
 
+@app.on_event("startup")
+async def startup_http_client():
+    # ✅ Um pool de conexoes (HTTP/2) para todas as chamadas ao OneSignal
+    await abrir_onesignal_client()
+
+
 @app.on_event("shutdown")
 def shutdown_scheduler():
     scheduler.shutdown(wait=False)
     print("[SCHEDULER] APScheduler encerrado.")
 
 
+@app.on_event("shutdown")
+async def shutdown_http_client():
+    await fechar_onesignal_client()
+
+
 # Frontend estatico — SEMPRE por ultimo
 frontend_path = None
 if os.path.exists("frontend/dist"):
@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, Boolean, Text, Float
+from sqlalchemy import Column, Integer, String, Boolean, Text, Float, ForeignKey, Index, UniqueConstraint
 from .database import Base
 
 
@@ -60,12 +60,17 @@ class AppConfig(Base):
     onesignal_app_id = Column(String(100), nullable=True)
     onesignal_api_key = Column(String(200), nullable=True)
 
+    # ✅ SERVICE WORKER — cache de navegacao (off | swr | app_shell)
+    sw_navigation_strategy = Column(String, default="off")
+
 
 class VendaApp(Base):
     __tablename__ = "vendas_app"
 
     id = Column(Integer, primary_key=True, index=True)
     store_id = Column(String, index=True)
+    # ✅ Chave inteira da loja (lojas.id) — indices menores e joins mais rapidos
+    loja_id = Column(Integer, ForeignKey("lojas.id"), index=True, nullable=True)
     valor = Column(String)
     data = Column(String)
     visitor_id = Column(String, index=True, nullable=True)
@@ -76,17 +81,28 @@ class VisitaApp(Base):
 
     id = Column(Integer, primary_key=True, index=True)
     store_id = Column(String, index=True)
+    loja_id = Column(Integer, ForeignKey("lojas.id"), index=True, nullable=True)
     data = Column(String)
     pagina = Column(String)
     is_pwa = Column(Boolean, default=False)
     visitor_id = Column(String, index=True, nullable=True)
 
 
+# ✅ Ids dos eventos do lote offline do SW ja gravados: lote reenviado nao
+# conta visita/venda duas vezes. Limpo depois da idade maxima da fila.
+class EventoLoteRecebido(Base):
+    __tablename__ = "analytics_eventos_recebidos"
+
+    event_id = Column(String, primary_key=True)
+    recebido_em = Column(String, index=True)
+
+
 class PushSubscription(Base):
     __tablename__ = "push_subscriptions"
 
     id = Column(Integer, primary_key=True, index=True)
     store_id = Column(String, index=True)
+    loja_id = Column(Integer, ForeignKey("lojas.id"), index=True, nullable=True)
     visitor_id = Column(String, index=True)
     endpoint = Column(Text, nullable=False)
     p256dh = Column(String, nullable=False)
@@ -99,12 +115,79 @@ class PushHistory(Base):
 
     id = Column(Integer, primary_key=True, index=True)
     store_id = Column(String, index=True)
+    loja_id = Column(Integer, ForeignKey("lojas.id"), index=True, nullable=True)
     title = Column(String)
     message = Column(String)
     url = Column(String)
     clicks = Column(Integer, default=0)
     sent_count = Column(Integer, default=0)
     created_at = Column(String)
+    notification_id = Column(String, nullable=True, index=True)  # id da notificacao no OneSignal
+    # Metricas de entrega trazidas pelo job de app/push_metrics.py (clicks = aberturas)
+    delivered_count = Column(Integer, default=0)
+    failed_count = Column(Integer, default=0)
+    metrics_updated_at = Column(String, nullable=True)
+
+
+# ✅ Fila de envio de push (app/push_outbox.py) — rotas e jobs so enfileiram
+class PushOutbox(Base):
+    __tablename__ = "push_outbox"
+
+    id = Column(Integer, primary_key=True, index=True)
+    store_id = Column(String, index=True)
+    loja_id = Column(Integer, ForeignKey("lojas.id"), index=True, nullable=True)
+    app_id = Column(String, index=True)             # app OneSignal (token bucket por app)
+    tipo = Column(String)                           # campanha | pedido | carrinho
+    payload = Column(Text)                          # corpo do POST /notifications (JSON, sem credenciais)
+    push_history_id = Column(Integer, ForeignKey("push_history.id"), nullable=True)
+    status = Column(String, default="pendente", index=True)  # pendente | enviando | enviado | falhou
+    tentativas = Column(Integer, default=0)
+    proxima_tentativa_em = Column(String, index=True)
+    reservado_em = Column(String, nullable=True)
+    enviado_em = Column(String, nullable=True)
+    notification_id = Column(String, nullable=True)
+    erro = Column(Text, nullable=True)
+    criado_em = Column(String)
+
+
+# ✅ Espelho local dos subscribers do OneSignal (app/push_subscribers.py)
+# Distribuicao por pais/dispositivo das stats roda aqui, sobre a audiencia toda
+class PushSubscriber(Base):
+    __tablename__ = "push_subscribers"
+    __table_args__ = (
+        UniqueConstraint("store_id", "player_id", name="uq_push_subscribers_store_player"),
+        Index("ix_push_subscribers_store_pais", "store_id", "ativo", "country"),
+        Index("ix_push_subscribers_store_plataforma", "store_id", "ativo", "plataforma"),
+    )
+
+    id = Column(Integer, primary_key=True, index=True)
+    store_id = Column(String, index=True)
+    loja_id = Column(Integer, ForeignKey("lojas.id"), index=True, nullable=True)
+    player_id = Column(String)                      # id do subscriber no OneSignal
+    external_id = Column(String, nullable=True)
+    device_type = Column(Integer, nullable=True)
+    plataforma = Column(String, nullable=True)      # iOS | Android | Web
+    country = Column(String, nullable=True)
+    ativo = Column(Boolean, default=True)           # inscrito e com token valido
+    last_active = Column(String, nullable=True)
+    criado_em = Column(String, nullable=True)
+    sincronizado_em = Column(String, index=True)
+
+
+# Estado da sincronizacao do espelho, uma linha por loja
+class PushSubscriberSync(Base):
+    __tablename__ = "push_subscriber_sync"
+
+    id = Column(Integer, primary_key=True, index=True)
+    store_id = Column(String, unique=True, index=True)
+    app_id = Column(String, nullable=True)          # app sincronizado (trocou, recomeca do zero)
+    total = Column(Integer, default=0)
+    sincronizado_em = Column(String, nullable=True) # ultima sincronizacao concluida
+    completo_em = Column(String, nullable=True)     # ultima sincronizacao completa
+    csv_url = Column(Text, nullable=True)           # export CSV pedido e ainda nao importado
+    csv_desde = Column(Integer, nullable=True)      # last_active_since do export (None = completo)
+    csv_pedido_em = Column(String, nullable=True)
+    erro = Column(Text, nullable=True)
 
 
 class VariantEvent(Base):
@@ -112,6 +195,7 @@ class VariantEvent(Base):
 
     id = Column(Integer, primary_key=True, index=True)
     store_id = Column(String, index=True)
+    loja_id = Column(Integer, ForeignKey("lojas.id"), index=True, nullable=True)
     visitor_id = Column(String, index=True)
     product_id = Column(String, index=True)
     variant_id = Column(String, index=True)
@@ -159,6 +243,7 @@ class CarrinhoAbandonado(Base):
 
     id = Column(Integer, primary_key=True, index=True)
     store_id = Column(String, index=True)
+    loja_id = Column(Integer, ForeignKey("lojas.id"), index=True, nullable=True)
     visitor_id = Column(String, index=True)
     external_id = Column(String, nullable=True)  # e-mail do cliente (OneSignal login)
     cart_count = Column(Integer, default=0)       # qtd de itens no carrinho
@@ -167,5 +252,6 @@ class CarrinhoAbandonado(Base):
     job1_id = Column(String, nullable=True)       # ID do job APScheduler passo 1
     job2_id = Column(String, nullable=True)       # ID do job APScheduler passo 2
     job3_id = Column(String, nullable=True)       # ID do job APScheduler passo 3
+    passo_pendente = Column(Integer, nullable=True, index=True)  # passo devido, aguardando o envio em lote
     criado_em = Column(String, nullable=True)
     atualizado_em = Column(String, nullable=True)
@@ -1,8 +1,9 @@
 # app/services/onesignal_service.py
-import httpx
 import os
 import logging
 
+from app.http_client import onesignal_client
+
 logger = logging.getLogger(__name__)
 
 ONESIGNAL_USER_AUTH_KEY = os.getenv("ONESIGNAL_USER_AUTH_KEY")
@@ -44,12 +45,12 @@ async def criar_app_onesignal(
         "chrome_web_sub_domain": store_id,
     }
 
-    async with httpx.AsyncClient(timeout=15) as client:
-        resp = await client.post(
-            f"{BASE_URL}/apps",
-            headers=_headers(),
-            json=payload
-        )
+    client = onesignal_client()
+    resp = await client.post(
+        f"{BASE_URL}/apps",
+        headers=_headers(),
+        json=payload
+    )
 
     if resp.status_code not in (200, 201):
         logger.error(f"[OneSignal] Erro ao criar app para {store_id}: {resp.status_code} - {resp.text}")
@@ -77,11 +78,11 @@ async def deletar_app_onesignal(app_id: str) -> bool:
     if not app_id:
         return False
 
-    async with httpx.AsyncClient(timeout=15) as client:
-        resp = await client.delete(
-            f"{BASE_URL}/apps/{app_id}",
-            headers=_headers()
-        )
+    client = onesignal_client()
+    resp = await client.delete(
+        f"{BASE_URL}/apps/{app_id}",
+        headers=_headers()
+    )
 
     if resp.status_code in (200, 204):
         logger.info(f"[OneSignal] ✅ App {app_id} deletado")
@@ -124,12 +125,12 @@ async def enviar_notificacao(
     if imagem:
         payload["chrome_web_image"] = imagem
 
-    async with httpx.AsyncClient(timeout=15) as client:
-        resp = await client.post(
-            f"{BASE_URL}/notifications",
-            headers=headers,
-            json=payload
-        )
+    client = onesignal_client()
+    resp = await client.post(
+        f"{BASE_URL}/notifications",
+        headers=headers,
+        json=payload
+    )
 
     data = resp.json()
 
@@ -150,11 +151,11 @@ async def buscar_total_assinantes(app_id: str, api_key: str) -> int:
         "Accept": "application/json"
     }
 
-    async with httpx.AsyncClient(timeout=15) as client:
-        resp = await client.get(
-            f"{BASE_URL}/apps/{app_id}",
-            headers=headers
-        )
+    client = onesignal_client()
+    resp = await client.get(
+        f"{BASE_URL}/apps/{app_id}",
+        headers=headers
+    )
 
     if resp.status_code != 200:
         return 0
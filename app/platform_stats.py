@@ -0,0 +1,169 @@
+# app/platform_stats.py
+"""
+Metricas da plataforma inteira (todas as lojas), calculadas em paralelo.
+
+Cada worker recebe um shard de lojas e faz poucas queries agregadas
+(GROUP BY loja_id) sobre ele, em vez de rodar o dashboard loja por loja.
+O resultado sai em NDJSON: uma linha por loja, conforme os shards terminam,
+e uma linha final com o total da plataforma.
+
+Uso via CLI:
+    python -m app.platform_stats --workers 4 --shard-size 200
+"""
+import argparse
+import json
+import multiprocessing
+import os
+import sys
+import threading
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from typing import Optional
+
+from sqlalchemy import create_engine, func, distinct, case, cast, Float
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import NullPool
+
+from app.database import DATABASE_URL
+from app.models import Loja, VisitaApp, VendaApp, PushHistory
+
+PLATFORM_STATS_WORKERS = int(os.getenv("PLATFORM_STATS_WORKERS", "4"))
+PLATFORM_STATS_SHARD_SIZE = int(os.getenv("PLATFORM_STATS_SHARD_SIZE", "200"))
+# Limites do endpoint: roda no mesmo dyno que o servidor web
+PLATFORM_STATS_MAX_WORKERS = os.cpu_count() or 1
+PLATFORM_STATS_MIN_SHARD_SIZE = 50
+PLATFORM_STATS_MAX_SHARD_SIZE = 5000
+
+METRICAS = ("instalacoes", "visitas", "visitantes", "vendas", "receita", "pushes", "push_enviados")
+
+
+def _sessao(db_url: str):
+    # Cada processo abre sua propria conexao — nada de herdar pool do processo pai
+    engine = create_engine(db_url, poolclass=NullPool)
+    return engine, sessionmaker(bind=engine)()
+
+
+def calcular_shard(db_url: str, lojas: list) -> list:
+    """Calcula as metricas de um shard de lojas [(loja_id, store_id), ...]."""
+    engine, db = _sessao(db_url)
+    try:
+        ids = [loja_id for loja_id, _ in lojas]
+        por_loja = {
+            loja_id: {"store_id": store_id, **{m: 0 for m in METRICAS}}
+            for loja_id, store_id in lojas
+        }
+
+        visitas = (
+            db.query(
+                VisitaApp.loja_id,
+                func.count(VisitaApp.id),
+                func.count(distinct(VisitaApp.visitor_id)),
+                func.count(distinct(case((VisitaApp.pagina == "install", VisitaApp.visitor_id)))),
+            )
+            .filter(VisitaApp.loja_id.in_(ids))
+            .group_by(VisitaApp.loja_id)
+            .all()
+        )
+        for loja_id, qtd, visitantes, instalacoes in visitas:
+            por_loja[loja_id].update(visitas=qtd, visitantes=visitantes, instalacoes=instalacoes)
+
+        vendas = (
+            db.query(
+                VendaApp.loja_id,
+                func.count(VendaApp.id),
+                func.coalesce(func.sum(cast(VendaApp.valor, Float)), 0),
+            )
+            .filter(VendaApp.loja_id.in_(ids))
+            .group_by(VendaApp.loja_id)
+            .all()
+        )
+        for loja_id, qtd, receita in vendas:
+            por_loja[loja_id].update(vendas=qtd, receita=round(float(receita), 2))
+
+        pushes = (
+            db.query(
+                PushHistory.loja_id,
+                func.count(PushHistory.id),
+                func.coalesce(func.sum(PushHistory.sent_count), 0),
+            )
+            .filter(PushHistory.loja_id.in_(ids))
+            .group_by(PushHistory.loja_id)
+            .all()
+        )
+        for loja_id, qtd, enviados in pushes:
+            por_loja[loja_id].update(pushes=qtd, push_enviados=int(enviados))
+
+        return list(por_loja.values())
+    finally:
+        db.close()
+        engine.dispose()
+
+
+def _listar_lojas(db_url: str) -> list:
+    engine, db = _sessao(db_url)
+    try:
+        return [(l.id, l.store_id) for l in db.query(Loja.id, Loja.store_id).order_by(Loja.id)]
+    finally:
+        db.close()
+        engine.dispose()
+
+
+def gerar_metricas_plataforma(
+    workers: int = PLATFORM_STATS_WORKERS,
+    shard_size: int = PLATFORM_STATS_SHARD_SIZE,
+    db_url: str = DATABASE_URL,
+    cancelado: Optional[threading.Event] = None,
+):
+    """
+    Gera as linhas do relatorio conforme os shards ficam prontos.
+    Com `cancelado` setado (cliente desconectou) para de esperar e descarta
+    os shards que ainda nao comecaram.
+    """
+    lojas = _listar_lojas(db_url)
+    shards = [lojas[i:i + shard_size] for i in range(0, len(lojas), shard_size)]
+    total = {m: 0 for m in METRICAS}
+    total["lojas"] = 0
+    shards_com_erro = 0
+
+    # "spawn": o servidor web tem threads (scheduler, uvicorn) e fork com threads e arriscado
+    ctx = multiprocessing.get_context("spawn")
+    pool = ProcessPoolExecutor(max_workers=max(1, workers), mp_context=ctx)
+    try:
+        pendentes = {pool.submit(calcular_shard, db_url, shard) for shard in shards}
+        while pendentes:
+            if cancelado is not None and cancelado.is_set():
+                print(f"[PLATFORM STATS] Cancelado com {len(pendentes)} shard(s) pendente(s)")
+                return
+            prontos, pendentes = wait(pendentes, timeout=1, return_when=FIRST_COMPLETED)
+            for futuro in prontos:
+                try:
+                    linhas = futuro.result()
+                except Exception as e:
+                    print(f"[PLATFORM STATS] Erro em shard: {e}")
+                    shards_com_erro += 1
+                    continue
+                for linha in linhas:
+                    total["lojas"] += 1
+                    for m in METRICAS:
+                        total[m] += linha[m]
+                    yield {"tipo": "loja", **linha}
+    finally:
+        # Nao segura a thread esperando shards que ninguem vai ler
+        pool.shutdown(wait=False, cancel_futures=True)
+
+    total["receita"] = round(total["receita"], 2)
+    yield {"tipo": "total", "shards": len(shards), "shards_com_erro": shards_com_erro, **total}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Metricas agregadas de todas as lojas (NDJSON).")
+    parser.add_argument("--workers", type=int, default=PLATFORM_STATS_WORKERS)
+    parser.add_argument("--shard-size", type=int, default=PLATFORM_STATS_SHARD_SIZE)
+    args = parser.parse_args(argv)
+
+    for linha in gerar_metricas_plataforma(args.workers, args.shard_size):
+        sys.stdout.write(json.dumps(linha) + "\n")
+        sys.stdout.flush()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,164 @@
+# app/push_metrics.py
+"""
+Metricas de entrega das campanhas (PushHistory) trazidas do OneSignal.
+
+O job sincronizar_metricas_push le, para cada app com campanhas recentes,
+a listagem de /notifications em paginas de 50 (uma chamada cobre 50
+campanhas) e grava entregues/abertos/falhas com UPDATE em lote por id.
+As lojas sao buscadas em paralelo no pool do cliente OneSignal.
+
+O painel le as metricas daqui (campanhas_recentes), sem chamar o OneSignal.
+"""
+import asyncio
+import os
+from datetime import datetime, timedelta
+from typing import Optional
+
+from sqlalchemy.orm import Session
+
+from app.database import SessionLocal
+from app.http_client import onesignal_client, run_no_loop_do_app
+from app.models import AppConfig, PushHistory
+from app.store_keys import get_loja_id, filtro_loja
+
+PUSH_METRICAS_SEGUNDOS = int(os.getenv("PUSH_METRICAS_SEGUNDOS", "300"))
+# Campanha mais velha que isso ja nao muda: sai da sincronizacao
+PUSH_METRICAS_JANELA_DIAS = int(os.getenv("PUSH_METRICAS_JANELA_DIAS", "7"))
+PUSH_METRICAS_PAGINA = 50          # limite da listagem de /notifications
+PUSH_METRICAS_MAX_PAGINAS = 10
+PUSH_METRICAS_CONCORRENCIA = 4
+CAMPANHAS_NO_PAINEL = 20
+
+
+async def _notificacoes_recentes(app_id: str, api_key: str, desde: float, ids: set) -> dict:
+    """notification_id -> metricas, paginando ate passar da janela ou achar todos os ids."""
+    encontradas = {}
+    for pagina in range(PUSH_METRICAS_MAX_PAGINAS):
+        resp = await onesignal_client().get(
+            "https://onesignal.com/api/v1/notifications",
+            headers={"Authorization": f"Basic {api_key}"},
+            params={"app_id": app_id, "limit": PUSH_METRICAS_PAGINA, "offset": pagina * PUSH_METRICAS_PAGINA},
+            timeout=20.0,
+        )
+        resp.raise_for_status()
+        notificacoes = resp.json().get("notifications", [])
+        for n in notificacoes:
+            if n.get("id") in ids:
+                encontradas[n["id"]] = {
+                    "delivered_count": n.get("successful", 0) or 0,
+                    "clicks": n.get("converted", 0) or 0,
+                    "failed_count": (n.get("failed", 0) or 0) + (n.get("errored", 0) or 0),
+                }
+        # Listagem vem da mais nova para a mais velha
+        if (
+            len(notificacoes) < PUSH_METRICAS_PAGINA
+            or len(encontradas) == len(ids)
+            or (notificacoes[-1].get("queued_at") or 0) < desde
+        ):
+            break
+    return encontradas
+
+
+async def _buscar_lojas(lojas: list, desde: float) -> list:
+    semaforo = asyncio.Semaphore(PUSH_METRICAS_CONCORRENCIA)
+
+    async def _uma(app_id, api_key, ids):
+        async with semaforo:
+            return await _notificacoes_recentes(app_id, api_key, desde, ids)
+
+    return await asyncio.gather(*(_uma(*loja[1:]) for loja in lojas), return_exceptions=True)
+
+
+def sincronizar_metricas_push():
+    """Job do APScheduler: atualiza as metricas das campanhas dos ultimos dias."""
+    db = SessionLocal()
+    try:
+        inicio_janela = datetime.now() - timedelta(days=PUSH_METRICAS_JANELA_DIAS)
+        campanhas = (
+            db.query(PushHistory.id, PushHistory.store_id, PushHistory.notification_id)
+            .filter(
+                PushHistory.notification_id.isnot(None),
+                PushHistory.created_at >= inicio_janela.isoformat(),
+            )
+            .all()
+        )
+        if not campanhas:
+            return
+
+        por_loja = {}
+        for hist_id, store_id, notification_id in campanhas:
+            por_loja.setdefault(store_id, {})[notification_id] = hist_id
+
+        credenciais = (
+            db.query(AppConfig.store_id, AppConfig.onesignal_app_id, AppConfig.onesignal_api_key)
+            .filter(AppConfig.store_id.in_(list(por_loja)))
+            .all()
+        )
+        lojas = [
+            (store_id, app_id, api_key, set(por_loja[store_id]))
+            for store_id, app_id, api_key in credenciais
+            if app_id and api_key
+        ]
+        if not lojas:
+            return
+
+        resultados = run_no_loop_do_app(lambda: _buscar_lojas(lojas, inicio_janela.timestamp()))
+
+        agora = datetime.now().isoformat()
+        mapeamentos = []
+        for (store_id, _, _, _), resultado in zip(lojas, resultados):
+            if isinstance(resultado, Exception):
+                print(f"[PUSH-METRICAS] Erro na loja {store_id}: {resultado}")
+                continue
+            for notification_id, metricas in resultado.items():
+                mapeamentos.append({
+                    "id": por_loja[store_id][notification_id],
+                    **metricas,
+                    "metrics_updated_at": agora,
+                })
+
+        if mapeamentos:
+            # UPDATE em lote pela chave primaria
+            db.bulk_update_mappings(PushHistory, mapeamentos)
+            db.commit()
+        print(f"[PUSH-METRICAS] {len(mapeamentos)} campanha(s) atualizada(s) em {len(lojas)} loja(s)")
+    except Exception as e:
+        db.rollback()
+        print(f"[PUSH-METRICAS] Erro na sincronizacao: {e}")
+    finally:
+        db.close()
+
+
+def _unix(iso: Optional[str]) -> int:
+    try:
+        return int(datetime.fromisoformat(iso).timestamp())
+    except (TypeError, ValueError):
+        return 0
+
+
+def campanhas_recentes(db: Session, store_id: str, limite: int = CAMPANHAS_NO_PAINEL) -> list:
+    """Ultimas campanhas da loja com metricas, no formato que o painel ja consumia."""
+    historico = (
+        db.query(PushHistory)
+        .filter(filtro_loja(PushHistory, store_id, get_loja_id(db, store_id)))
+        .order_by(PushHistory.id.desc())
+        .limit(limite)
+        .all()
+    )
+    campanhas = []
+    for h in historico:
+        # Antes da primeira sincronizacao so ha o recipients da resposta do envio
+        sent = h.delivered_count if h.metrics_updated_at else (h.sent_count or 0)
+        opened = h.clicks or 0
+        campanhas.append({
+            "id": h.notification_id or h.id,
+            "title": h.title or "",
+            "message": h.message or "",
+            "url": h.url or "/",
+            "sent": sent or 0,
+            "opened": opened,
+            "failed": h.failed_count or 0,
+            "taxa_abertura": round((opened / sent * 100), 1) if sent else 0,
+            "created_at": _unix(h.created_at),
+        })
+    return campanhas
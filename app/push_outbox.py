@@ -0,0 +1,292 @@
+# app/push_outbox.py
+"""
+Outbox de push: rotas, webhooks e jobs so gravam a notificacao em
+push_outbox; o envio ao OneSignal e feito pelo job despachar_outbox.
+
+- Reserva em lotes com FOR UPDATE SKIP LOCKED (varios workers nao pegam a
+  mesma linha); reserva abandonada (processo caiu) volta a fila.
+- Token bucket por app OneSignal: rajada de campanhas de uma loja nao
+  estoura o rate limit. Cada lote reserva no maximo OUTBOX_POR_APP_NO_LOTE
+  linhas por app, entao a fila grande de uma loja nao atrasa as outras.
+- 429 respeita o Retry-After (o app inteiro espera); 5xx/rede tentam de
+  novo com backoff exponencial com jitter; outros 4xx falham na hora.
+- Cada linha leva um idempotency_key fixo no payload: retry nunca vira
+  notificacao duplicada no OneSignal.
+"""
+import asyncio
+import json
+import os
+import random
+import threading
+import time
+import uuid
+from datetime import datetime, timedelta
+from email.utils import parsedate_to_datetime
+from typing import Optional
+
+from sqlalchemy import and_, or_, func
+from sqlalchemy.orm import Session
+
+from app.database import SessionLocal
+from app.http_client import onesignal_client, run_no_loop_do_app
+from app.models import AppConfig, PushHistory, PushOutbox
+from app.store_keys import get_loja_id
+
+ONESIGNAL_NOTIFICATIONS_URL = "https://onesignal.com/api/v1/notifications"
+
+OUTBOX_INTERVALO_SEGUNDOS = int(os.getenv("OUTBOX_INTERVALO_SEGUNDOS", "3"))
+OUTBOX_LOTE = int(os.getenv("OUTBOX_LOTE", "50"))
+# Linha "enviando" ha mais tempo que isso e de um worker que morreu
+OUTBOX_RESERVA_SEGUNDOS = 300
+OUTBOX_MAX_TENTATIVAS = 6
+OUTBOX_BACKOFF_BASE_SEGUNDOS = 10
+OUTBOX_BACKOFF_MAX_SEGUNDOS = 1800
+OUTBOX_RETRY_AFTER_PADRAO = 60
+
+# Token bucket por app OneSignal (por processo)
+OUTBOX_TAXA_POR_APP = float(os.getenv("OUTBOX_TAXA_POR_APP", "5"))        # envios/segundo
+OUTBOX_RAJADA_POR_APP = float(os.getenv("OUTBOX_RAJADA_POR_APP", "10"))
+# Teto de linhas de um mesmo app por lote: fila grande de uma loja nao
+# ocupa o lote inteiro (o bucket nao deixaria enviar mais que a rajada mesmo)
+OUTBOX_POR_APP_NO_LOTE = max(1, int(os.getenv("OUTBOX_POR_APP_NO_LOTE", str(int(OUTBOX_RAJADA_POR_APP)))))
+
+
+class TokenBucket:
+    def __init__(self, taxa: float, capacidade: float):
+        self.taxa = taxa
+        self.capacidade = capacidade
+        self.tokens = capacidade
+        self.atualizado = time.monotonic()
+
+    def consumir(self) -> float:
+        """Consome um token; sem token, devolve quantos segundos faltam para o proximo."""
+        agora = time.monotonic()
+        self.tokens = min(self.capacidade, self.tokens + (agora - self.atualizado) * self.taxa)
+        self.atualizado = agora
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return 0.0
+        return (1 - self.tokens) / self.taxa
+
+
+_lock = threading.Lock()
+_buckets = {}         # app_id -> TokenBucket
+_bloqueado_ate = {}   # app_id -> datetime (Retry-After de um 429)
+
+
+def _bucket(app_id: str) -> TokenBucket:
+    bucket = _buckets.get(app_id)
+    if bucket is None:
+        bucket = _buckets[app_id] = TokenBucket(OUTBOX_TAXA_POR_APP, OUTBOX_RAJADA_POR_APP)
+    return bucket
+
+
+def enfileirar_push(
+    db: Session,
+    store_id: str,
+    tipo: str,
+    payload: dict,
+    push_history_id: Optional[int] = None,
+) -> PushOutbox:
+    """Grava a notificacao na outbox (o commit fica com quem chamou)."""
+    agora = datetime.now().isoformat()
+    # Chave gerada uma vez por linha: se um retry repete um POST que o OneSignal
+    # ja aceitou (5xx/timeout depois do aceite, reserva expirada), ele devolve a
+    # mesma notificacao em vez de criar outra
+    payload = {**payload, "idempotency_key": payload.get("idempotency_key") or str(uuid.uuid4())}
+    item = PushOutbox(
+        store_id=store_id,
+        loja_id=get_loja_id(db, store_id),
+        app_id=payload.get("app_id"),
+        tipo=tipo,
+        payload=json.dumps(payload, ensure_ascii=False),
+        push_history_id=push_history_id,
+        status="pendente",
+        tentativas=0,
+        proxima_tentativa_em=agora,
+        criado_em=agora,
+    )
+    db.add(item)
+    db.flush()
+    return item
+
+
+def _backoff(tentativas: int) -> float:
+    # Exponencial com "equal jitter": metade fixa, metade aleatoria
+    teto = min(OUTBOX_BACKOFF_MAX_SEGUNDOS, OUTBOX_BACKOFF_BASE_SEGUNDOS * 2 ** max(0, tentativas - 1))
+    return teto / 2 + random.uniform(0, teto / 2)
+
+
+def _retry_after(valor: Optional[str]) -> float:
+    if not valor:
+        return OUTBOX_RETRY_AFTER_PADRAO
+    try:
+        return max(1.0, float(valor))
+    except ValueError:
+        pass
+    try:
+        # Formato HTTP-date
+        quando = parsedate_to_datetime(valor)
+        return max(1.0, (quando - datetime.now(quando.tzinfo)).total_seconds())
+    except Exception:
+        return OUTBOX_RETRY_AFTER_PADRAO
+
+
+def _reservar(db: Session, limite: int) -> list:
+    agora = datetime.now()
+    reserva_expirada = (agora - timedelta(seconds=OUTBOX_RESERVA_SEGUNDOS)).isoformat()
+    disponivel = or_(
+        and_(PushOutbox.status == "pendente", PushOutbox.proxima_tentativa_em <= agora.isoformat()),
+        and_(PushOutbox.status == "enviando", PushOutbox.reservado_em <= reserva_expirada),
+    )
+    # Ate OUTBOX_POR_APP_NO_LOTE linhas por app (as mais antigas de cada um)
+    posicao = func.row_number().over(partition_by=PushOutbox.app_id, order_by=PushOutbox.id).label("posicao")
+    candidatos = db.query(PushOutbox.id.label("id"), posicao).filter(disponivel).subquery()
+    ids = (
+        db.query(candidatos.c.id)
+        .filter(candidatos.c.posicao <= OUTBOX_POR_APP_NO_LOTE)
+        .order_by(candidatos.c.id)
+        .limit(limite)
+    )
+    # Window function nao combina com FOR UPDATE: a trava fica na query de fora,
+    # que confere a condicao de novo (outro worker pode ter pego a linha)
+    itens = (
+        db.query(PushOutbox)
+        .filter(PushOutbox.id.in_(ids.scalar_subquery()), disponivel)
+        .order_by(PushOutbox.id)
+        .with_for_update(skip_locked=True)
+        .all()
+    )
+    for item in itens:
+        item.status = "enviando"
+        item.reservado_em = agora.isoformat()
+    db.commit()
+    return itens
+
+
+def _adiar(item: PushOutbox, segundos: float, erro: Optional[str] = None, conta_tentativa: bool = False):
+    if conta_tentativa:
+        item.tentativas = (item.tentativas or 0) + 1
+        if item.tentativas >= OUTBOX_MAX_TENTATIVAS:
+            item.status = "falhou"
+            item.erro = erro
+            return
+    item.status = "pendente"
+    item.reservado_em = None
+    item.proxima_tentativa_em = (datetime.now() + timedelta(seconds=segundos)).isoformat()
+    if erro:
+        item.erro = erro
+
+
+async def _post(api_key: str, payload: str):
+    return await onesignal_client().post(
+        ONESIGNAL_NOTIFICATIONS_URL,
+        headers={
+            "Authorization": f"Basic {api_key}",
+            "Content-Type": "application/json",
+        },
+        content=payload.encode("utf-8"),
+    )
+
+
+async def _enviar_todos(envios: list):
+    return await asyncio.gather(*(_post(api_key, payload) for api_key, payload in envios), return_exceptions=True)
+
+
+def _registrar_envio(db: Session, item: PushOutbox, data: dict):
+    item.status = "enviado"
+    item.enviado_em = datetime.now().isoformat()
+    item.notification_id = data.get("id") or None
+    item.erro = json.dumps(data["errors"], ensure_ascii=False) if data.get("errors") else None
+    if item.push_history_id:
+        historico = db.query(PushHistory).filter(PushHistory.id == item.push_history_id).first()
+        if historico:
+            historico.notification_id = item.notification_id
+            historico.sent_count = data.get("recipients", 0) or 0
+
+
+def _processar_resposta(db: Session, item: PushOutbox, resposta):
+    if isinstance(resposta, Exception):
+        _adiar(item, _backoff((item.tentativas or 0) + 1), f"rede: {resposta}", conta_tentativa=True)
+        return
+
+    if resposta.status_code == 429:
+        espera = _retry_after(resposta.headers.get("Retry-After"))
+        with _lock:
+            _bloqueado_ate[item.app_id] = datetime.now() + timedelta(seconds=espera)
+        # Rate limit nao e falha do item: nao conta tentativa
+        _adiar(item, espera, "429 rate limit")
+        print(f"[OUTBOX] 429 no app {item.app_id} — pausado por {espera:.0f}s")
+        return
+
+    if resposta.status_code >= 500:
+        _adiar(item, _backoff((item.tentativas or 0) + 1), f"HTTP {resposta.status_code}", conta_tentativa=True)
+        return
+
+    try:
+        data = resposta.json()
+    except ValueError:
+        data = {}
+
+    if resposta.status_code >= 400:
+        # Payload/credencial invalidos: repetir nao resolve
+        item.status = "falhou"
+        item.erro = f"HTTP {resposta.status_code}: {resposta.text[:500]}"
+        return
+
+    _registrar_envio(db, item, data)
+
+
+def despachar_outbox(limite: int = OUTBOX_LOTE) -> int:
+    """Job do APScheduler: envia um lote da outbox. Devolve quantos foram ao OneSignal."""
+    db = SessionLocal()
+    try:
+        itens = _reservar(db, limite)
+        if not itens:
+            return 0
+
+        credenciais = {}
+        envios, enviados = [], []
+        agora = datetime.now()
+        for item in itens:
+            if item.store_id not in credenciais:
+                config = db.query(AppConfig).filter(AppConfig.store_id == item.store_id).first()
+                credenciais[item.store_id] = getattr(config, "onesignal_api_key", None)
+            api_key = credenciais[item.store_id]
+            if not api_key or not item.app_id:
+                item.status = "falhou"
+                item.erro = "OneSignal nao configurado"
+                continue
+
+            with _lock:
+                bloqueado_ate = _bloqueado_ate.get(item.app_id)
+                if bloqueado_ate and bloqueado_ate > agora:
+                    espera = (bloqueado_ate - agora).total_seconds()
+                else:
+                    espera = _bucket(item.app_id).consumir()
+            if espera:
+                # Nunca antes do proximo tick: sem isso a linha volta a frente
+                # da fila a cada rodada e so gasta reserva/commit
+                _adiar(item, max(espera, OUTBOX_INTERVALO_SEGUNDOS))
+                continue
+
+            envios.append((api_key, item.payload))
+            enviados.append(item)
+        db.commit()
+
+        if envios:
+            respostas = run_no_loop_do_app(lambda: _enviar_todos(envios))
+            for item, resposta in zip(enviados, respostas):
+                _processar_resposta(db, item, resposta)
+            db.commit()
+
+        falhas = sum(1 for item in itens if item.status == "falhou")
+        if falhas:
+            print(f"[OUTBOX] {falhas} push(es) sem envio definitivo neste lote")
+        return len(envios)
+    except Exception as e:
+        db.rollback()
+        print(f"[OUTBOX] Erro no despacho: {e}")
+        return 0
+    finally:
+        db.close()
@@ -0,0 +1,238 @@
+# app/push_stats.py
+"""
+Cache das stats de push do painel (/push/stats).
+
+Montar as stats custa chamadas ao OneSignal (app e, sem o espelho de
+subscribers, a amostra de players) mais um count(distinct) de instalacoes.
+O resultado fica em memoria por loja; o painel le sempre do cache e o job
+atualizar_push_stats do APScheduler renova as lojas que estao com o painel
+aberto. As campanhas vem do banco a cada request (app/push_metrics.py).
+
+- So o primeiro acesso da loja (ou troca de app OneSignal) espera o OneSignal.
+- Se a renovacao falha, o valor antigo continua sendo servido, com o
+  horario da ultima atualizacao boa e o erro.
+- Falha no primeiro acesso tambem fica em cache (stats vazias + erro) e o job
+  tenta de novo depois de PUSH_STATS_ERRO_TTL_SECONDS: OneSignal fora do ar
+  ou api key invalida nao seguram um thread por request.
+- Loja que ninguem consulta ha PUSH_STATS_INATIVA_SEGUNDOS sai do cache.
+"""
+import asyncio
+import os
+import threading
+import time
+from collections import Counter
+from datetime import datetime
+from typing import Optional
+
+from sqlalchemy import func, distinct
+from sqlalchemy.orm import Session
+
+from app.database import SessionLocal
+from app.http_client import onesignal_client, run_no_loop_do_app
+from app.models import AppConfig, VisitaApp
+from app.push_metrics import campanhas_recentes
+from app.push_subscribers import distribuicao, espelho_sincronizado, plataforma
+from app.store_keys import get_loja_id, filtro_loja
+
+PUSH_STATS_TTL_SECONDS = int(os.getenv("PUSH_STATS_TTL_SECONDS", "300"))
+PUSH_STATS_REFRESH_SECONDS = int(os.getenv("PUSH_STATS_REFRESH_SECONDS", "60"))
+PUSH_STATS_INATIVA_SEGUNDOS = int(os.getenv("PUSH_STATS_INATIVA_SEGUNDOS", "1800"))
+PUSH_STATS_ERRO_TTL_SECONDS = int(os.getenv("PUSH_STATS_ERRO_TTL_SECONDS", "60"))
+PUSH_STATS_TIMEOUT = 20.0
+
+STATS_VAZIAS = {
+    "subscribers": 0,
+    "active_subscribers": 0,
+    "instalacoes": 0,
+    "taxa_optin": 0,
+    "por_pais": [],
+    "por_dispositivo": [],
+    "notifications": [],
+}
+
+
+class _Entrada:
+    def __init__(self, app_id: str, stats: dict, erro: Optional[str] = None):
+        self.app_id = app_id
+        self.stats = stats
+        # Sem nenhuma atualizacao boa ainda (falha no primeiro acesso): None
+        self.atualizado_em = None if erro else datetime.now().isoformat()
+        self.renovado = time.monotonic()
+        self.consultado = time.monotonic()
+        self.erro = erro
+
+    def vencida(self, agora: float) -> bool:
+        ttl = PUSH_STATS_ERRO_TTL_SECONDS if self.erro else PUSH_STATS_TTL_SECONDS
+        return agora - self.renovado >= ttl
+
+
+_lock = threading.Lock()
+_cache = {}  # store_id -> _Entrada
+
+
+async def _get_json(url: str, api_key: str, params: Optional[dict] = None) -> dict:
+    resp = await onesignal_client().get(
+        url,
+        headers={"Authorization": f"Basic {api_key}"},
+        params=params,
+        timeout=PUSH_STATS_TIMEOUT,
+    )
+    resp.raise_for_status()
+    return resp.json()
+
+
+async def _sem_amostra() -> dict:
+    return {}
+
+
+async def buscar_onesignal(app_id: str, api_key: str, amostra: bool = True) -> dict:
+    """
+    Chamadas ao OneSignal, em paralelo, ja formatadas para o painel.
+    Com o espelho de subscribers sincronizado (amostra=False) a distribuicao
+    sai do banco e a amostra de /players nao e buscada.
+    """
+    app_data, players_data = await asyncio.gather(
+        # Dados gerais do app
+        _get_json(f"https://onesignal.com/api/v1/apps/{app_id}", api_key),
+        # Amostra de subscribers (primeiros 300) enquanto nao ha espelho local
+        _get_json("https://onesignal.com/api/v1/players", api_key, {"app_id": app_id, "limit": 300})
+        if amostra else _sem_amostra(),
+    )
+
+    # ✅ Distribuição por país e dispositivo
+    players = players_data.get("players", [])
+    paises = Counter()
+    dispositivos = Counter()
+    for p in players:
+        country = (p.get("country") or "").upper()
+        if country:
+            paises[country] += 1
+        dispositivos[plataforma(p.get("device_type"))] += 1
+
+    total_players = len(players) or 1
+    por_pais = [
+        {"pais": k, "count": v, "pct": round(v / total_players * 100, 1)}
+        for k, v in paises.most_common(5)
+    ]
+    por_dispositivo = [
+        {"dispositivo": k, "count": v, "pct": round(v / total_players * 100, 1)}
+        for k, v in dispositivos.most_common()
+    ]
+
+    return {
+        "subscribers": app_data.get("players", 0),
+        "active_subscribers": app_data.get("messageable_players", 0),
+        "por_pais": por_pais,
+        "por_dispositivo": por_dispositivo,
+    }
+
+
+def _com_dados_locais(db: Session, store_id: str, onesignal: dict) -> dict:
+    if espelho_sincronizado(db, store_id):
+        # ✅ Distribuicao sobre a audiencia toda (push_subscribers)
+        por_pais, por_dispositivo = distribuicao(db, store_id)
+        onesignal = {**onesignal, "por_pais": por_pais, "por_dispositivo": por_dispositivo}
+
+    # Taxa de opt-in
+    instalacoes = (
+        db.query(func.count(distinct(VisitaApp.visitor_id)))
+        .filter(
+            filtro_loja(VisitaApp, store_id, get_loja_id(db, store_id)),
+            VisitaApp.is_pwa == True,
+            VisitaApp.pagina == "install",
+        )
+        .scalar() or 0
+    )
+    ativos = onesignal.get("active_subscribers", 0) or 0
+    return {
+        **onesignal,
+        "instalacoes": instalacoes,
+        "taxa_optin": round((ativos / instalacoes * 100), 1) if instalacoes > 0 else 0,
+    }
+
+
+def _gravar(store_id: str, app_id: str, stats: dict):
+    with _lock:
+        anterior = _cache.get(store_id)
+        entrada = _Entrada(app_id, stats)
+        if anterior is not None:
+            entrada.consultado = anterior.consultado
+        _cache[store_id] = entrada
+
+
+def _resposta(entrada: _Entrada, notifications: list) -> dict:
+    return {
+        **entrada.stats,
+        "notifications": notifications,
+        "atualizado_em": entrada.atualizado_em,
+        "desatualizado": entrada.erro is not None,
+        "erro": entrada.erro,
+    }
+
+
+def stats_da_loja(db: Session, store_id: str, app_id: str, api_key: str) -> dict:
+    """
+    Stats do cache; so espera o OneSignal quando a loja ainda nao tem nada em cache.
+    Sincrono (roda no threadpool): as queries nao travam o loop do app, onde
+    a chamada ao OneSignal e executada via run_no_loop_do_app.
+    """
+    # Campanhas e metricas ja estao no banco (app/push_metrics.py): sempre frescas
+    notifications = campanhas_recentes(db, store_id)
+    with _lock:
+        entrada = _cache.get(store_id)
+        if entrada is not None and entrada.app_id == app_id:
+            entrada.consultado = time.monotonic()
+            return _resposta(entrada, notifications)
+
+    try:
+        amostra = not espelho_sincronizado(db, store_id)
+        onesignal = run_no_loop_do_app(lambda: buscar_onesignal(app_id, api_key, amostra), timeout=PUSH_STATS_TIMEOUT * 2)
+        stats = _com_dados_locais(db, store_id, onesignal)
+    except Exception as e:
+        db.rollback()
+        print(f"[PUSH-STATS] Erro ao buscar stats da loja {store_id}: {e}")
+        # ✅ Falha tambem vai para o cache: os proximos acessos respondem na hora
+        entrada = _Entrada(app_id, STATS_VAZIAS, erro=str(e) or e.__class__.__name__)
+        with _lock:
+            _cache[store_id] = entrada
+        return _resposta(entrada, notifications)
+
+    _gravar(store_id, app_id, stats)
+    return _resposta(_cache[store_id], notifications)
+
+
+def atualizar_push_stats():
+    """Job do APScheduler: renova as lojas vencidas que tiveram o painel aberto."""
+    agora = time.monotonic()
+    with _lock:
+        for store_id in [s for s, e in _cache.items() if agora - e.consultado > PUSH_STATS_INATIVA_SEGUNDOS]:
+            del _cache[store_id]
+        vencidas = [s for s, e in _cache.items() if e.vencida(agora)]
+    if not vencidas:
+        return
+
+    db = SessionLocal()
+    try:
+        for store_id in vencidas:
+            config = db.query(AppConfig).filter(AppConfig.store_id == store_id).first()
+            app_id = getattr(config, "onesignal_app_id", None)
+            api_key = getattr(config, "onesignal_api_key", None)
+            if not app_id or not api_key:
+                with _lock:
+                    _cache.pop(store_id, None)
+                continue
+            try:
+                amostra = not espelho_sincronizado(db, store_id)
+                onesignal = run_no_loop_do_app(lambda: buscar_onesignal(app_id, api_key, amostra))
+                _gravar(store_id, app_id, _com_dados_locais(db, store_id, onesignal))
+            except Exception as e:
+                db.rollback()
+                # Mantem o valor antigo; tenta de novo so no proximo TTL
+                with _lock:
+                    entrada = _cache.get(store_id)
+                    if entrada is not None:
+                        entrada.erro = str(e) or e.__class__.__name__
+                        entrada.renovado = time.monotonic()
+                print(f"[PUSH-STATS] Erro ao renovar stats da loja {store_id}: {e}")
+    finally:
+        db.close()
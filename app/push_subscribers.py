@@ -0,0 +1,424 @@
+# app/push_subscribers.py
+"""
+Espelho local dos subscribers do OneSignal (tabela push_subscribers).
+
+A distribuicao por pais e dispositivo das stats era calculada sobre os
+primeiros 300 players da API; agora roda em SQL sobre a audiencia toda.
+O job sincronizar_subscribers mantem o espelho:
+
+- Sincronizacao completa (primeira vez, troca de app, e a cada
+  SUBSCRIBERS_COMPLETO_DIAS): paginas de /players buscadas em paralelo;
+  app grande demais para paginar vai pelo export CSV completo. Quem nao
+  apareceu na sincronizacao completa sai do espelho (se o total_count mudou
+  durante a paginacao, so sai quem tambem nao apareceu desde a anterior).
+- Incremental (a cada SUBSCRIBERS_INCREMENTAL_SEGUNDOS): export CSV com
+  last_active_since, so os subscribers que mudaram.
+
+O export CSV e gerado pelo OneSignal em background: o job pede o arquivo,
+guarda a URL em push_subscriber_sync e importa numa rodada seguinte,
+quando o arquivo ja estiver pronto.
+"""
+import asyncio
+import csv
+import gzip
+import io
+import os
+import tempfile
+from datetime import datetime, timedelta, timezone
+from typing import Optional
+
+import requests
+from sqlalchemy import func
+from sqlalchemy.orm import Session
+
+from app.database import SessionLocal
+from app.http_client import onesignal_client, run_no_loop_do_app
+from app.models import AppConfig, PushSubscriber, PushSubscriberSync
+from app.store_keys import get_loja_id
+
+ONESIGNAL_API = "https://onesignal.com/api/v1"
+
+SUBSCRIBERS_SYNC_SEGUNDOS = int(os.getenv("SUBSCRIBERS_SYNC_SEGUNDOS", "900"))
+SUBSCRIBERS_INCREMENTAL_SEGUNDOS = int(os.getenv("SUBSCRIBERS_INCREMENTAL_SEGUNDOS", "3600"))
+SUBSCRIBERS_COMPLETO_DIAS = int(os.getenv("SUBSCRIBERS_COMPLETO_DIAS", "7"))
+# Acima disso a API de /players nao pagina: vai pelo export CSV
+SUBSCRIBERS_PAGINACAO_MAX = int(os.getenv("SUBSCRIBERS_PAGINACAO_MAX", "80000"))
+SUBSCRIBERS_CONCORRENCIA = int(os.getenv("SUBSCRIBERS_CONCORRENCIA", "4"))
+SUBSCRIBERS_PAGINA = 300                 # limite da API de /players
+SUBSCRIBERS_PAGINAS_POR_RODADA = 40      # paginas em memoria antes de gravar
+SUBSCRIBERS_LOTE_DB = 1000
+# Sobreposicao do last_active_since: relogio do OneSignal x o nosso
+SUBSCRIBERS_MARGEM_SEGUNDOS = 3600
+# Export que nao ficou pronto nesse tempo e descartado (pede de novo)
+SUBSCRIBERS_CSV_ESPERA_MAX_SEGUNDOS = 3600
+SUBSCRIBERS_CSV_MAX_BYTES = int(os.getenv("SUBSCRIBERS_CSV_MAX_BYTES", str(2 * 1024 * 1024 * 1024)))
+CSV_EXTRA_FIELDS = ["country", "notification_types", "external_user_id"]
+JOB_TIMEOUT_SECONDS = 600
+
+
+def plataforma(device_type) -> str:
+    """Simplifica o device_type do OneSignal para iOS/Android/Web."""
+    try:
+        device_type = int(device_type)
+    except (TypeError, ValueError):
+        return "Web"
+    if device_type == 0:
+        return "iOS"
+    if device_type in (1, 2):  # Android, Amazon
+        return "Android"
+    return "Web"
+
+
+def _ativo(invalid_identifier, notification_types) -> bool:
+    # notification_types negativo = desinscrito/sem permissao
+    if invalid_identifier in (True, "t", "true", "1", 1):
+        return False
+    try:
+        return notification_types in (None, "") or int(notification_types) > 0
+    except (TypeError, ValueError):
+        return True
+
+
+def _iso_unix(ts) -> Optional[str]:
+    try:
+        return datetime.fromtimestamp(int(ts)).isoformat()
+    except (TypeError, ValueError, OverflowError, OSError):
+        return None
+
+
+def _iso_csv(texto: Optional[str]) -> Optional[str]:
+    # CSV do OneSignal: "2024-05-12 23:45:17" em UTC
+    if not texto:
+        return None
+    try:
+        utc = datetime.strptime(texto[:19], "%Y-%m-%d %H:%M:%S").replace(tzinfo=timezone.utc)
+    except ValueError:
+        return None
+    return utc.astimezone().replace(tzinfo=None).isoformat()
+
+
+def _linha_api(p: dict) -> dict:
+    return {
+        "player_id": p.get("id"),
+        "external_id": p.get("external_user_id") or None,
+        "device_type": p.get("device_type"),
+        "plataforma": plataforma(p.get("device_type")),
+        "country": (p.get("country") or "").upper() or None,
+        "ativo": _ativo(p.get("invalid_identifier"), p.get("notification_types")),
+        "last_active": _iso_unix(p.get("last_active")),
+        "criado_em": _iso_unix(p.get("created_at")),
+    }
+
+
+def _linha_csv(row: dict) -> dict:
+    try:
+        device_type = int(row.get("device_type"))
+    except (TypeError, ValueError):
+        device_type = None
+    return {
+        "player_id": row.get("id"),
+        "external_id": row.get("external_user_id") or None,
+        "device_type": device_type,
+        "plataforma": plataforma(device_type),
+        "country": (row.get("country") or "").upper() or None,
+        "ativo": _ativo(row.get("invalid_identifier"), row.get("notification_types")),
+        "last_active": _iso_csv(row.get("last_active")),
+        "criado_em": _iso_csv(row.get("created_at")),
+    }
+
+
+def _gravar(db: Session, store_id: str, loja_id: Optional[int], linhas: list, agora: str):
+    """Upsert de um lote no espelho (por store_id + player_id)."""
+    por_player = {l["player_id"]: l for l in linhas if l.get("player_id")}
+    if not por_player:
+        return
+    existentes = dict(
+        db.query(PushSubscriber.player_id, PushSubscriber.id)
+        .filter(PushSubscriber.store_id == store_id, PushSubscriber.player_id.in_(list(por_player)))
+        .all()
+    )
+    novos, alterados = [], []
+    for player_id, linha in por_player.items():
+        linha = {**linha, "store_id": store_id, "loja_id": loja_id, "sincronizado_em": agora}
+        if player_id in existentes:
+            alterados.append({"id": existentes[player_id], **linha})
+        else:
+            novos.append(linha)
+    if novos:
+        db.bulk_insert_mappings(PushSubscriber, novos)
+    if alterados:
+        db.bulk_update_mappings(PushSubscriber, alterados)
+
+
+def _gravar_em_lotes(db: Session, store_id: str, loja_id: Optional[int], linhas, agora: str) -> int:
+    total, lote = 0, []
+    for linha in linhas:
+        lote.append(linha)
+        if len(lote) >= SUBSCRIBERS_LOTE_DB:
+            _gravar(db, store_id, loja_id, lote, agora)
+            db.commit()
+            total += len(lote)
+            lote = []
+    if lote:
+        _gravar(db, store_id, loja_id, lote, agora)
+        db.commit()
+        total += len(lote)
+    return total
+
+
+def _remover_nao_vistos(db: Session, store_id: str, inicio: str):
+    db.query(PushSubscriber).filter(
+        PushSubscriber.store_id == store_id,
+        PushSubscriber.sincronizado_em < inicio,
+    ).delete(synchronize_session=False)
+
+
+# =============================================
+# API do OneSignal
+# =============================================
+
+async def _pagina(app_id: str, api_key: str, offset: int) -> dict:
+    resp = await onesignal_client().get(
+        f"{ONESIGNAL_API}/players",
+        headers={"Authorization": f"Basic {api_key}"},
+        params={"app_id": app_id, "limit": SUBSCRIBERS_PAGINA, "offset": offset},
+        timeout=30.0,
+    )
+    resp.raise_for_status()
+    return resp.json()
+
+
+async def _paginas(app_id: str, api_key: str, offsets: list) -> list:
+    semaforo = asyncio.Semaphore(SUBSCRIBERS_CONCORRENCIA)
+
+    async def _uma(offset):
+        async with semaforo:
+            return await _pagina(app_id, api_key, offset)
+
+    return await asyncio.gather(*(_uma(offset) for offset in offsets))
+
+
+async def _pedir_csv(app_id: str, api_key: str, desde: Optional[int]) -> str:
+    body = {"extra_fields": CSV_EXTRA_FIELDS}
+    if desde is not None:
+        body["last_active_since"] = str(desde)
+    resp = await onesignal_client().post(
+        f"{ONESIGNAL_API}/players/csv_export",
+        headers={"Authorization": f"Basic {api_key}", "Content-Type": "application/json"},
+        params={"app_id": app_id},
+        json=body,
+        timeout=30.0,
+    )
+    resp.raise_for_status()
+    url = resp.json().get("csv_file_url")
+    if not url:
+        raise ValueError("OneSignal nao devolveu csv_file_url")
+    return url
+
+
+def _baixar_csv(url: str) -> Optional[str]:
+    """Baixa o export para um arquivo temporario; None se ainda nao esta pronto."""
+    with requests.get(url, timeout=60, stream=True) as resp:
+        if resp.status_code in (403, 404):
+            return None
+        resp.raise_for_status()
+        fd, path = tempfile.mkstemp(prefix="onesignal-", suffix=".csv")
+        baixados = 0
+        try:
+            with os.fdopen(fd, "wb") as f:
+                for chunk in resp.iter_content(1024 * 1024):
+                    baixados += len(chunk)
+                    if baixados > SUBSCRIBERS_CSV_MAX_BYTES:
+                        raise ValueError("export CSV muito grande")
+                    f.write(chunk)
+        except Exception:
+            os.remove(path)
+            raise
+    return path
+
+
+def _ler_csv(path: str):
+    with open(path, "rb") as f:
+        comprimido = f.read(2) == b"\x1f\x8b"
+    bruto = gzip.open(path, "rb") if comprimido else open(path, "rb")
+    with bruto, io.TextIOWrapper(bruto, encoding="utf-8", newline="") as texto:
+        for row in csv.DictReader(texto):
+            yield _linha_csv(row)
+
+
+# =============================================
+# SINCRONIZACAO — job de intervalo do APScheduler
+# =============================================
+
+def _sincronizar_paginado(db: Session, estado: PushSubscriberSync, app_id: str, api_key: str,
+                          primeira: dict, loja_id: Optional[int], inicio: str):
+    total = primeira.get("total_count", 0) or 0
+    _gravar_em_lotes(db, estado.store_id, loja_id, (_linha_api(p) for p in primeira.get("players", [])), inicio)
+
+    offsets = list(range(SUBSCRIBERS_PAGINA, total, SUBSCRIBERS_PAGINA))
+    audiencia_mudou = False
+    for i in range(0, len(offsets), SUBSCRIBERS_PAGINAS_POR_RODADA):
+        rodada = offsets[i:i + SUBSCRIBERS_PAGINAS_POR_RODADA]
+        paginas = run_no_loop_do_app(lambda: _paginas(app_id, api_key, rodada), timeout=JOB_TIMEOUT_SECONDS)
+        audiencia_mudou = audiencia_mudou or any(
+            (pagina.get("total_count", 0) or 0) != total for pagina in paginas
+        )
+        linhas = (_linha_api(p) for pagina in paginas for p in pagina.get("players", []))
+        _gravar_em_lotes(db, estado.store_id, loja_id, linhas, inicio)
+
+    if not audiencia_mudou:
+        _remover_nao_vistos(db, estado.store_id, inicio)
+    elif estado.completo_em:
+        # Paginacao por offset com a audiencia mudando pula players entre paginas:
+        # so sai quem tambem nao apareceu desde a sincronizacao completa anterior
+        _remover_nao_vistos(db, estado.store_id, estado.completo_em)
+        print(f"[SUBSCRIBERS] Loja {estado.store_id}: audiencia mudou durante a paginacao;"
+              f" removidos so os nao vistos desde {estado.completo_em}")
+    estado.completo_em = estado.sincronizado_em = inicio
+    estado.total = total
+    estado.erro = None
+    db.commit()
+    print(f"[SUBSCRIBERS] Loja {estado.store_id}: {total} subscribers sincronizados (paginado)")
+
+
+def _importar_csv(db: Session, estado: PushSubscriberSync, loja_id: Optional[int]) -> bool:
+    """Importa o export pendente. False se o OneSignal ainda esta gerando o arquivo."""
+    path = _baixar_csv(estado.csv_url)
+    if path is None:
+        pedido_em = datetime.fromisoformat(estado.csv_pedido_em)
+        if datetime.now() - pedido_em > timedelta(seconds=SUBSCRIBERS_CSV_ESPERA_MAX_SEGUNDOS):
+            estado.csv_url = None
+            estado.erro = "export CSV nao ficou pronto"
+            db.commit()
+        return False
+
+    # O export reflete o momento do pedido: e dai que o proximo incremental parte
+    marco = estado.csv_pedido_em
+    try:
+        importados = _gravar_em_lotes(db, estado.store_id, loja_id, _ler_csv(path), marco)
+    finally:
+        os.remove(path)
+
+    completo = estado.csv_desde is None
+    if completo:
+        _remover_nao_vistos(db, estado.store_id, marco)
+        estado.completo_em = marco
+    estado.sincronizado_em = marco
+    estado.csv_url = estado.csv_desde = estado.csv_pedido_em = None
+    estado.total = (
+        db.query(func.count(PushSubscriber.id)).filter(PushSubscriber.store_id == estado.store_id).scalar() or 0
+    )
+    estado.erro = None
+    db.commit()
+    print(f"[SUBSCRIBERS] Loja {estado.store_id}: {importados} subscribers importados do CSV"
+          f" ({'completo' if completo else 'incremental'})")
+    return True
+
+
+def _solicitar_csv(db: Session, estado: PushSubscriberSync, app_id: str, api_key: str, desde: Optional[int]):
+    agora = datetime.now().isoformat()
+    estado.csv_url = run_no_loop_do_app(lambda: _pedir_csv(app_id, api_key, desde))
+    estado.csv_desde = desde
+    estado.csv_pedido_em = agora
+    db.commit()
+
+
+def sincronizar_loja(db: Session, store_id: str, app_id: str, api_key: str):
+    estado = db.query(PushSubscriberSync).filter(PushSubscriberSync.store_id == store_id).first()
+    if estado is None:
+        estado = PushSubscriberSync(store_id=store_id, app_id=app_id, total=0)
+        db.add(estado)
+    elif estado.app_id != app_id:
+        # App do OneSignal trocou: o espelho antigo nao vale mais
+        db.query(PushSubscriber).filter(PushSubscriber.store_id == store_id).delete(synchronize_session=False)
+        estado.app_id = app_id
+        estado.total = 0
+        estado.sincronizado_em = estado.completo_em = None
+        estado.csv_url = estado.csv_desde = estado.csv_pedido_em = None
+    db.commit()
+
+    loja_id = get_loja_id(db, store_id)
+    if estado.csv_url:
+        _importar_csv(db, estado, loja_id)
+        return
+
+    agora = datetime.now()
+    completo_vencido = (
+        not estado.completo_em
+        or agora - datetime.fromisoformat(estado.completo_em) > timedelta(days=SUBSCRIBERS_COMPLETO_DIAS)
+    )
+    if completo_vencido:
+        primeira = run_no_loop_do_app(lambda: _pagina(app_id, api_key, 0))
+        if (primeira.get("total_count", 0) or 0) <= SUBSCRIBERS_PAGINACAO_MAX:
+            _sincronizar_paginado(db, estado, app_id, api_key, primeira, loja_id, agora.isoformat())
+        else:
+            _solicitar_csv(db, estado, app_id, api_key, None)
+        return
+
+    if agora - datetime.fromisoformat(estado.sincronizado_em) >= timedelta(seconds=SUBSCRIBERS_INCREMENTAL_SEGUNDOS):
+        desde = int(datetime.fromisoformat(estado.sincronizado_em).timestamp()) - SUBSCRIBERS_MARGEM_SEGUNDOS
+        _solicitar_csv(db, estado, app_id, api_key, desde)
+
+
+def sincronizar_subscribers():
+    """Job do APScheduler: avanca a sincronizacao do espelho de cada loja com OneSignal."""
+    db = SessionLocal()
+    try:
+        lojas = (
+            db.query(AppConfig.store_id, AppConfig.onesignal_app_id, AppConfig.onesignal_api_key)
+            .filter(AppConfig.onesignal_app_id.isnot(None), AppConfig.onesignal_api_key.isnot(None))
+            .all()
+        )
+        for store_id, app_id, api_key in lojas:
+            if not app_id or not api_key:
+                continue
+            try:
+                sincronizar_loja(db, store_id, app_id, api_key)
+            except Exception as e:
+                db.rollback()
+                estado = db.query(PushSubscriberSync).filter(PushSubscriberSync.store_id == store_id).first()
+                if estado is not None:
+                    estado.erro = str(e)[:500]
+                    db.commit()
+                print(f"[SUBSCRIBERS] Erro ao sincronizar loja {store_id}: {e}")
+    finally:
+        db.close()
+
+
+# =============================================
+# CONSULTAS — usadas pelas stats de push
+# =============================================
+
+def espelho_sincronizado(db: Session, store_id: str) -> bool:
+    estado = db.query(PushSubscriberSync.completo_em).filter(PushSubscriberSync.store_id == store_id).first()
+    return bool(estado and estado.completo_em)
+
+
+def distribuicao(db: Session, store_id: str):
+    """(por_pais, por_dispositivo) dos subscribers ativos da loja, no formato do painel."""
+    base = db.query(PushSubscriber).filter(PushSubscriber.store_id == store_id, PushSubscriber.ativo == True)
+    total = base.count() or 1
+
+    paises = (
+        base.filter(PushSubscriber.country.isnot(None))
+        .with_entities(PushSubscriber.country, func.count(PushSubscriber.id))
+        .group_by(PushSubscriber.country)
+        .order_by(func.count(PushSubscriber.id).desc())
+        .limit(5)
+        .all()
+    )
+    dispositivos = (
+        base.with_entities(PushSubscriber.plataforma, func.count(PushSubscriber.id))
+        .group_by(PushSubscriber.plataforma)
+        .order_by(func.count(PushSubscriber.id).desc())
+        .all()
+    )
+    por_pais = [
+        {"pais": pais, "count": qtd, "pct": round(qtd / total * 100, 1)}
+        for pais, qtd in paises
+    ]
+    por_dispositivo = [
+        {"dispositivo": disp or "Web", "count": qtd, "pct": round(qtd / total * 100, 1)}
+        for disp, qtd in dispositivos
+    ]
+    return por_pais, por_dispositivo
@@ -0,0 +1,92 @@
+# app/query_budget.py
+import os
+import threading
+import time
+from collections import OrderedDict
+from sqlalchemy.exc import DBAPIError
+from sqlalchemy.orm import Session
+
+from app.database import set_statement_timeout
+
+DASHBOARD_STATEMENT_TIMEOUT_MS = int(os.getenv("DASHBOARD_STATEMENT_TIMEOUT_MS", "2000"))
+DASHBOARD_BUDGET_MS = int(os.getenv("DASHBOARD_BUDGET_MS", "6000"))
+
+# Fallback limitado: LRU com teto de entradas, e valor velho demais nao e servido
+DASHBOARD_FALLBACK_MAX_ENTRIES = int(os.getenv("DASHBOARD_FALLBACK_MAX_ENTRIES", "2000"))
+DASHBOARD_FALLBACK_TTL_SECONDS = int(os.getenv("DASHBOARD_FALLBACK_TTL_SECONDS", "3600"))
+
+# Ultimo valor completo de cada metrica por (endpoint, loja).
+# E o que devolvemos quando o orcamento estoura ou a query e cancelada.
+_ultimos_valores: OrderedDict = OrderedDict()  # (endpoint, loja) -> (atualizado_em, {metrica: valor})
+_lock = threading.Lock()
+
+
+def _valores_da_loja(chave) -> dict:
+    agora = time.monotonic()
+    with _lock:
+        entrada = _ultimos_valores.get(chave)
+        if entrada is None or agora - entrada[0] > DASHBOARD_FALLBACK_TTL_SECONDS:
+            entrada = (agora, {})
+        _ultimos_valores[chave] = entrada
+        _ultimos_valores.move_to_end(chave)
+        while len(_ultimos_valores) > DASHBOARD_FALLBACK_MAX_ENTRIES:
+            _ultimos_valores.popitem(last=False)
+        return entrada[1]
+
+
+def _guardar_valor(chave, valores: dict, nome: str, valor):
+    valores[nome] = valor
+    with _lock:
+        # Recoloca a entrada (pode ter sido expulsa do LRU durante o request)
+        _ultimos_valores[chave] = (time.monotonic(), valores)
+        _ultimos_valores.move_to_end(chave)
+        while len(_ultimos_valores) > DASHBOARD_FALLBACK_MAX_ENTRIES:
+            _ultimos_valores.popitem(last=False)
+
+
+class QueryBudget:
+    """
+    Orcamento de tempo de banco para um request.
+    Cada metrica roda com statement_timeout = min(timeout do endpoint, tempo restante).
+    Quando a query e cancelada ou o orcamento acabou, devolve o ultimo valor
+    conhecido (ou o padrao) e registra a metrica em `parciais`.
+    """
+
+    def __init__(
+        self,
+        db: Session,
+        endpoint: str,
+        store_id: str,
+        budget_ms: int = DASHBOARD_BUDGET_MS,
+        statement_timeout_ms: int = DASHBOARD_STATEMENT_TIMEOUT_MS,
+    ):
+        self.db = db
+        self.endpoint = endpoint
+        self.store_id = store_id
+        self.statement_timeout_ms = statement_timeout_ms
+        self.deadline = time.monotonic() + budget_ms / 1000
+        self.parciais = []
+        self._chave = (endpoint, store_id)
+        self._cache = _valores_da_loja(self._chave)
+
+    def restante_ms(self) -> int:
+        return int((self.deadline - time.monotonic()) * 1000)
+
+    def medir(self, nome: str, consulta, padrao=0):
+        restante = self.restante_ms()
+        if restante <= 0:
+            self.parciais.append(nome)
+            return self._cache.get(nome, padrao)
+
+        try:
+            set_statement_timeout(self.db, min(self.statement_timeout_ms, restante))
+            valor = consulta()
+        except DBAPIError as e:
+            # Query cancelada (timeout) ou erro — libera a transacao e segue degradado
+            self.db.rollback()
+            print(f"[BUDGET] {self.endpoint} loja {self.store_id}: '{nome}' parcial ({e.orig})")
+            self.parciais.append(nome)
+            return self._cache.get(nome, padrao)
+
+        _guardar_valor(self._chave, self._cache, nome, valor)
+        return valor
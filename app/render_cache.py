@@ -0,0 +1,212 @@
+# app/render_cache.py
+import os
+import gzip
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+from typing import Optional
+from fastapi import Request, Response
+
+# Dependencias opcionais: sem brotli serve so gzip; sem rjsmin serve o JS como esta
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+try:
+    import rjsmin
+except ImportError:
+    rjsmin = None
+
+# Rede de seguranca para quando houver mais de um processo: mesmo sem
+# invalidacao explicita, nenhuma entrada vive mais que isso
+RENDER_CACHE_TTL_SECONDS = int(os.getenv("RENDER_CACHE_TTL_SECONDS", "300"))
+
+# Teto de entradas por cache (LRU): a memoria nao cresce com o numero de lojas
+RENDER_CACHE_MAX_ENTRIES = int(os.getenv("RENDER_CACHE_MAX_ENTRIES", "5000"))
+# Locks de render em faixas fixas (hash da chave), nao um lock por chave
+_RENDER_LOCK_STRIPES = 64
+
+# Abaixo disso o header de compressao custa mais do que economiza
+COMPRESS_MIN_BYTES = int(os.getenv("COMPRESS_MIN_BYTES", "256"))
+
+# Ordem de preferencia quando o cliente aceita mais de um
+_ENCODINGS = ("br", "gzip")
+_ETAG_SUFIXOS = {"br": "-br", "gzip": "-gz"}
+
+_caches = []
+
+
+def minify_js(code: str) -> str:
+    """Minifica JS gerado (uma vez, no render)."""
+    if rjsmin is None:
+        return code
+    return rjsmin.jsmin(code)
+
+
+class RenderedAsset:
+    """
+    Resultado de um render (JS/JSON) pronto para servir, com hash do conteudo.
+    As versoes gzip/brotli sao geradas aqui, uma vez por render — o request
+    so escolhe qual mandar.
+    """
+
+    def __init__(self, content: str):
+        self.content = content
+        self.body = content.encode("utf-8")
+        digest = hashlib.sha256(self.body).hexdigest()
+        # version vai na URL (?v=...), etag no header — ambos mudam junto com o conteudo
+        self.version = digest[:12]
+        self.etag = f'"{digest[:32]}"'
+
+        self.encoded = {}  # encoding -> bytes
+        if len(self.body) >= COMPRESS_MIN_BYTES:
+            self.encoded["gzip"] = gzip.compress(self.body, compresslevel=9, mtime=0)
+            if brotli is not None:
+                self.encoded["br"] = brotli.compress(self.body, quality=11)
+
+    def etag_for(self, encoding: Optional[str]) -> str:
+        # ETag forte tem que mudar com a representacao, nao so com o conteudo
+        if not encoding:
+            return self.etag
+        return f'{self.etag[:-1]}{_ETAG_SUFIXOS[encoding]}"'
+
+
+class RenderCache:
+    """
+    Cache de renders por loja.
+
+    - Cada loja tem uma versao; invalidate() sobe a versao e descarta as entradas.
+    - Render de uma mesma chave e single-flight: em misses concorrentes so o
+      primeiro renderiza, os outros esperam e reaproveitam o resultado.
+    - Um render que comecou antes de uma invalidacao nao e gravado no cache.
+    - LRU com no maximo max_entries entradas; expiradas saem na gravacao.
+      Quem chama so deve usar o cache para lojas que existem (store_id vem
+      de URL publica).
+    """
+
+    def __init__(self, name: str, ttl_seconds: int = RENDER_CACHE_TTL_SECONDS,
+                 max_entries: int = RENDER_CACHE_MAX_ENTRIES):
+        self.name = name
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self._entries = OrderedDict()  # (store_id, key) -> (versao, criado_em, asset), LRU
+        self._versions = {}  # store_id -> versao (so lojas invalidadas, via admin/instalacao)
+        self._locks = [threading.Lock() for _ in range(_RENDER_LOCK_STRIPES)]
+        self._guard = threading.Lock()
+        _caches.append(self)
+
+    def _lookup(self, full_key, version):
+        with self._guard:
+            entry = self._entries.get(full_key)
+            if not entry:
+                return None
+            entry_version, created_at, asset = entry
+            if entry_version != version or time.monotonic() - created_at > self.ttl_seconds:
+                return None
+            self._entries.move_to_end(full_key)
+            return asset
+
+    def _lock_for(self, full_key):
+        return self._locks[hash(full_key) % _RENDER_LOCK_STRIPES]
+
+    def _store(self, full_key, version, asset):
+        # Chamado com self._guard
+        self._entries[full_key] = (version, time.monotonic(), asset)
+        self._entries.move_to_end(full_key)
+        if len(self._entries) > self.max_entries:
+            agora = time.monotonic()
+            for k in [k for k, e in self._entries.items() if agora - e[1] > self.ttl_seconds]:
+                del self._entries[k]
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def get(self, store_id: str, key, render) -> RenderedAsset:
+        full_key = (store_id, key)
+        asset = self._lookup(full_key, self._versions.get(store_id, 0))
+        if asset is not None:
+            return asset
+
+        with self._lock_for(full_key):
+            version = self._versions.get(store_id, 0)
+            asset = self._lookup(full_key, version)
+            if asset is not None:
+                return asset
+
+            asset = render()
+            with self._guard:
+                if self._versions.get(store_id, 0) == version:
+                    self._store(full_key, version, asset)
+            return asset
+
+    def invalidate(self, store_id: str):
+        with self._guard:
+            self._versions[store_id] = self._versions.get(store_id, 0) + 1
+            for full_key in [k for k in self._entries if k[0] == store_id]:
+                del self._entries[full_key]
+
+
+def invalidate_store(store_id: str):
+    """Descarta tudo que foi renderizado para a loja (loader, manifest, ...)."""
+    for cache in _caches:
+        cache.invalidate(store_id)
+
+
+def _etag_confere(if_none_match: str, etag: str) -> bool:
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    for candidato in if_none_match.split(","):
+        candidato = candidato.strip()
+        if candidato.startswith("W/"):
+            candidato = candidato[2:]
+        if candidato == etag:
+            return True
+    return False
+
+
+def _escolher_encoding(accept_encoding: str, disponiveis) -> Optional[str]:
+    """Melhor encoding pre-comprimido que o cliente aceita (q > 0), ou None."""
+    if not accept_encoding or not disponiveis:
+        return None
+    aceitos = {}
+    for parte in accept_encoding.lower().split(","):
+        nome, _, params = parte.strip().partition(";")
+        q = 1.0
+        params = params.strip()
+        if params.startswith("q="):
+            try:
+                q = float(params[2:])
+            except ValueError:
+                q = 0.0
+        aceitos[nome.strip()] = q
+    for encoding in _ENCODINGS:
+        if encoding in disponiveis and aceitos.get(encoding, aceitos.get("*", 0)) > 0:
+            return encoding
+    return None
+
+
+def asset_response(
+    request: Request,
+    asset: RenderedAsset,
+    media_type: str,
+    cache_control: str,
+    extra_headers: Optional[dict] = None,
+) -> Response:
+    """
+    Responde o asset com ETag forte; If-None-Match igual -> 304 sem corpo.
+    Escolhe a variante pre-comprimida pelo Accept-Encoding (sem comprimir no request).
+    """
+    encoding = _escolher_encoding(request.headers.get("accept-encoding", ""), asset.encoded)
+    etag = asset.etag_for(encoding)
+    headers = {"ETag": etag, "Cache-Control": cache_control, **(extra_headers or {})}
+    if asset.encoded:
+        headers["Vary"] = "Accept-Encoding"
+    if _etag_confere(request.headers.get("if-none-match", ""), etag):
+        return Response(status_code=304, headers=headers)
+    if encoding:
+        headers["Content-Encoding"] = encoding
+        return Response(content=asset.encoded[encoding], media_type=media_type, headers=headers)
+    return Response(content=asset.body, media_type=media_type, headers=headers)
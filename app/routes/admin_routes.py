@@ -1,4 +1,8 @@
-from fastapi import APIRouter, Depends
+import json
+import threading
+from fastapi import APIRouter, Depends, BackgroundTasks, Query
+from fastapi.responses import StreamingResponse
+from starlette.concurrency import iterate_in_threadpool
 from sqlalchemy.orm import Session
 from pydantic import BaseModel
 from typing import Optional
@@ -6,7 +10,16 @@ from typing import Optional
 from ..database import get_db
 from ..models import Loja, AppConfig
 from ..auth import get_current_store
-from ..services import create_landing_page_internal, sync_store_logo_from_nuvemshop
+from ..services import create_landing_page_internal, sync_store_logo_from_nuvemshop, atualizar_script_tag
+from ..security import validate_operator_token
+from ..platform_stats import (
+    gerar_metricas_plataforma,
+    PLATFORM_STATS_WORKERS,
+    PLATFORM_STATS_MAX_WORKERS,
+    PLATFORM_STATS_MIN_SHARD_SIZE,
+    PLATFORM_STATS_MAX_SHARD_SIZE,
+)
+from ..render_cache import invalidate_store
 
 router = APIRouter(prefix="/admin", tags=["Config"])
 
@@ -52,6 +65,9 @@ class ConfigPayload(BaseModel):
     onesignal_app_id: Optional[str] = None
     onesignal_api_key: Optional[str] = None
 
+    # ✅ Cache de navegacao do Service Worker: off | swr | app_shell
+    sw_navigation_strategy: Optional[str] = "off"
+
 
 def _normalize_fab_size(size: str | None) -> str:
     allowed = {"xs", "small", "medium", "large", "xl"}
@@ -61,6 +77,14 @@ def _normalize_fab_size(size: str | None) -> str:
     return s if s in allowed else "medium"
 
 
+def _normalize_sw_navigation_strategy(strategy: str | None) -> str:
+    allowed = {"off", "swr", "app_shell"}
+    if not strategy:
+        return "off"
+    s = str(strategy).lower()
+    return s if s in allowed else "off"
+
+
 def _normalize_topbar_size(size: str | None) -> str:
     allowed = {"xs", "small", "medium", "large", "xl"}
     if not size:
@@ -106,6 +130,7 @@ def get_config(
             "bottom_bar_icon_color": "#6B7280",
             "onesignal_app_id": "",
             "onesignal_api_key": "",
+            "sw_navigation_strategy": "off",
         }
 
     return {
@@ -138,6 +163,7 @@ def get_config(
         "bottom_bar_icon_color": getattr(config, "bottom_bar_icon_color", "#6B7280") or "#6B7280",
         "onesignal_app_id": getattr(config, "onesignal_app_id", "") or "",
         "onesignal_api_key": getattr(config, "onesignal_api_key", "") or "",
+        "sw_navigation_strategy": getattr(config, "sw_navigation_strategy", "off") or "off",
     }
 
 
@@ -164,6 +190,7 @@ def get_store_info(
 @router.post("/config")
 def save_config(
     payload: ConfigPayload,
+    background_tasks: BackgroundTasks,
     store_id: str = Depends(get_current_store),
     db: Session = Depends(get_db),
 ):
@@ -208,6 +235,9 @@ def save_config(
     config.bottom_bar_bg = payload.bottom_bar_bg
     config.bottom_bar_icon_color = payload.bottom_bar_icon_color
 
+    # Service Worker
+    config.sw_navigation_strategy = _normalize_sw_navigation_strategy(payload.sw_navigation_strategy)
+
     # ✅ OneSignal
     if payload.onesignal_app_id is not None:
         config.onesignal_app_id = payload.onesignal_app_id
@@ -215,6 +245,9 @@ def save_config(
         config.onesignal_api_key = payload.onesignal_api_key
 
     db.commit()
+    invalidate_store(store_id)
+    # ✅ Loader mudou -> script tag da Nuvemshop aponta para a nova versao
+    background_tasks.add_task(atualizar_script_tag, store_id)
     return {"status": "success"}
 
 
@@ -231,6 +264,34 @@ def manual_create_page(
     return {"status": "success"}
 
 
+# ✅ Visao da plataforma inteira — so para o time de operacao
+@router.get("/platform-stats", dependencies=[Depends(validate_operator_token)])
+def platform_stats(
+    workers: Optional[int] = Query(None, ge=1, le=PLATFORM_STATS_MAX_WORKERS),
+    shard_size: Optional[int] = Query(None, ge=PLATFORM_STATS_MIN_SHARD_SIZE, le=PLATFORM_STATS_MAX_SHARD_SIZE),
+):
+    """
+    Instalacoes, visitas, vendas e volume de push de todas as lojas.
+    Calculado em paralelo por shards de lojas; a resposta sai em NDJSON
+    (uma linha por loja e uma linha final com o total).
+    """
+    # Mesmo o padrao do env nao passa do numero de CPUs do dyno
+    kwargs = {"workers": min(workers or PLATFORM_STATS_WORKERS, PLATFORM_STATS_MAX_WORKERS)}
+    if shard_size:
+        kwargs["shard_size"] = shard_size
+    cancelado = threading.Event()
+
+    async def linhas():
+        try:
+            async for linha in iterate_in_threadpool(gerar_metricas_plataforma(cancelado=cancelado, **kwargs)):
+                yield json.dumps(linha) + "\n"
+        finally:
+            # ✅ Cliente desconectou (ou terminou): libera a thread e os shards pendentes
+            cancelado.set()
+
+    return StreamingResponse(linhas(), media_type="application/x-ndjson")
+
+
 # ✅ ROTA TEMPORÁRIA — salva API Key do OneSignal direto no banco
 # Remove após confirmar que o token está sendo gerado corretamente
 @router.get("/fix-onesignal")
@@ -246,6 +307,7 @@ def fix_onesignal(
     config.onesignal_app_id = app_id
     config.onesignal_api_key = api_key
     db.commit()
+    invalidate_store(store_id)
     return {
         "status": "ok",
         "store_id": store_id,
@@ -1,17 +1,36 @@
 import os
+import json
+import asyncio
 from fastapi import APIRouter, Depends, Request
+from fastapi.responses import StreamingResponse
 from sqlalchemy.orm import Session
 from sqlalchemy import func, distinct, desc
+from sqlalchemy.dialects import postgresql, sqlite
 from datetime import datetime, timedelta
-from pydantic import BaseModel
-from typing import Optional, Union
+from pydantic import BaseModel, Field, ValidationError
+from typing import List, Optional, Union
 
-from app.database import get_db
-from app.models import VendaApp, VisitaApp, VariantEvent, CarrinhoAbandonado
+from app.database import get_db, SessionLocal
+from app.models import VendaApp, VisitaApp, VariantEvent, CarrinhoAbandonado, EventoLoteRecebido
 from app.auth import get_current_store
+from app.store_keys import get_loja_id, filtro_loja
+from app.query_budget import QueryBudget
+from app.beacon import beacon_payload
+from app.live_visitors import registrar_visitante, contar_ativos
 
 router = APIRouter(prefix="/analytics", tags=["Analytics"])
 
+# Intervalo de checagem do SSE de visitantes ao vivo e do heartbeat
+LIVE_INTERVALO_SEGUNDOS = 2
+LIVE_HEARTBEAT_SEGUNDOS = 15
+
+# Lote offline do service worker (fila guarda no maximo 7 dias)
+BATCH_MAX_EVENTS = 200
+BATCH_MAX_BYTES = 1024 * 1024
+BATCH_MAX_AGE_MS = 7 * 24 * 60 * 60 * 1000
+# Ids de evento guardados um pouco alem da idade maxima da fila
+BATCH_IDS_RETENCAO_DIAS = 8
+
 
 def get_db_url():
     return (
@@ -56,27 +75,73 @@ class InstallPayload(BaseModel):
     visitor_id: str
 
 
-@router.post("/visita")
-async def registrar_visita(
-    payload: VisitaPayload,
-    request: Request,
-    db: Session = Depends(get_db),
-):
+# =====================================================
+# INGESTAO — nucleo compartilhado pelas rotas de evento e pelo lote
+# =====================================================
+def data_evento(age_ms: int = 0) -> str:
+    """Horario do evento; lotes reenviados pelo SW informam a idade (relogio do cliente nao entra)."""
+    age_ms = min(max(age_ms or 0, 0), BATCH_MAX_AGE_MS)
+    return (datetime.now() - timedelta(milliseconds=age_ms)).isoformat()
+
+
+def salvar_visita(db: Session, payload: VisitaPayload, data: str):
     db.add(
         VisitaApp(
             store_id=payload.store_id,
+            loja_id=get_loja_id(db, payload.store_id),
             pagina=payload.pagina,
             is_pwa=payload.is_pwa,
             visitor_id=payload.visitor_id,
-            data=datetime.now().isoformat(),
+            data=data,
         )
     )
-    db.commit()
 
-    # ✅ Integração com o agendador de carrinho abandonado
+
+def salvar_venda(db: Session, payload: VendaPayload, data: str):
+    db.add(
+        VendaApp(
+            store_id=payload.store_id,
+            loja_id=get_loja_id(db, payload.store_id),
+            valor=payload.valor,
+            visitor_id=payload.visitor_id,
+            data=data,
+        )
+    )
+
+
+def salvar_variant_event(db: Session, payload: VariantEventPayload, data: str):
+    db.add(
+        VariantEvent(
+            store_id=payload.store_id,
+            loja_id=get_loja_id(db, payload.store_id),
+            visitor_id=payload.visitor_id,
+            product_id=payload.product_id,
+            variant_id=payload.variant_id,
+            variant_name=payload.variant_name,
+            price=payload.price,
+            stock=payload.stock,
+            data=data,
+        )
+    )
+
+
+def salvar_install(db: Session, payload: InstallPayload, data: str):
+    db.add(
+        VisitaApp(
+            store_id=payload.store_id,
+            loja_id=get_loja_id(db, payload.store_id),
+            pagina="install",
+            is_pwa=True,
+            visitor_id=payload.visitor_id,
+            data=data,
+        )
+    )
+
+
+def processar_carrinho_visita(scheduler, db: Session, payload: VisitaPayload):
+    """✅ Integração com o agendador de carrinho abandonado."""
     try:
         cart_count = payload.cart_items_count or 0
-        scheduler = request.app.state.scheduler
         db_url = get_db_url()
 
         from app.routes.automacao_routes import (
@@ -131,28 +196,10 @@ async def registrar_visita(
     except Exception as e:
         print(f"[AUTOMACAO] Erro ao processar carrinho: {e}")
 
-    return {"status": "ok"}
-
-
-@router.post("/venda")
-async def registrar_venda(
-    payload: VendaPayload,
-    request: Request,
-    db: Session = Depends(get_db),
-):
-    db.add(
-        VendaApp(
-            store_id=payload.store_id,
-            valor=payload.valor,
-            visitor_id=payload.visitor_id,
-            data=datetime.now().isoformat(),
-        )
-    )
-    db.commit()
 
-    # ✅ Cancela jobs de carrinho abandonado quando cliente compra
+def encerrar_carrinho_venda(scheduler, db: Session, payload: VendaPayload):
+    """✅ Cancela jobs de carrinho abandonado quando cliente compra."""
     try:
-        scheduler = request.app.state.scheduler
         from app.routes.automacao_routes import cancelar_recuperacao_carrinho
         cancelar_recuperacao_carrinho(
             store_id=payload.store_id,
@@ -172,50 +219,191 @@ async def registrar_venda(
     except Exception as e:
         print(f"[AUTOMACAO] Erro ao cancelar carrinho apos venda: {e}")
 
+
+@router.post("/visita")
+async def registrar_visita(
+    request: Request,
+    payload: VisitaPayload = Depends(beacon_payload(VisitaPayload)),
+    db: Session = Depends(get_db),
+):
+    salvar_visita(db, payload, data_evento())
+    db.commit()
+    registrar_visitante(db, payload.store_id, payload.visitor_id, payload.is_pwa)
+    processar_carrinho_visita(getattr(request.app.state, "scheduler", None), db, payload)
+    return {"status": "ok"}
+
+
+@router.post("/venda")
+async def registrar_venda(
+    request: Request,
+    payload: VendaPayload = Depends(beacon_payload(VendaPayload)),
+    db: Session = Depends(get_db),
+):
+    salvar_venda(db, payload, data_evento())
+    db.commit()
+    encerrar_carrinho_venda(getattr(request.app.state, "scheduler", None), db, payload)
     return {"status": "ok"}
 
 
 @router.post("/variant")
 async def registrar_variant_event(
-    payload: VariantEventPayload,
     request: Request,
+    payload: VariantEventPayload = Depends(beacon_payload(VariantEventPayload)),
     db: Session = Depends(get_db),
 ):
-    db.add(
-        VariantEvent(
-            store_id=payload.store_id,
-            visitor_id=payload.visitor_id,
-            product_id=payload.product_id,
-            variant_id=payload.variant_id,
-            variant_name=payload.variant_name,
-            price=payload.price,
-            stock=payload.stock,
-            data=datetime.now().isoformat(),
-        )
-    )
+    salvar_variant_event(db, payload, data_evento())
     db.commit()
     return {"status": "ok"}
 
 
 @router.post("/install")
 async def registrar_install(
-    payload: InstallPayload,
     request: Request,
+    payload: InstallPayload = Depends(beacon_payload(InstallPayload)),
     db: Session = Depends(get_db),
 ):
-    db.add(
-        VisitaApp(
-            store_id=payload.store_id,
-            pagina="install",
-            is_pwa=True,
-            visitor_id=payload.visitor_id,
-            data=datetime.now().isoformat(),
-        )
-    )
+    salvar_install(db, payload, data_evento())
     db.commit()
+    registrar_visitante(db, payload.store_id, payload.visitor_id, True)
     return {"status": "ok"}
 
 
+# =====================================================
+# ✅ LOTE OFFLINE — fila do service worker reenviada pelo Background Sync
+# Um POST text/plain (gzip com ?encoding=gzip) com ate BATCH_MAX_EVENTS eventos.
+# Visitas antigas nao mexem no carrinho abandonado nem no "ao vivo";
+# vendas ainda encerram a recuperacao do carrinho.
+# =====================================================
+class BatchEvent(BaseModel):
+    id: Optional[str] = Field(None, max_length=64)  # uid do SW (filas antigas nao tem)
+    path: str
+    payload: dict
+    age_ms: int = 0
+
+
+class BatchPayload(BaseModel):
+    events: List[BatchEvent] = Field(..., max_length=BATCH_MAX_EVENTS)
+
+
+BATCH_MODELOS = {
+    "/analytics/visita": (VisitaPayload, salvar_visita),
+    "/analytics/venda": (VendaPayload, salvar_venda),
+    "/analytics/variant": (VariantEventPayload, salvar_variant_event),
+    "/analytics/install": (InstallPayload, salvar_install),
+}
+
+
+def registrar_ids_lote(db: Session, ids: list) -> set:
+    """
+    Grava os ids na mesma transacao dos eventos e devolve so os que eram novos.
+    Lote repetido concorrente espera o primeiro no indice unico e nao grava nada.
+    """
+    if not ids:
+        return set()
+    dialeto = postgresql if db.get_bind().dialect.name == "postgresql" else sqlite
+    agora = datetime.now().isoformat()
+    stmt = (
+        dialeto.insert(EventoLoteRecebido)
+        .values([{"event_id": event_id, "recebido_em": agora} for event_id in ids])
+        .on_conflict_do_nothing(index_elements=["event_id"])
+        .returning(EventoLoteRecebido.event_id)
+    )
+    return {row[0] for row in db.execute(stmt)}
+
+
+def limpar_ids_lote():
+    """Job do APScheduler: descarta ids mais velhos que qualquer evento da fila."""
+    db = SessionLocal()
+    try:
+        limite = (datetime.now() - timedelta(days=BATCH_IDS_RETENCAO_DIAS)).isoformat()
+        apagados = db.query(EventoLoteRecebido).filter(EventoLoteRecebido.recebido_em < limite).delete(
+            synchronize_session=False
+        )
+        db.commit()
+        if apagados:
+            print(f"[ANALYTICS] {apagados} ids de lote antigos removidos")
+    except Exception as e:
+        db.rollback()
+        print(f"[ANALYTICS] Erro ao limpar ids de lote: {e}")
+    finally:
+        db.close()
+
+
+@router.post("/batch")
+async def registrar_lote(
+    request: Request,
+    payload: BatchPayload = Depends(beacon_payload(BatchPayload, max_bytes=BATCH_MAX_BYTES, allow_gzip=True)),
+    db: Session = Depends(get_db),
+):
+    aceitos, rejeitados, repetidos = 0, 0, 0
+    vendas = []
+    novos = registrar_ids_lote(db, list(dict.fromkeys(e.id for e in payload.events if e.id)))
+    for evento in payload.events:
+        if evento.id:
+            if evento.id not in novos:
+                # Ja gravado num envio anterior do mesmo lote (ou repetido no lote)
+                repetidos += 1
+                continue
+            novos.discard(evento.id)
+        modelo = BATCH_MODELOS.get(evento.path)
+        if not modelo:
+            rejeitados += 1
+            continue
+        model, salvar = modelo
+        try:
+            dados = model.model_validate(evento.payload)
+        except ValidationError:
+            # Evento invalido nao derruba o lote (o SW descarta o lote depois do 2xx)
+            rejeitados += 1
+            continue
+        salvar(db, dados, data_evento(evento.age_ms))
+        if model is VendaPayload:
+            vendas.append(dados)
+        aceitos += 1
+    db.commit()
+
+    for venda in vendas:
+        encerrar_carrinho_venda(getattr(request.app.state, "scheduler", None), db, venda)
+
+    if rejeitados or repetidos:
+        print(f"[ANALYTICS] Lote offline: {aceitos} aceitos, {rejeitados} rejeitados, {repetidos} repetidos")
+    return {"status": "ok", "aceitos": aceitos, "rejeitados": rejeitados, "repetidos": repetidos}
+
+
+@router.get("/live")
+async def visitantes_ao_vivo(token: str, request: Request):
+    """
+    SSE com os visitantes ativos nos ultimos 5 minutos (PWA x site).
+    Le so o contador em memoria — nenhuma query no banco.
+    O token vai na query string porque o EventSource nao envia headers.
+    """
+    store_id = get_current_store(token)
+
+    async def eventos():
+        ultimo = None
+        ultimo_envio = 0.0
+        yield "retry: 5000\n\n"
+        while not await request.is_disconnected():
+            atual = contar_ativos(store_id)
+            agora = asyncio.get_running_loop().time()
+            if atual != ultimo:
+                anterior = ultimo or {"total": 0, "pwa": 0, "site": 0}
+                delta = {k: atual[k] - anterior[k] for k in atual}
+                yield f"event: visitantes\ndata: {json.dumps({**atual, 'delta': delta})}\n\n"
+                ultimo = atual
+                ultimo_envio = agora
+            elif agora - ultimo_envio >= LIVE_HEARTBEAT_SEGUNDOS:
+                yield ": ping\n\n"
+                ultimo_envio = agora
+            await asyncio.sleep(LIVE_INTERVALO_SEGUNDOS)
+
+    return StreamingResponse(
+        eventos(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
 @router.get("/dashboard")
 def get_dashboard_stats(
     store_id: str = Depends(get_current_store),
@@ -225,162 +413,178 @@ def get_dashboard_stats(
     sete_dias_atras = agora - timedelta(days=7)
     quatorze_dias_atras = agora - timedelta(days=14)
 
-    vendas = db.query(VendaApp).filter(VendaApp.store_id == store_id).all()
-    total_receita = sum(float(v.valor) for v in vendas)
-    qtd_vendas = len(vendas)
+    # ✅ Resolve a chave inteira da loja uma vez por request
+    loja_id = get_loja_id(db, store_id)
+    da_loja_venda = filtro_loja(VendaApp, store_id, loja_id)
+    da_loja_visita = filtro_loja(VisitaApp, store_id, loja_id)
+
+    # ✅ Orcamento de banco do request — metricas que estourarem voltam do cache
+    orcamento = QueryBudget(db, "analytics/dashboard", store_id)
+
+    def _receita_e_vendas():
+        vendas = db.query(VendaApp.valor).filter(da_loja_venda).all()
+        return sum(float(v.valor) for v in vendas), len(vendas)
+
+    total_receita, qtd_vendas = orcamento.medir("receita", _receita_e_vendas, padrao=(0.0, 0))
 
-    visitantes_unicos = (
+    visitantes_unicos = orcamento.medir("visitantes_unicos", lambda: (
         db.query(func.count(distinct(VisitaApp.visitor_id)))
-        .filter(VisitaApp.store_id == store_id)
+        .filter(da_loja_visita)
         .scalar() or 0
-    )
+    ))
 
-    visitas_pwa = (
+    visitas_pwa = orcamento.medir("visitas_pwa", lambda: (
         db.query(func.count(distinct(VisitaApp.visitor_id)))
-        .filter(VisitaApp.store_id == store_id, VisitaApp.is_pwa == True)
+        .filter(da_loja_visita, VisitaApp.is_pwa == True)
         .scalar() or 0
-    )
+    ))
     visitas_site = max(0, visitantes_unicos - visitas_pwa)
 
-    vendas_pwa = (
+    vendas_pwa = orcamento.medir("vendas_pwa", lambda: (
         db.query(func.count(VendaApp.id))
         .filter(
-            VendaApp.store_id == store_id,
+            da_loja_venda,
             VendaApp.visitor_id.in_(
                 db.query(VisitaApp.visitor_id).filter(
-                    VisitaApp.store_id == store_id,
+                    da_loja_visita,
                     VisitaApp.is_pwa == True,
                 )
             ),
         )
         .scalar() or 0
-    )
+    ))
     vendas_site = max(0, qtd_vendas - vendas_pwa)
 
-    qtd_checkout = (
+    qtd_checkout = orcamento.medir("checkout", lambda: (
         db.query(func.count(distinct(VisitaApp.visitor_id)))
         .filter(
-            VisitaApp.store_id == store_id,
+            da_loja_visita,
             (VisitaApp.pagina.contains("checkout") | VisitaApp.pagina.contains("carrinho")),
         )
         .scalar() or 0
-    )
+    ))
 
     abandonos = max(0, qtd_checkout - qtd_vendas)
     ticket_medio = total_receita / max(1, qtd_vendas) if qtd_vendas > 0 else 0
 
-    subquery = (
-        db.query(VendaApp.visitor_id)
-        .filter(VendaApp.store_id == store_id)
-        .group_by(VendaApp.visitor_id)
-        .having(func.count(VendaApp.id) > 1)
-        .subquery()
-    )
-    recorrentes = db.query(func.count(subquery.c.visitor_id)).scalar() or 0
+    def _recorrentes():
+        subquery = (
+            db.query(VendaApp.visitor_id)
+            .filter(da_loja_venda)
+            .group_by(VendaApp.visitor_id)
+            .having(func.count(VendaApp.id) > 1)
+            .subquery()
+        )
+        return db.query(func.count(subquery.c.visitor_id)).scalar() or 0
+
+    recorrentes = orcamento.medir("recorrentes", _recorrentes)
 
     visitas_pwa_qs = db.query(VisitaApp).filter(
-        VisitaApp.store_id == store_id, VisitaApp.is_pwa == True
+        da_loja_visita, VisitaApp.is_pwa == True
     )
-    pageviews_pwa = visitas_pwa_qs.count()
+    pageviews_pwa = orcamento.medir("pageviews", visitas_pwa_qs.count)
 
-    top_paginas_pwa = [
+    top_paginas_pwa = orcamento.medir("top_paginas", lambda: [
         p[0]
         for p in db.query(VisitaApp.pagina, func.count(VisitaApp.pagina).label("total"))
-        .filter(VisitaApp.store_id == store_id, VisitaApp.is_pwa == True)
+        .filter(da_loja_visita, VisitaApp.is_pwa == True)
         .group_by(VisitaApp.pagina)
         .order_by(desc("total"))
         .limit(5)
         .all()
-    ]
+    ], padrao=[])
 
-    installs_7d = (
+    installs_7d = orcamento.medir("installs_7d", lambda: (
         db.query(func.count(distinct(VisitaApp.visitor_id)))
         .filter(
-            VisitaApp.store_id == store_id,
+            da_loja_visita,
             VisitaApp.is_pwa == True,
             VisitaApp.data >= sete_dias_atras.isoformat(),
         )
         .scalar() or 0
-    )
-    installs_7d_antes = (
+    ))
+    installs_7d_antes = orcamento.medir("installs_7d_antes", lambda: (
         db.query(func.count(distinct(VisitaApp.visitor_id)))
         .filter(
-            VisitaApp.store_id == store_id,
+            da_loja_visita,
             VisitaApp.is_pwa == True,
             VisitaApp.data >= quatorze_dias_atras.isoformat(),
             VisitaApp.data < sete_dias_atras.isoformat(),
         )
         .scalar() or 0
-    )
+    ))
 
     crescimento_instalacoes_7d = (
         round((installs_7d - installs_7d_antes) / installs_7d_antes * 100, 1)
         if installs_7d_antes > 0 else 0.0
     )
 
-    instalacoes_pwa = (
+    instalacoes_pwa = orcamento.medir("instalacoes", lambda: (
         db.query(func.count(distinct(VisitaApp.visitor_id)))
         .filter(
-            VisitaApp.store_id == store_id,
+            da_loja_visita,
             VisitaApp.is_pwa == True,
             VisitaApp.pagina == "install",
         )
         .scalar() or 0
-    )
-
-    from datetime import datetime as _dt
-    visitas_pwa_list = (
-        visitas_pwa_qs.filter(VisitaApp.visitor_id.isnot(None))
-        .order_by(VisitaApp.visitor_id, VisitaApp.data)
-        .all()
-    )
+    ))
+
+    def _tempo_medio():
+        from datetime import datetime as _dt
+        visitas_pwa_list = (
+            db.query(VisitaApp.visitor_id, VisitaApp.data)
+            .filter(da_loja_visita, VisitaApp.is_pwa == True, VisitaApp.visitor_id.isnot(None))
+            .order_by(VisitaApp.visitor_id, VisitaApp.data)
+            .all()
+        )
 
-    total_segundos = 0
-    total_sessoes = 0
-    ultimo_visitante = None
-    ultima_data = None
-    LIMITE_SESSAO = 5 * 60
+        total_segundos = 0
+        total_sessoes = 0
+        ultimo_visitante = None
+        ultima_data = None
+        LIMITE_SESSAO = 5 * 60
 
-    for v in visitas_pwa_list:
-        try:
-            dt = _dt.fromisoformat(v.data)
-        except Exception:
-            continue
-        if v.visitor_id != ultimo_visitante:
-            ultimo_visitante = v.visitor_id
-            ultima_data = dt
-            total_sessoes += 1
-        else:
-            diff = (dt - ultima_data).total_seconds()
-            if 0 < diff <= LIMITE_SESSAO:
-                total_segundos += diff
-            ultima_data = dt
-
-    if total_sessoes > 0 and total_segundos > 0:
-        media_segundos = total_segundos / total_sessoes
-        tempo_medio_str = f"{media_segundos / 60:.1f} min".replace(".", ",")
-    else:
-        tempo_medio_str = "--"
-
-    qtd_checkout_pwa = (
+        for v in visitas_pwa_list:
+            try:
+                dt = _dt.fromisoformat(v.data)
+            except Exception:
+                continue
+            if v.visitor_id != ultimo_visitante:
+                ultimo_visitante = v.visitor_id
+                ultima_data = dt
+                total_sessoes += 1
+            else:
+                diff = (dt - ultima_data).total_seconds()
+                if 0 < diff <= LIMITE_SESSAO:
+                    total_segundos += diff
+                ultima_data = dt
+
+        if total_sessoes > 0 and total_segundos > 0:
+            media_segundos = total_segundos / total_sessoes
+            return f"{media_segundos / 60:.1f} min".replace(".", ",")
+        return "--"
+
+    tempo_medio_str = orcamento.medir("tempo_medio", _tempo_medio, padrao="--")
+
+    qtd_checkout_pwa = orcamento.medir("checkout_pwa", lambda: (
         db.query(func.count(distinct(VisitaApp.visitor_id)))
         .filter(
-            VisitaApp.store_id == store_id,
+            da_loja_visita,
             VisitaApp.is_pwa == True,
             (VisitaApp.pagina.contains("checkout") | VisitaApp.pagina.contains("carrinho")),
         )
         .scalar() or 0
-    )
+    ))
 
     # ✅ Carrinhos abandonados ativos
-    carrinhos_ativos = (
+    carrinhos_ativos = orcamento.medir("carrinhos_ativos", lambda: (
         db.query(func.count(CarrinhoAbandonado.id))
         .filter(
-            CarrinhoAbandonado.store_id == store_id,
+            filtro_loja(CarrinhoAbandonado, store_id, loja_id),
             CarrinhoAbandonado.status == "ativo",
         )
         .scalar() or 0
-    )
+    ))
 
     return {
         "receita": total_receita,
@@ -419,4 +623,7 @@ def get_dashboard_stats(
             "vendas_pwa": vendas_pwa,
             "vendas_site": vendas_site,
         },
+        # ✅ Metricas que vieram do cache/padrao porque o orcamento estourou
+        "parcial": bool(orcamento.parciais),
+        "metricas_parciais": orcamento.parciais,
     }
@@ -7,6 +7,10 @@ from sqlalchemy.orm import Session
 from app.database import get_db
 from app.models import Loja, AppConfig
 from app.auth import CLIENT_ID, CLIENT_SECRET, encrypt_token, create_jwt_token
+from app.services import inject_script_tag
+from app.render_cache import invalidate_store
+from app.routes.loader_routes import get_loader_version
+from app.store_keys import vincular_loja
 
 router = APIRouter(tags=["Auth"])
 
@@ -175,38 +179,6 @@ def create_landing_page_internal(store_id: str, access_token: str, theme_color:
             print(f"Erro ao criar pagina: {e}")
 
 
-def inject_script_tag(store_id: str, access_token: str):
-    url = f"https://api.tiendanube.com/v1/{store_id}/scripts"
-    headers = {
-        "Authentication": f"bearer {access_token}",
-        "Content-Type": "application/json",
-        "User-Agent": "AppBuilder (Builder)"
-    }
-    payload = {
-        "src": f"{BACKEND_URL}/loader.js?store_id={store_id}",
-        "event": "onload"
-    }
-    try:
-        check = requests.get(url, headers=headers)
-        if check.status_code == 200:
-            scripts = check.json()
-            if isinstance(scripts, list):
-                for s in scripts:
-                    if isinstance(s, dict) and "loader.js" in s.get("src", ""):
-                        print(f"Script ja injetado na loja {store_id}. Pulando.")
-                        return
-        res = requests.post(url, json=payload, headers=headers)
-        if res.status_code == 404:
-            url_alt = f"https://api.nuvemshop.com.br/v1/{store_id}/scripts"
-            res = requests.post(url_alt, json=payload, headers=headers)
-        if res.status_code == 201:
-            print(f"Script injetado na loja {store_id}")
-        else:
-            print(f"Erro ao injetar script: {res.status_code} - {res.text}")
-    except Exception as e:
-        print(f"Erro ao injetar script: {e}")
-
-
 @router.get("/install")
 def install():
     if not CLIENT_ID:
@@ -284,6 +256,8 @@ def callback(code: str = Query(None), db: Session = Depends(get_db)):
             loja.url = store_url
             if email:
                 loja.email = email
+        # ✅ Eventos que chegaram antes da Loja existir ganham o loja_id
+        vincular_loja(db, loja)
 
         config = db.query(AppConfig).filter(AppConfig.store_id == store_id).first()
         is_new_store = config is None
@@ -293,6 +267,8 @@ def callback(code: str = Query(None), db: Session = Depends(get_db)):
 
         db.commit()
         db.refresh(config)
+        # URL da loja pode ter mudado (start_url do manifest)
+        invalidate_store(store_id)
 
         # 4. Cria app OneSignal se necessario
         if is_new_store or not config.onesignal_app_id:
@@ -310,10 +286,14 @@ def callback(code: str = Query(None), db: Session = Depends(get_db)):
         print(f"Registrando webhooks para loja {store_id}...")
         registrar_webhooks_nuvemshop(store_id, raw_token)
 
-        # 6. Pos-install
+        # 6. Registra o loader.js com URL versionada (&v=<hash do conteudo>)
+        invalidate_store(store_id)
+        inject_script_tag(store_id, raw_token, get_loader_version(store_id, db))
+
+        # 7. Pos-install
         create_landing_page_internal(store_id, raw_token, "#000000")
 
-        # 7. Redireciona para o Painel
+        # 8. Redireciona para o Painel
         jwt_token = create_jwt_token(store_id)
         return RedirectResponse(f"{FRONTEND_URL}/admin?token={jwt_token}", status_code=303)
 
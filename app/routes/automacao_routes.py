@@ -1,14 +1,17 @@
-import httpx
+import os
 from datetime import datetime, timedelta
 from typing import Optional
 
 from fastapi import APIRouter, Depends, Request
+from sqlalchemy import update
 from sqlalchemy.orm import Session
 from pydantic import BaseModel
 
-from app.database import get_db
+from app.database import get_db, SessionLocal
+from app.push_outbox import enfileirar_push
 from app.models import AutomacaoConfig, CarrinhoAbandonado, VendaApp, AppConfig
 from app.auth import get_current_store
+from app.store_keys import get_loja_id, filtro_loja
 
 router = APIRouter(prefix="/automacao", tags=["Automacao"])
 
@@ -67,37 +70,25 @@ def carrinho_ainda_ativo(store_id: str, visitor_id: str, db: Session) -> bool:
     return carrinho is not None and (carrinho.cart_count or 0) > 0
 
 
-async def disparar_push_carrinho(
+def montar_push_carrinho(
     app_id: str,
-    api_key: str,
-    external_id: str,
+    external_ids: list,
     titulo: str,
     mensagem: str,
     cupom: Optional[str] = None,
-):
-    """Dispara push de carrinho abandonado via OneSignal external_id."""
+) -> dict:
+    """Push de carrinho abandonado para varios external_id de uma vez."""
     if cupom:
         mensagem = f"{mensagem} Cupom: {cupom}"
 
-    headers = {
-        "Authorization": f"Basic {api_key}",
-        "Content-Type": "application/json",
-    }
-    payload = {
+    return {
         "app_id": app_id,
         "headings": {"en": titulo, "pt": titulo},
         "contents": {"en": mensagem, "pt": mensagem},
         "url": "/carrinho",
-        "include_aliases": {"external_id": [external_id]},
+        "include_aliases": {"external_id": list(external_ids)},
         "target_channel": "push",
     }
-    async with httpx.AsyncClient(timeout=10.0) as client:
-        resp = await client.post(
-            "https://onesignal.com/api/v1/notifications",
-            headers=headers,
-            json=payload,
-        )
-        return resp.json()
 
 
 # =============================================
@@ -114,9 +105,9 @@ def executar_push_carrinho(
     """
     Função executada pelo APScheduler nos horários configurados.
     Verifica se o cliente ainda tem carrinho ativo e não comprou.
-    Se sim, dispara o push. Se não, cancela silenciosamente.
+    Se sim, marca o passo como pendente — o envio sai no proximo lote
+    (enviar_lotes_carrinho). Se não, cancela silenciosamente.
     """
-    import asyncio
     from sqlalchemy import create_engine
     from sqlalchemy.orm import sessionmaker
 
@@ -134,60 +125,147 @@ def executar_push_carrinho(
             _marcar_carrinho_comprado(store_id, visitor_id, db)
             return
 
-        if not carrinho_ainda_ativo(store_id, visitor_id, db):
+        carrinho = db.query(CarrinhoAbandonado).filter(
+            CarrinhoAbandonado.store_id == store_id,
+            CarrinhoAbandonado.visitor_id == visitor_id,
+            CarrinhoAbandonado.status == "ativo",
+        ).first()
+        if not carrinho or (carrinho.cart_count or 0) <= 0:
             print(f"[SCHEDULER] Carrinho {visitor_id} nao esta mais ativo — cancelando")
             return
 
-        # Busca config de automacao da loja
-        config_automacao = db.query(AutomacaoConfig).filter(
-            AutomacaoConfig.store_id == store_id
-        ).first()
+        if external_id and not carrinho.external_id:
+            carrinho.external_id = external_id
+        carrinho.passo_pendente = passo
+        carrinho.atualizado_em = datetime.now().isoformat()
+        db.commit()
 
-        if not config_automacao:
-            print(f"[SCHEDULER] Sem config de automacao para loja {store_id}")
-            return
+    except Exception as e:
+        print(f"[SCHEDULER] Erro no passo {passo} para {visitor_id}: {e}")
+    finally:
+        db.close()
+        engine.dispose()
 
-        # Seleciona template do passo correto
-        if passo == 1 and config_automacao.passo1_ativo:
-            titulo = config_automacao.passo1_titulo
-            mensagem = config_automacao.passo1_mensagem
-            cupom = None
-        elif passo == 2 and config_automacao.passo2_ativo:
-            titulo = config_automacao.passo2_titulo
-            mensagem = config_automacao.passo2_mensagem
-            cupom = None
-        elif passo == 3 and config_automacao.passo3_ativo:
-            titulo = config_automacao.passo3_titulo
-            mensagem = config_automacao.passo3_mensagem
-            cupom = config_automacao.passo3_cupom
-        else:
-            print(f"[SCHEDULER] Passo {passo} desativado para loja {store_id}")
-            return
 
-        # Busca credenciais OneSignal
-        app_config = db.query(AppConfig).filter(AppConfig.store_id == store_id).first()
-        if not app_config or not app_config.onesignal_app_id:
-            print(f"[SCHEDULER] OneSignal nao configurado para loja {store_id}")
-            return
+# =============================================
+# LOTES DE RECUPERAÇÃO — job de intervalo do APScheduler
+# Agrupa os passos pendentes por (loja, passo, template) e manda um push
+# por bloco de ate CARRINHO_LOTE_MAX_ALIASES external_ids.
+# =============================================
+
+# Janela de agrupamento: passos que vencem dentro dela saem juntos
+CARRINHO_LOTE_SEGUNDOS = int(os.getenv("CARRINHO_LOTE_SEGUNDOS", "60"))
+# Limite de aliases por notificacao da API do OneSignal
+CARRINHO_LOTE_MAX_ALIASES = 2000
+
+
+def _template_passo(config: AutomacaoConfig, passo: int):
+    """(titulo, mensagem, cupom) do passo, ou None se o passo esta desativado."""
+    if passo == 1 and config.passo1_ativo:
+        return config.passo1_titulo, config.passo1_mensagem, None
+    if passo == 2 and config.passo2_ativo:
+        return config.passo2_titulo, config.passo2_mensagem, None
+    if passo == 3 and config.passo3_ativo:
+        return config.passo3_titulo, config.passo3_mensagem, config.passo3_cupom
+    return None
 
-        # Dispara o push
-        loop = asyncio.new_event_loop()
-        asyncio.set_event_loop(loop)
-        result = loop.run_until_complete(
-            disparar_push_carrinho(
-                app_id=app_config.onesignal_app_id,
-                api_key=app_config.onesignal_api_key,
-                external_id=external_id,
+
+def _reservar_pendentes(db: Session, ids: list, passo: int) -> list:
+    """
+    Tira os carrinhos do estado pendente e devolve (id, external_id) dos que
+    ainda estavam nele — outro worker rodando o mesmo lote nao reenvia.
+    O commit fica com quem chamou (junto com o que for enfileirado).
+    """
+    result = db.execute(
+        update(CarrinhoAbandonado)
+        .where(
+            CarrinhoAbandonado.id.in_(ids),
+            CarrinhoAbandonado.passo_pendente == passo,
+            CarrinhoAbandonado.status == "ativo",
+        )
+        .values(passo_pendente=None)
+        .returning(CarrinhoAbandonado.id, CarrinhoAbandonado.external_id)
+    ).all()
+    return result
+
+
+def _enviar_lote_loja(db: Session, store_id: str, passo: int, carrinhos: list):
+    config_automacao = db.query(AutomacaoConfig).filter(AutomacaoConfig.store_id == store_id).first()
+    template = _template_passo(config_automacao, passo) if config_automacao else None
+    app_id, _ = get_onesignal_credentials(store_id, db)
+    if not template or not app_id:
+        # Passo desligado / loja sem OneSignal: descarta os pendentes
+        _reservar_pendentes(db, [c.id for c in carrinhos], passo)
+        db.commit()
+        print(f"[CARRINHO-LOTE] Loja {store_id} passo {passo}: sem template/OneSignal — {len(carrinhos)} descartados")
+        return
+
+    # Quem comprou depois do job do passo nao recebe (uma query para o lote todo)
+    compraram = {
+        row[0] for row in db.query(VendaApp.visitor_id).filter(
+            VendaApp.store_id == store_id,
+            VendaApp.visitor_id.in_([c.visitor_id for c in carrinhos]),
+        ).distinct()
+    }
+    for carrinho in carrinhos:
+        if carrinho.visitor_id in compraram:
+            carrinho.status = "comprou"
+            carrinho.passo_pendente = None
+            carrinho.atualizado_em = datetime.now().isoformat()
+    db.commit()
+
+    elegiveis = [c.id for c in carrinhos if c.visitor_id not in compraram]
+    titulo, mensagem, cupom = template
+
+    for inicio in range(0, len(elegiveis), CARRINHO_LOTE_MAX_ALIASES):
+        bloco = elegiveis[inicio:inicio + CARRINHO_LOTE_MAX_ALIASES]
+        reservados = _reservar_pendentes(db, bloco, passo)
+        external_ids = list(dict.fromkeys(ext for _, ext in reservados if ext))
+        if not external_ids:
+            db.commit()
+            continue
+        # Reserva e enfileiramento na mesma transacao: o bloco ou vai inteiro
+        # para a outbox (que cuida de rate limit e retry) ou continua pendente
+        item = enfileirar_push(
+            db,
+            store_id,
+            "carrinho",
+            montar_push_carrinho(
+                app_id=app_id,
+                external_ids=external_ids,
                 titulo=titulo,
                 mensagem=mensagem,
                 cupom=cupom,
-            )
+            ),
+        )
+        db.commit()
+        print(
+            f"[CARRINHO-LOTE] Loja {store_id} passo {passo}: 1 push para "
+            f"{len(external_ids)} clientes (outbox {item.id})"
         )
-        loop.close()
-        print(f"[SCHEDULER] Push passo {passo} enviado para {external_id}: {result}")
 
-    except Exception as e:
-        print(f"[SCHEDULER] Erro no passo {passo} para {visitor_id}: {e}")
+
+def enviar_lotes_carrinho():
+    """Job de intervalo: envia todos os passos pendentes, agrupados por loja e passo."""
+    db = SessionLocal()
+    try:
+        pendentes = db.query(CarrinhoAbandonado).filter(
+            CarrinhoAbandonado.passo_pendente.isnot(None),
+            CarrinhoAbandonado.status == "ativo",
+        ).all()
+        if not pendentes:
+            return
+
+        grupos = {}
+        for carrinho in pendentes:
+            grupos.setdefault((carrinho.store_id, carrinho.passo_pendente), []).append(carrinho)
+
+        for (store_id, passo), carrinhos in grupos.items():
+            try:
+                _enviar_lote_loja(db, store_id, passo, carrinhos)
+            except Exception as e:
+                db.rollback()
+                print(f"[CARRINHO-LOTE] Erro no lote da loja {store_id} passo {passo}: {e}")
     finally:
         db.close()
 
@@ -233,6 +311,7 @@ def agendar_recuperacao_carrinho(
     if not carrinho:
         carrinho = CarrinhoAbandonado(
             store_id=store_id,
+            loja_id=get_loja_id(db, store_id),
             visitor_id=visitor_id,
             external_id=external_id,
             cart_count=cart_count,
@@ -247,6 +326,7 @@ def agendar_recuperacao_carrinho(
         carrinho.cart_count = cart_count
         carrinho.cart_total = cart_total
         carrinho.status = "ativo"
+        carrinho.passo_pendente = None
         carrinho.atualizado_em = now.isoformat()
         if external_id:
             carrinho.external_id = external_id
@@ -353,6 +433,7 @@ def cancelar_recuperacao_carrinho(
                 pass
 
     carrinho.status = "expirado"
+    carrinho.passo_pendente = None
     carrinho.job1_id = None
     carrinho.job2_id = None
     carrinho.job3_id = None
@@ -430,7 +511,7 @@ def listar_carrinhos(
 ):
     """Lista carrinhos abandonados ativos da loja — para o dashboard."""
     carrinhos = db.query(CarrinhoAbandonado).filter(
-        CarrinhoAbandonado.store_id == store_id,
+        filtro_loja(CarrinhoAbandonado, store_id, get_loja_id(db, store_id)),
         CarrinhoAbandonado.status == "ativo",
     ).order_by(CarrinhoAbandonado.id.desc()).limit(50).all()
 
@@ -1,26 +1,29 @@
-from fastapi import APIRouter, Depends, Response
-from fastapi.responses import JSONResponse
+import os
+import json
+import hashlib
+from fastapi import APIRouter, Depends, HTTPException, Request
+from fastapi.responses import FileResponse
 from sqlalchemy.orm import Session
 from app.database import get_db
 from app.models import AppConfig, Loja
+from app.render_cache import RenderCache, RenderedAsset, asset_response, minify_js
+from app.js_templates import load_js_template
+from app.routes.loader_routes import build_loader_config, loja_existe
+from app.icons import ICON_FORMATS, ICON_NAME_RE, agendar_icones, icon_path, icones_gerados, manifest_icons
 
 router = APIRouter()
 
 
-@router.get("/manifest/{store_id}.json")
-def get_manifest(store_id: str, db: Session = Depends(get_db)):
-    try:
-        config = db.query(AppConfig).filter(AppConfig.store_id == store_id).first()
-    except Exception as e:
-        print(f"Erro no banco PWA (config): {e}")
-        config = None
+# ✅ Manifest renderizado em cache por loja — sem tocar no banco em regime.
+# Invalidado junto com o loader (POST /admin/config, callback de instalacao).
+manifest_cache = RenderCache("manifest")
 
-    try:
-        loja = db.query(Loja).filter(Loja.store_id == store_id).first()
-    except Exception as e:
-        print(f"Erro no banco PWA (loja): {e}")
-        loja = None
+# Navegador revalida com ETag a cada 5 min (304 sem corpo quando nada mudou)
+MANIFEST_CACHE_CONTROL = "public, max-age=300"
 
+
+def build_manifest(store_id: str, config, loja) -> dict:
+    """Monta o manifest a partir da AppConfig e da Loja (defaults se None)."""
     app_name = config.app_name if config else "Minha Loja"
     theme_color = config.theme_color if (config and config.theme_color) else "#000000"
     background_color = theme_color
@@ -40,7 +43,18 @@ def get_manifest(store_id: str, db: Session = Depends(get_db)):
     else:
         start_url = f"/?utm_source=pwa_app&store_id={store_id}"
 
-    return JSONResponse({
+    # ✅ Icones redimensionados no servidor; ate ficarem prontos, usa a imagem original
+    icon_hash = icones_gerados(icon_src)
+    if icon_hash:
+        icons = manifest_icons(icon_hash)
+    else:
+        agendar_icones(store_id, icon_src)
+        icons = [
+            {"src": icon_src, "sizes": "192x192", "type": "image/png"},
+            {"src": icon_src, "sizes": "512x512", "type": "image/png"}
+        ]
+
+    return {
         "name": app_name,
         "short_name": app_name[:12],
         "start_url": start_url,
@@ -48,131 +62,164 @@ def get_manifest(store_id: str, db: Session = Depends(get_db)):
         "background_color": background_color,
         "theme_color": theme_color,
         "orientation": "portrait",
-        "icons": [
-            {"src": icon_src, "sizes": "192x192", "type": "image/png"},
-            {"src": icon_src, "sizes": "512x512", "type": "image/png"}
-        ]
-    })
-
-
-# Conteúdo do Service Worker — compartilhado por todas as rotas
-SW_CONTENT = """
-importScripts("https://cdn.onesignal.com/sdks/web/v16/OneSignalSDK.sw.js");
-
-const CACHE_NAME = 'app-builder-cache-v1';
-const PRECACHE_URLS = [
-    '/service-worker.js',
-    '/favicon.ico'
-];
-
-self.addEventListener('install', (event) => {
-    event.waitUntil(
-        caches.open(CACHE_NAME).then((cache) => {
-            return cache.addAll(PRECACHE_URLS).catch((err) => {
-                console.warn('SW: erro ao fazer precache', err);
-            });
-        })
-    );
-    self.skipWaiting();
-});
-
-self.addEventListener('activate', (event) => {
-    event.waitUntil(
-        caches.keys().then((keys) => {
-            return Promise.all(
-                keys.map((key) => {
-                    if (key !== CACHE_NAME) {
-                        return caches.delete(key);
-                    }
-                })
-            );
-        })
-    );
-    return self.clients.claim();
-});
-
-self.addEventListener('fetch', (event) => {
-    const req = event.request;
-    if (req.method !== 'GET') return;
-    const acceptHeader = req.headers.get('Accept') || '';
-    if (acceptHeader.includes('text/html')) return;
-    if (
-        req.url.includes('/manifest') ||
-        (req.url.endsWith('.js') && !req.url.includes('service-worker') && !req.url.includes('OneSignalSDK')) ||
-        req.url.endsWith('.css') ||
-        req.url.endsWith('.png') ||
-        req.url.endsWith('.jpg') ||
-        req.url.endsWith('.jpeg') ||
-        req.url.endsWith('.svg') ||
-        req.url.endsWith('.ico')
-    ) {
-        event.respondWith(
-            caches.match(req).then((cachedResponse) => {
-                const fetchPromise = fetch(req)
-                    .then((networkResponse) => {
-                        caches.open(CACHE_NAME).then((cache) => {
-                            cache.put(req, networkResponse.clone());
-                        });
-                        return networkResponse;
-                    })
-                    .catch((err) => {
-                        if (cachedResponse) return cachedResponse;
-                        throw err;
-                    });
-                return cachedResponse || fetchPromise;
-            })
-        );
+        "icons": icons
     }
-});
-"""
+
+
+def render_manifest(store_id: str, config, loja) -> str:
+    return json.dumps(build_manifest(store_id, config, loja), ensure_ascii=False, separators=(",", ":"))
+
+
+def _manifest_asset(store_id: str, db: Session) -> RenderedAsset:
+    def _render():
+        config = db.query(AppConfig).filter(AppConfig.store_id == store_id).first()
+        loja = db.query(Loja).filter(Loja.store_id == store_id).first()
+        return RenderedAsset(render_manifest(store_id, config, loja))
+
+    return manifest_cache.get(store_id, "manifest", _render)
+
+
+@router.get("/manifest/{store_id}.json")
+def get_manifest(store_id: str, request: Request, db: Session = Depends(get_db)):
+    try:
+        asset = _manifest_asset(store_id, db) if loja_existe(store_id, db) else None
+    except Exception as e:
+        print(f"Erro no banco PWA: {e}")
+        # Defaults sem cache — o proximo request tenta o banco de novo
+        asset = RenderedAsset(render_manifest(store_id, None, None))
+        return asset_response(request, asset, "application/manifest+json", "no-cache")
+
+    if asset is None:
+        raise HTTPException(status_code=404, detail="Loja nao encontrada")
+
+    return asset_response(request, asset, "application/manifest+json", MANIFEST_CACHE_CONTROL)
+
+
+# =====================================================
+# ✅ ICONES DO MANIFEST (app/icons.py) — nome = hash do conteudo, cache imutavel
+# loja.com/apps/app-builder/icons/{hash}-{tamanho}.{png|webp}
+# =====================================================
+ICON_CACHE_CONTROL = "public, max-age=31536000, immutable"
+
+
+@router.get("/icons/{name}")
+@router.get("/app-builder/icons/{name}")
+def get_icon(name: str):
+    match = ICON_NAME_RE.match(name)
+    if not match or not os.path.isfile(icon_path(name)):
+        raise HTTPException(status_code=404, detail="Icone nao encontrado")
+    return FileResponse(
+        icon_path(name),
+        media_type=ICON_FORMATS[match.group(2)],
+        headers={"Cache-Control": ICON_CACHE_CONTROL},
+    )
+
+
+# =====================================================
+# ✅ SERVICE WORKER POR LOJA (app/templates/service_worker.js)
+# loja.com/apps/app-builder/service-worker/{store_id}.js, scope /apps/app-builder/
+# =====================================================
+SW_TEMPLATE = load_js_template("service_worker.js")
+sw_cache = RenderCache("service_worker")
 
 SW_HEADERS = {
     "Service-Worker-Allowed": "/",
-    "Cache-Control": "no-cache, no-store, must-revalidate"
 }
+# O navegador ja ignora o cache HTTP ao checar update do SW; no-cache deixa revalidar com ETag
+SW_CACHE_CONTROL = "no-cache"
 
 
-def sw_response():
-    return Response(
-        content=SW_CONTENT,
-        media_type="application/javascript",
-        headers=SW_HEADERS
-    )
+def sw_precache_urls(store_id: str, config, loja) -> list:
+    """Manifest, icones do manifest e imagens dos widgets ligados da loja."""
+    urls = [f"/apps/app-builder/manifest/{store_id}.json", "/favicon.ico"]
+    urls += [icon["src"] for icon in build_manifest(store_id, config, loja)["icons"]]
+
+    loader_config = build_loader_config(store_id, config)
+    if loader_config["popup"]:
+        urls.append(loader_config["popup"]["image_url"])
+    if loader_config["topbar"] and loader_config["topbar"]["background_image_url"]:
+        urls.append(loader_config["topbar"]["background_image_url"])
+
+    return list(dict.fromkeys(urls))
+
+
+def render_service_worker(precache_urls: list, navigation_strategy: str = "off") -> str:
+    """Renderiza o SW com CACHE_NAME derivado do hash do proprio conteudo."""
+    contexto = {"precache_urls": precache_urls, "navigation_strategy": navigation_strategy}
+    rascunho = minify_js(SW_TEMPLATE.render(cache_version="", **contexto))
+    versao = hashlib.sha256(rascunho.encode("utf-8")).hexdigest()[:12]
+    return minify_js(SW_TEMPLATE.render(cache_version=versao, **contexto))
+
+
+def _sw_asset(store_id: str, db: Session) -> RenderedAsset:
+    def _render():
+        config = db.query(AppConfig).filter(AppConfig.store_id == store_id).first()
+        loja = db.query(Loja).filter(Loja.store_id == store_id).first()
+        strategy = getattr(config, "sw_navigation_strategy", None) or "off"
+        return RenderedAsset(render_service_worker(sw_precache_urls(store_id, config, loja), strategy))
+
+    return sw_cache.get(store_id, "sw", _render)
+
+
+# SW generico das URLs antigas (registros feitos antes do SW por loja)
+SW_ASSET = RenderedAsset(render_service_worker(["/favicon.ico"]))
+
+
+def sw_response(request: Request, asset: RenderedAsset = SW_ASSET):
+    return asset_response(request, asset, "application/javascript", SW_CACHE_CONTROL, SW_HEADERS)
+
+
+@router.get("/service-worker/{store_id}.js")
+@router.get("/app-builder/service-worker/{store_id}.js")
+def get_store_service_worker(store_id: str, request: Request, db: Session = Depends(get_db)):
+    """
+    ✅ SW da loja via proxy Nuvemshop.
+    loja.com/apps/app-builder/service-worker/{store_id}.js
+    → railway/app-builder/service-worker/{store_id}.js
+    """
+    try:
+        asset = _sw_asset(store_id, db) if loja_existe(store_id, db) else None
+    except Exception as e:
+        print(f"Erro no banco PWA (service worker): {e}")
+        return sw_response(request)
+    if asset is None:
+        raise HTTPException(status_code=404, detail="Loja nao encontrada")
+    return sw_response(request, asset)
 
 
 @router.get("/service-worker.js")
-def get_service_worker():
+def get_service_worker(request: Request):
     """Rota direta — usada internamente."""
-    return sw_response()
+    return sw_response(request)
 
 
 @router.get("/sw.js")
-def get_service_worker_root():
+def get_service_worker_root(request: Request):
     """Fallback sem prefixo."""
-    return sw_response()
+    return sw_response(request)
 
 
 @router.get("/app-builder/sw.js")
-def get_service_worker_proxy_sw():
+def get_service_worker_proxy_sw(request: Request):
     """Proxy Nuvemshop — /app-builder/sw.js"""
-    return sw_response()
+    return sw_response(request)
 
 
 @router.get("/app-builder/service-worker.js")
-def get_service_worker_proxy():
+def get_service_worker_proxy(request: Request):
     """
     ✅ Rota principal via proxy Nuvemshop.
     loja.com/apps/app-builder/service-worker.js
     → railway/app-builder/service-worker.js
     """
-    return sw_response()
+    return sw_response(request)
 
 
 @router.get("/app-builder/manifest/{store_id}.json")
-def get_manifest_proxy(store_id: str, db: Session = Depends(get_db)):
+def get_manifest_proxy(store_id: str, request: Request, db: Session = Depends(get_db)):
     """
     ✅ Manifest via proxy Nuvemshop.
     loja.com/apps/app-builder/manifest/{store_id}.json
     → railway/app-builder/manifest/{store_id}.json
     """
-    return get_manifest(store_id, db)
+    return get_manifest(store_id, request, db)
@@ -8,6 +8,10 @@ from pydantic import BaseModel
 from app.database import get_db
 from app.models import VendaApp, VisitaApp, AppConfig
 from app.auth import get_current_store
+from app.store_keys import get_loja_id, filtro_loja
+from app.query_budget import QueryBudget
+from app.beacon import beacon_payload
+from app.live_visitors import registrar_visitante
 
 router = APIRouter(prefix="/stats", tags=["Stats"])
 
@@ -26,22 +30,25 @@ class VisitaPayload(BaseModel):
 
 
 @router.post("/visita")
-def registrar_visita(payload: VisitaPayload, db: Session = Depends(get_db)):
+def registrar_visita(payload: VisitaPayload = Depends(beacon_payload(VisitaPayload)), db: Session = Depends(get_db)):
     db.add(VisitaApp(
         store_id=payload.store_id,
+        loja_id=get_loja_id(db, payload.store_id),
         pagina=payload.pagina,
         is_pwa=payload.is_pwa,
         visitor_id=payload.visitor_id,
         data=datetime.now().isoformat()
     ))
     db.commit()
+    registrar_visitante(db, payload.store_id, payload.visitor_id, payload.is_pwa)
     return {"status": "ok"}
 
 
 @router.post("/venda")
-def registrar_venda(payload: VendaPayload, db: Session = Depends(get_db)):
+def registrar_venda(payload: VendaPayload = Depends(beacon_payload(VendaPayload)), db: Session = Depends(get_db)):
     db.add(VendaApp(
         store_id=payload.store_id,
+        loja_id=get_loja_id(db, payload.store_id),
         valor=payload.valor,
         visitor_id=payload.visitor_id,
         data=datetime.now().isoformat()
@@ -55,73 +62,84 @@ def get_dashboard_stats(
     store_id: str = Depends(get_current_store),
     db: Session = Depends(get_db)
 ):
-    vendas = db.query(VendaApp).filter(VendaApp.store_id == store_id).all()
-    total_receita = sum([float(v.valor) for v in vendas])
-    qtd_vendas = len(vendas)
+    loja_id = get_loja_id(db, store_id)
+    da_loja_venda = filtro_loja(VendaApp, store_id, loja_id)
+    da_loja_visita = filtro_loja(VisitaApp, store_id, loja_id)
 
-    visitantes_unicos = db.query(
+    orcamento = QueryBudget(db, "stats/dashboard", store_id)
+
+    def _receita_e_vendas():
+        vendas = db.query(VendaApp.valor).filter(da_loja_venda).all()
+        return sum([float(v.valor) for v in vendas]), len(vendas)
+
+    total_receita, qtd_vendas = orcamento.medir("receita", _receita_e_vendas, padrao=(0.0, 0))
+
+    visitantes_unicos = orcamento.medir("visitantes_unicos", lambda: db.query(
         func.count(distinct(VisitaApp.visitor_id))
-    ).filter(VisitaApp.store_id == store_id).scalar() or 0
+    ).filter(da_loja_visita).scalar() or 0)
 
-    visitas_pwa = db.query(
+    visitas_pwa = orcamento.medir("visitas_pwa", lambda: db.query(
         func.count(distinct(VisitaApp.visitor_id))
     ).filter(
-        VisitaApp.store_id == store_id,
+        da_loja_visita,
         VisitaApp.is_pwa == True
-    ).scalar() or 0
+    ).scalar() or 0)
 
     visitas_web = max(0, visitantes_unicos - visitas_pwa)
 
-    vendas_pwa = db.query(func.count(VendaApp.id)).filter(
-        VendaApp.store_id == store_id,
+    vendas_pwa = orcamento.medir("vendas_pwa", lambda: db.query(func.count(VendaApp.id)).filter(
+        da_loja_venda,
         VendaApp.visitor_id.in_(
             db.query(VisitaApp.visitor_id).filter(
-                VisitaApp.store_id == store_id,
+                da_loja_visita,
                 VisitaApp.is_pwa == True
             )
         )
-    ).scalar() or 0
+    ).scalar() or 0)
 
     vendas_site = max(0, qtd_vendas - vendas_pwa)
 
-    qtd_checkout = db.query(
+    qtd_checkout = orcamento.medir("checkout", lambda: db.query(
         func.count(distinct(VisitaApp.visitor_id))
     ).filter(
-        VisitaApp.store_id == store_id,
+        da_loja_visita,
         (VisitaApp.pagina.contains("checkout") | VisitaApp.pagina.contains("carrinho"))
-    ).scalar() or 0
+    ).scalar() or 0)
 
     abandonos = max(0, qtd_checkout - qtd_vendas)
     ticket_medio = total_receita / max(1, qtd_vendas) if qtd_vendas > 0 else 0
 
-    subquery = db.query(VendaApp.visitor_id).filter(
-        VendaApp.store_id == store_id
-    ).group_by(
-        VendaApp.visitor_id
-    ).having(
-        func.count(VendaApp.id) > 1
-    ).subquery()
+    def _recorrentes():
+        subquery = db.query(VendaApp.visitor_id).filter(
+            da_loja_venda
+        ).group_by(
+            VendaApp.visitor_id
+        ).having(
+            func.count(VendaApp.id) > 1
+        ).subquery()
+
+        return db.query(
+            func.count(subquery.c.visitor_id)
+        ).scalar() or 0
 
-    recorrentes = db.query(
-        func.count(subquery.c.visitor_id)
-    ).scalar() or 0
+    recorrentes = orcamento.medir("recorrentes", _recorrentes)
 
-    pageviews = db.query(VisitaApp).filter(
-        VisitaApp.store_id == store_id
-    ).count()
+    pageviews = orcamento.medir("pageviews", lambda: db.query(VisitaApp).filter(
+        da_loja_visita
+    ).count())
 
-    top_paginas = [
+    top_paginas = orcamento.medir("top_paginas", lambda: [
         p[0] for p in db.query(
             VisitaApp.pagina,
             func.count(VisitaApp.pagina).label('total')
         ).filter(
-            VisitaApp.store_id == store_id
+            da_loja_visita
         ).group_by(
             VisitaApp.pagina
         ).order_by(
             desc('total')
         ).limit(5).all()
-    ]
+    ], padrao=[])
 
     return {
         "receita": total_receita,
@@ -158,5 +176,7 @@ def get_dashboard_stats(
             "app": visitas_pwa,
             "site": visitas_web,
             "total": visitantes_unicos
-        }
+        },
+        "parcial": bool(orcamento.parciais),
+        "metricas_parciais": orcamento.parciais
     }
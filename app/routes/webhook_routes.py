@@ -1,9 +1,9 @@
-import httpx
 from fastapi import APIRouter, Request, Depends, Header
 from sqlalchemy.orm import Session
 from typing import Optional
 
 from app.database import get_db
+from app.push_outbox import enfileirar_push
 from app.models import AppConfig
 
 router = APIRouter(prefix="/webhooks", tags=["Webhooks"])
@@ -72,24 +72,19 @@ def resolver_template(event_key: str, nome: str, pedido: str) -> Optional[dict]:
     }
 
 
-async def disparar_push_por_email(
+def montar_push_por_email(
     app_id: str,
-    api_key: str,
     external_id: str,
     title: str,
     message: str,
     url: str = "/minha-conta",
 ) -> dict:
     """
-    Envia push para um usuario especifico via external_user_id (e-mail).
+    Push para um usuario especifico via external_user_id (e-mail).
     Funciona porque o loader.js chama OneSignal.login(email) quando o
     cliente esta logado na loja.
     """
-    headers = {
-        "Authorization": f"Basic {api_key}",
-        "Content-Type": "application/json",
-    }
-    payload = {
+    return {
         "app_id": app_id,
         "headings": {"en": title, "pt": title},
         "contents": {"en": message, "pt": message},
@@ -97,13 +92,6 @@ async def disparar_push_por_email(
         "include_aliases": {"external_id": [external_id]},
         "target_channel": "push",
     }
-    async with httpx.AsyncClient(timeout=10.0) as client:
-        resp = await client.post(
-            "https://onesignal.com/api/v1/notifications",
-            headers=headers,
-            json=payload,
-        )
-        return resp.json()
 
 
 def extrair_dados_pedido(body: dict) -> dict:
@@ -167,17 +155,23 @@ async def processar_webhook(store_id: str, event: str, body: dict, db: Session)
         print(f"[WEBHOOK] OneSignal nao configurado para loja {store_id}")
         return {"status": "ignored", "reason": "OneSignal not configured"}
 
-    result = await disparar_push_por_email(
-        app_id=app_id,
-        api_key=api_key,
-        external_id=customer_email,
-        title=template["title"],
-        message=template["message"],
-        url=template["url"],
+    # ✅ Responde rapido para a Nuvemshop: o envio sai pela outbox (com retry)
+    item = enfileirar_push(
+        db,
+        store_id,
+        "pedido",
+        montar_push_por_email(
+            app_id=app_id,
+            external_id=customer_email,
+            title=template["title"],
+            message=template["message"],
+            url=template["url"],
+        ),
     )
+    db.commit()
 
-    print(f"[WEBHOOK] Push enviado para {customer_email}: {result}")
-    return {"status": "ok", "push_result": result}
+    print(f"[WEBHOOK] Push enfileirado para {customer_email}: outbox {item.id}")
+    return {"status": "ok", "outbox_id": item.id}
 
 
 # =============================================
@@ -51,3 +51,26 @@ async def validate_proxy_hmac(request: Request):
 
     # Se passou, não precisa retornar nada específico
     return True
+
+
+OPERATOR_TOKEN = os.getenv("OPERATOR_TOKEN", "")
+
+async def validate_operator_token(request: Request):
+    """
+    Libera rotas de operacao da plataforma (visao de todas as lojas).
+    Exige o header X-Operator-Token igual a variavel OPERATOR_TOKEN.
+    """
+    if not OPERATOR_TOKEN:
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="OPERATOR_TOKEN não configurado"
+        )
+
+    received = request.headers.get("X-Operator-Token", "")
+    if not hmac.compare_digest(received.encode("utf-8"), OPERATOR_TOKEN.encode("utf-8")):
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN,
+            detail="Token de operador inválido"
+        )
+
+    return True
@@ -1,5 +1,6 @@
 import os
 import requests
+from typing import Optional
 from sqlalchemy.orm import Session
 from app.models import Loja
 from .auth import decrypt_token
@@ -7,12 +8,25 @@ from .auth import decrypt_token
 BACKEND_URL = os.getenv("PUBLIC_URL") or os.getenv("RAILWAY_PUBLIC_DOMAIN")
 if BACKEND_URL and not BACKEND_URL.startswith("http"):
     BACKEND_URL = f"https://{BACKEND_URL}"
+if BACKEND_URL and BACKEND_URL.endswith("/"):
+    BACKEND_URL = BACKEND_URL[:-1]
 
 NUVEMSHOP_API_URL = "https://api.nuvemshop.com.br/v1"
 
 
-def inject_script_tag(store_id: str, access_token: str):
-    """Injeta o loader.js na loja via API da Nuvemshop."""
+def loader_script_src(store_id: str, version: Optional[str] = None) -> str:
+    src = f"{BACKEND_URL}/loader.js?store_id={store_id}"
+    if version:
+        src += f"&v={version}"
+    return src
+
+
+def inject_script_tag(store_id: str, access_token: str, version: Optional[str] = None):
+    """
+    Injeta o loader.js na loja via API da Nuvemshop.
+    Com `version`, registra a URL versionada (&v=<hash>) — se a loja ja tem o
+    loader com outra URL, atualiza a script tag existente em vez de pular.
+    """
     url = f"https://api.tiendanube.com/v1/{store_id}/scripts"
     headers = {
         "Authentication": f"bearer {access_token}",
@@ -20,7 +34,7 @@ def inject_script_tag(store_id: str, access_token: str):
         "User-Agent": "AppBuilder (Builder)"
     }
     payload = {
-        "src": f"{BACKEND_URL}/loader.js?store_id={store_id}",
+        "src": loader_script_src(store_id, version),
         "event": "onload"
     }
     try:
@@ -30,7 +44,14 @@ def inject_script_tag(store_id: str, access_token: str):
             if isinstance(scripts, list):
                 for s in scripts:
                     if isinstance(s, dict) and "loader.js" in s.get("src", ""):
-                        print(f"Script já injetado na loja {store_id}. Pulando.")
+                        if s.get("src") == payload["src"]:
+                            print(f"Script já injetado na loja {store_id}. Pulando.")
+                            return
+                        res = requests.put(f"{url}/{s.get('id')}", json=payload, headers=headers)
+                        if res.status_code == 200:
+                            print(f"Script atualizado na loja {store_id}: {payload['src']}")
+                        else:
+                            print(f"Erro ao atualizar script: {res.status_code} - {res.text}")
                         return
         res = requests.post(url, json=payload, headers=headers)
         if res.status_code == 404:
@@ -44,6 +65,51 @@ def inject_script_tag(store_id: str, access_token: str):
         print(f"Erro ao injetar script: {e}")
 
 
+def atualizar_script_tag(store_id: str):
+    """
+    Roda em background depois de salvar a config: re-registra o loader.js
+    com o &v= do conteudo novo, para navegadores/CDN cachearem para sempre.
+    """
+    from app.database import SessionLocal
+    from app.routes.loader_routes import get_loader_version
+
+    db = SessionLocal()
+    try:
+        loja = db.query(Loja).filter(Loja.store_id == store_id).first()
+        if not loja or not loja.access_token:
+            return
+        raw_token = decrypt_token(loja.access_token)
+        if not raw_token:
+            return
+        inject_script_tag(store_id, raw_token, get_loader_version(store_id, db))
+    except Exception as e:
+        print(f"Erro ao atualizar script tag da loja {store_id}: {e}")
+    finally:
+        db.close()
+
+
+def sincronizar_script_tags():
+    """
+    Roda uma vez por deploy: template do bootstrap, hash do core ou minificador
+    novos mudam o &v= de todas as lojas. Sem re-registrar, a script tag
+    continua com o hash antigo e o loader.js cai no max-age curto.
+    inject_script_tag so faz PUT quando a URL realmente mudou.
+    """
+    from app.database import SessionLocal
+
+    db = SessionLocal()
+    try:
+        store_ids = [
+            row[0] for row in db.query(Loja.store_id).filter(Loja.access_token.isnot(None)).all()
+        ]
+    finally:
+        db.close()
+
+    print(f"[SCRIPT TAG] Conferindo versao do loader em {len(store_ids)} loja(s)")
+    for store_id in store_ids:
+        atualizar_script_tag(store_id)
+
+
 def create_landing_page_internal(store_id: str, access_token: str, theme_color: str):
     """Cria página de download do app na loja."""
     urls = [
@@ -0,0 +1,107 @@
+# app/store_keys.py
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Optional
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+
+from app.database import Base
+from app.models import Loja
+
+# Mapa store_id (string da Nuvemshop) -> Loja.id (inteiro).
+# Loja.id nunca muda depois de criado, entao o cache positivo nao expira.
+_loja_ids: dict = {}
+
+# Cache negativo: store_id sem Loja, por pouco tempo e com teto de entradas.
+# A ingestao publica recebe qualquer store_id; sem isso cada evento de uma loja
+# desconhecida faria um SELECT. Loja instalada sai daqui no commit (vincular_loja).
+LOJA_NEGATIVA_TTL_SECONDS = int(os.getenv("LOJA_NEGATIVA_TTL_SECONDS", "60"))
+LOJA_NEGATIVA_MAX_ENTRIES = int(os.getenv("LOJA_NEGATIVA_MAX_ENTRIES", "10000"))
+_sem_loja: OrderedDict = OrderedDict()  # store_id -> expira_em (monotonic)
+_lock = threading.Lock()
+
+
+def _sem_loja_valido(store_id: str) -> bool:
+    with _lock:
+        expira_em = _sem_loja.get(store_id)
+        if expira_em is None:
+            return False
+        if time.monotonic() >= expira_em:
+            del _sem_loja[store_id]
+            return False
+        return True
+
+
+def _lembrar_sem_loja(store_id: str):
+    with _lock:
+        _sem_loja[store_id] = time.monotonic() + LOJA_NEGATIVA_TTL_SECONDS
+        _sem_loja.move_to_end(store_id)
+        while len(_sem_loja) > LOJA_NEGATIVA_MAX_ENTRIES:
+            _sem_loja.popitem(last=False)
+
+
+def get_loja_id(db: Session, store_id: str) -> Optional[int]:
+    """Resolve o store_id para a chave inteira da loja (uma query por processo)."""
+    if not store_id:
+        return None
+
+    loja_id = _loja_ids.get(store_id)
+    if loja_id is not None:
+        return loja_id
+    if _sem_loja_valido(store_id):
+        return None
+
+    row = db.query(Loja.id).filter(Loja.store_id == store_id).first()
+    if not row:
+        _lembrar_sem_loja(store_id)
+        return None
+
+    _loja_ids[store_id] = row[0]
+    return row[0]
+
+
+def filtro_loja(model, store_id: str, loja_id: Optional[int]):
+    """Filtro por loja: usa loja_id quando a loja existe, senao cai no store_id."""
+    if loja_id is not None:
+        return model.loja_id == loja_id
+    return model.store_id == store_id
+
+
+def _tabelas_com_loja_id() -> list:
+    return [
+        mapper.class_ for mapper in Base.registry.mappers
+        if mapper.class_ is not Loja
+        and "loja_id" in mapper.columns and "store_id" in mapper.columns
+    ]
+
+
+def vincular_loja(db: Session, loja: Loja):
+    """
+    Chamado quando a Loja e criada/reinstalada: preenche loja_id das linhas
+    gravadas enquanto ela ainda nao existia (loja_id NULL). Sem isso elas
+    ficariam fora do filtro_loja ate o backfill do proximo deploy.
+    O commit fica com quem chamou; o cache so e atualizado depois dele.
+    """
+    db.flush()
+    for model in _tabelas_com_loja_id():
+        db.query(model).filter(
+            model.loja_id.is_(None),
+            model.store_id == loja.store_id,
+        ).update({"loja_id": loja.id}, synchronize_session=False)
+    db.info.setdefault("lojas_vinculadas", {})[loja.store_id] = loja.id
+
+
+@event.listens_for(Session, "after_commit")
+def _aplicar_lojas_vinculadas(session):
+    # ✅ So depois do commit: rollback nao deixa loja_id fantasma no cache
+    for store_id, loja_id in session.info.pop("lojas_vinculadas", {}).items():
+        _loja_ids[store_id] = loja_id
+        with _lock:
+            _sem_loja.pop(store_id, None)
+
+
+@event.listens_for(Session, "after_rollback")
+def _descartar_lojas_vinculadas(session):
+    session.info.pop("lojas_vinculadas", None)
@@ -0,0 +1,28 @@
+{# Bootstrap por loja: aponta para a config versionada e injeta o core compartilhado #}
+(function() {
+    if (window.AppBuilderPWA) return;
+    var boot = window.AppBuilderPWA = {
+        storeId: {{ store_id|tojson }},
+        backendUrl: {{ backend_url|tojson }},
+        configUrls: {{ config_urls|tojson }}
+    };
+    function getJson(url) {
+        return fetch(url, { credentials: 'omit' }).then(function(r) {
+            if (!r.ok) throw new Error('HTTP ' + r.status);
+            return r.json();
+        });
+    }
+    // Proxy da loja primeiro (mesma origem); se falhar, direto no backend
+    boot.config = getJson(boot.configUrls[0]).catch(function() { return getJson(boot.configUrls[1]); });
+    // Build de debug (log na tela): ?pwa_debug=1 liga, ?pwa_debug=0 desliga — fica salvo no aparelho
+    var debug = false;
+    try {
+        var m = /[?&]pwa_debug=([01])/.exec(window.location.search);
+        if (m) localStorage.setItem('pwa_debug', m[1]);
+        debug = localStorage.getItem('pwa_debug') === '1';
+    } catch(e) {}
+    var s = document.createElement('script');
+    s.src = debug ? {{ debug_core_url|tojson }} : {{ core_url|tojson }};
+    s.async = true;
+    (document.head || document.documentElement).appendChild(s);
+})();
@@ -0,0 +1,841 @@
+{# Core do loader: nenhum dado de loja aqui dentro — tudo vem de window.AppBuilderPWA
+   e da config JSON. Por isso o mesmo arquivo serve todas as lojas.
+
+   Variaveis de build:
+   - debug: inclui a caixa de log na tela, pwaLog e o reset de SW a cada load
+   - features: widgets/integracoes ligados (fab, topbar, popup, push) — o resto nem entra no JS #}
+{% set install_ui = features.fab or features.topbar %}
+(function() {
+
+    var boot = window.AppBuilderPWA;
+    if (!boot || boot.started) return;
+    boot.started = true;
+
+    var storeId = boot.storeId;
+    var backendUrl = boot.backendUrl;
+    // SW por loja (precache e cache versionados pelo conteudo)
+    var swPath = '/apps/app-builder/service-worker/' + storeId + '.js';
+    var cfg = null;
+
+    // Manifest e captura do prompt de instalacao nao dependem da config:
+    // entram ja, para nao perder o beforeinstallprompt enquanto a config carrega
+    function initManifest() {
+        var link = document.createElement('link');
+        link.rel = 'manifest';
+        link.href = '/apps/app-builder/manifest/' + storeId + '.json';
+        document.head.appendChild(link);
+    }
+
+    function initInstallCapture() {
+        window.deferredPrompt = null;
+        window.addEventListener('beforeinstallprompt', function(e) {
+            e.preventDefault();
+            window.deferredPrompt = e;
+{% if features.popup %}
+            if (cfg) initInstallPopup();
+{% endif %}
+        });
+    }
+
+    try {
+        initManifest();
+        initInstallCapture();
+    } catch(e) {}
+
+    Promise.resolve(boot.config).then(function(config) {
+        if (!config) return;
+        cfg = config;
+        run();
+    }).catch(function(e) {
+        console.log('[PWA] Config indisponivel: ' + (e && e.message));
+    });
+
+    var visitorId = localStorage.getItem('pwa_v_id');
+    if (!visitorId) {
+        visitorId = 'v_' + Math.random().toString(36).substr(2,9) + Date.now().toString(36);
+        localStorage.setItem('pwa_v_id', visitorId);
+    }
+
+    var isApp = (
+        (window.matchMedia && window.matchMedia('(display-mode: standalone)').matches) ||
+        (window.matchMedia && window.matchMedia('(display-mode: fullscreen)').matches) ||
+        (window.matchMedia && window.matchMedia('(display-mode: minimal-ui)').matches) ||
+        window.navigator.standalone === true
+    );
+
+{% if debug %}
+    var logBox = null;
+
+    function pwaLog(msg) {
+        console.log('[PWA] ' + msg);
+        if (!logBox) return;
+        var line = document.createElement('div');
+        line.textContent = new Date().toLocaleTimeString('pt-BR') + ' - ' + msg;
+        logBox.appendChild(line);
+        logBox.scrollTop = logBox.scrollHeight;
+    }
+
+    function initDebugLog() {
+        if (!isApp) return;
+        logBox = document.createElement('div');
+        logBox.id = 'pwa-debug-log';
+        logBox.style.cssText = 'position:fixed;top:0;left:0;right:0;z-index:2147483647;' +
+            'background:rgba(0,0,0,0.88);color:#00FF00;' +
+            'font-family:monospace;font-size:11px;padding:8px 10px;' +
+            'max-height:220px;overflow-y:auto;';
+        var closeLog = document.createElement('button');
+        closeLog.textContent = 'fechar log';
+        closeLog.style.cssText = 'display:block;margin-bottom:6px;background:#333;color:#fff;border:none;padding:4px 8px;border-radius:4px;cursor:pointer;font-size:11px;';
+        closeLog.onclick = function() { logBox.remove(); };
+        logBox.appendChild(closeLog);
+        if (document.body) {
+            document.body.appendChild(logBox);
+        } else {
+            document.addEventListener('DOMContentLoaded', function() { document.body.appendChild(logBox); });
+        }
+    }
+
+{% endif %}
+    // PWA offline / rede instavel: o SW guarda o evento e reenvia em lote depois
+    var QUEUED_FLAG = 'pwa_analytics_queued';
+
+    function queueEvent(path, payload) {
+        if (!isApp || !('serviceWorker' in navigator)) return;
+        navigator.serviceWorker.getRegistration(swScope()).then(function(reg) {
+            var worker = reg && (reg.active || reg.waiting || reg.installing);
+            if (!worker) return;
+            worker.postMessage({ type:'analytics-queue', backend:backendUrl, path:path, payload:payload, at:Date.now() });
+            try { localStorage.setItem(QUEUED_FLAG, '1'); } catch(e) {}
+        }).catch(function() {});
+    }
+
+    // Eventos vao como text/plain (CORS "simple request"): sem preflight OPTIONS
+    // antes de cada POST. O backend le o corpo como JSON de qualquer forma.
+    function sendEvent(path, payload) {
+        var url = backendUrl + path;
+        var body = JSON.stringify(payload);
+        try {
+            if (isApp && navigator.onLine === false) {
+                queueEvent(path, payload);
+                return;
+            }
+            if (window.fetch) {
+                fetch(url, { method:'POST', headers:{'Content-Type':'text/plain;charset=UTF-8'}, body:body, keepalive:true })
+                    .then(function(res) { if (res.status >= 500) queueEvent(path, payload); })
+                    .catch(function() { queueEvent(path, payload); });
+                return;
+            }
+            if (navigator.sendBeacon) navigator.sendBeacon(url, new Blob([body], { type:'text/plain;charset=UTF-8' }));
+        } catch(e) {}
+    }
+
+{% if install_ui or features.popup %}
+    function trackInstall() {
+        sendEvent('/analytics/install', {store_id:storeId,visitor_id:visitorId});
+    }
+
+{% endif %}
+{% if install_ui %}
+    function promptInstall(onAccepted) {
+        if (!window.deferredPrompt) { showInstallHelpModal(); return; }
+        window.deferredPrompt.prompt();
+        window.deferredPrompt.userChoice.then(function(r) {
+            if (r.outcome === 'accepted') {
+                if (onAccepted) onAccepted();
+                trackInstall();
+            }
+            window.deferredPrompt = null;
+        });
+    }
+
+    function showInstallHelpModal() {
+        var existing = document.getElementById('pwa-install-modal');
+        if (existing) existing.remove();
+        var ua = navigator.userAgent || '';
+        var isSamsung = ua.toLowerCase().indexOf('samsungbrowser') !== -1;
+        var isSafari = ua.includes('Safari') && !ua.includes('Chrome');
+        var steps = isSamsung
+            ? '1. Toque no menu.\n2. Escolha Adicionar a Tela inicial.\n3. Confirme e toque em Adicionar.'
+            : isSafari
+            ? '1. Toque no icone de compartilhar.\n2. Selecione Adicionar a Tela de Inicio.\n3. Confirme e toque em Adicionar.'
+            : '1. Abra o menu do navegador.\n2. Toque em Instalar app ou Adicionar a Tela inicial.\n3. Confirme para instalar.';
+        var modal = document.createElement('div');
+        modal.id = 'pwa-install-modal';
+        modal.style.cssText = 'position:fixed;inset:0;background:rgba(0,0,0,0.55);z-index:2147483648;display:flex;align-items:center;justify-content:center;';
+        var box = document.createElement('div');
+        box.style.cssText = 'background:#fff;max-width:90%;border-radius:12px;padding:20px;font-family:sans-serif;color:#222;box-shadow:0 8px 30px rgba(0,0,0,0.25);';
+        box.innerHTML = "<div style='font-size:18px;font-weight:bold;margin-bottom:8px;'>Instalar aplicativo</div>" +
+                        "<div style='font-size:14px;line-height:1.5;margin-bottom:12px;'>Siga os passos para instalar na tela inicial:</div>" +
+                        "<pre style='white-space:pre-wrap;font-size:13px;background:#f5f5f5;padding:10px;border-radius:8px;'>" + steps + "</pre>" +
+                        "<button id='pwa-install-modal-close' style='margin-top:14px;width:100%;padding:10px 0;border:none;border-radius:8px;color:#fff;font-weight:bold;font-size:14px;cursor:pointer;'>Entendi</button>";
+        modal.appendChild(box);
+        document.body.appendChild(modal);
+        var closeBtn = document.getElementById('pwa-install-modal-close');
+        closeBtn.style.background = cfg ? cfg.theme_color : '#000000';
+        closeBtn.onclick = function() { modal.remove(); };
+    }
+
+{% endif %}
+{% if features.topbar or features.popup %}
+    function cssUrl(url) {
+        return 'url("' + String(url).replace(/["\\\n\r]/g, '') + '")';
+    }
+
+{% endif %}
+    // =============================================
+    // WIDGETS — so entram no build quando habilitados em alguma config
+    // =============================================
+{% if features.fab %}
+    function initFab() {
+        var fabCfg = cfg.fab;
+        if (!fabCfg) return;
+        if (isApp) return;
+        if (window.innerWidth >= 900) return;
+        setTimeout(function() {
+            var fab = document.createElement('div');
+            fab.id = 'pwa-fab-btn';
+            var side = fabCfg.position === 'right' ? 'right:' : 'left:';
+            fab.style.cssText = 'position:fixed;bottom:' + fabCfg.offset_px + 'px;' + side + fabCfg.offset_px + 'px;background:' + fabCfg.color + ';color:white;width:' + fabCfg.width + 'px;height:' + fabCfg.height + 'px;border-radius:9999px;box-shadow:0 4px 15px rgba(0,0,0,0.3);z-index:2147483647;font-family:sans-serif;font-weight:bold;font-size:13px;display:flex;align-items:center;justify-content:center;gap:8px;cursor:pointer;padding:0 22px;';
+            var iconSpan = document.createElement('span');
+            iconSpan.style.fontSize = '20px';
+            iconSpan.textContent = fabCfg.icon;
+            var textSpan = document.createElement('span');
+            textSpan.textContent = fabCfg.text;
+            textSpan.style.whiteSpace = 'nowrap';
+            fab.appendChild(iconSpan);
+            fab.appendChild(textSpan);
+            fab.onclick = function() {
+                promptInstall(function() { fab.style.display = 'none'; });
+            };
+            fab.animate([{transform:'translateY(100px)',opacity:0},{transform:'translateY(0)',opacity:1}],{duration:500,easing:'ease-out'});
+            document.body.appendChild(fab);
+            // Pulso a cada 5s numa unica animacao infinita (transform roda no compositor, sem timer JS)
+            fab.animate([
+                {transform:'scale(1)', offset:0},
+                {transform:'scale(1.05)', offset:0.1},
+                {transform:'scale(1)', offset:0.2},
+                {transform:'scale(1)', offset:1}
+            ], {duration:5000, delay:5000, iterations:Infinity});
+        }, fabCfg.delay_ms);
+    }
+
+{% endif %}
+{% if features.topbar %}
+    function initTopbarWidget() {
+        var barCfg = cfg.topbar;
+        if (!barCfg) return;
+        try {
+            if (isApp) return;
+            if (window.innerWidth >= 900) return;
+            if (document.getElementById('pwa-topbar-widget')) return;
+            var bar = document.createElement('div');
+            bar.id = 'pwa-topbar-widget';
+            var positionCss = barCfg.position === 'top' ? 'top:0;' : 'bottom:0;';
+            var backgroundCss = barCfg.background_image_url
+                ? 'background-image:' + cssUrl(barCfg.background_image_url) + ';background-size:cover;background-position:center;'
+                : 'background:' + barCfg.color + ';';
+            bar.style.cssText = 'position:fixed;' + positionCss + 'left:0;right:0;' + backgroundCss + 'color:' + barCfg.text_color + ';padding:10px 14px;display:flex;align-items:center;justify-content:space-between;font-family:sans-serif;font-size:13px;z-index:2147483647;box-shadow:0 2px 8px rgba(0,0,0,0.3);';
+            try {
+                var barHeight = 44;
+                if (barCfg.position === 'top') {
+                    var ct = window.getComputedStyle(document.body).paddingTop || '0px';
+                    document.body.style.paddingTop = (parseInt(ct,10)||0) + barHeight + 'px';
+                } else {
+                    var cb = window.getComputedStyle(document.body).paddingBottom || '0px';
+                    document.body.style.paddingBottom = (parseInt(cb,10)||0) + barHeight + 'px';
+                }
+            } catch(e) {}
+            var left = document.createElement('div');
+            left.style.cssText = 'display:flex;align-items:center;gap:8px;';
+            var iconSpan = document.createElement('span');
+            iconSpan.textContent = barCfg.icon;
+            iconSpan.style.fontSize = '16px';
+            var overlayText = document.createElement('span');
+            overlayText.textContent = barCfg.text;
+            overlayText.style.flex = '1';
+            left.appendChild(iconSpan);
+            left.appendChild(overlayText);
+            var btn = document.createElement('button');
+            btn.textContent = barCfg.button_text;
+            btn.style.cssText = 'background:' + barCfg.button_bg_color + ';color:' + barCfg.button_text_color + ';border:none;border-radius:999px;padding:6px 12px;font-size:12px;font-weight:600;cursor:pointer;';
+            btn.onclick = function() { promptInstall(); };
+            bar.appendChild(left);
+            bar.appendChild(btn);
+            document.body.appendChild(bar);
+        } catch(e) { console.log('Topbar widget error:', e); }
+    }
+
+{% endif %}
+{% if features.popup %}
+    function initInstallPopup() {
+        var popupCfg = cfg.popup;
+        if (!popupCfg) return;
+        try {
+            if (isApp) return;
+            if (window.innerWidth >= 900) return;
+            if (!window.deferredPrompt) return;
+            if (document.getElementById('pwa-install-popup')) return;
+            var overlay = document.createElement('div');
+            overlay.id = 'pwa-install-popup';
+            overlay.style.cssText = 'position:fixed;inset:0;background:rgba(0,0,0,0.6);z-index:2147483647;display:flex;align-items:center;justify-content:center;';
+            var box = document.createElement('div');
+            box.style.cssText = 'position:relative;width:90%;max-width:400px;border-radius:16px;overflow:hidden;box-shadow:0 10px 30px rgba(0,0,0,0.5);background:#000;';
+            var img = document.createElement('div');
+            img.style.cssText = 'width:100%;padding-top:177%;background-image:' + cssUrl(popupCfg.image_url) + ';background-size:cover;background-position:center;';
+            var btnArea = document.createElement('div');
+            btnArea.style.cssText = 'position:absolute;bottom:12px;left:0;right:0;display:flex;justify-content:center;gap:8px;';
+            var installBtn = document.createElement('button');
+            installBtn.textContent = 'Instalar app';
+            installBtn.style.cssText = 'background:#10B981;color:#fff;border:none;border-radius:999px;padding:10px 18px;font-size:14px;font-weight:600;cursor:pointer;';
+            installBtn.onclick = function() {
+                if (!window.deferredPrompt) { overlay.remove(); return; }
+                window.deferredPrompt.prompt();
+                window.deferredPrompt.userChoice.then(function(r) {
+                    if (r.outcome === 'accepted') trackInstall();
+                    window.deferredPrompt = null;
+                    overlay.remove();
+                });
+            };
+            var closeBtn = document.createElement('button');
+            closeBtn.textContent = 'Fechar';
+            closeBtn.style.cssText = 'background:rgba(0,0,0,0.6);color:#fff;border:none;border-radius:999px;padding:8px 14px;font-size:12px;cursor:pointer;';
+            closeBtn.onclick = function() { overlay.remove(); };
+            btnArea.appendChild(installBtn);
+            btnArea.appendChild(closeBtn);
+            box.appendChild(img);
+            box.appendChild(btnArea);
+            overlay.appendChild(box);
+            document.body.appendChild(overlay);
+        } catch(e) { console.log('Popup install error:', e); }
+    }
+
+{% endif %}
+    function isPwaMode() {
+        try {
+            if (window.matchMedia) {
+                if (window.matchMedia('(display-mode: standalone)').matches) return true;
+                if (window.matchMedia('(display-mode: fullscreen)').matches) return true;
+                if (window.matchMedia('(display-mode: minimal-ui)').matches) return true;
+            }
+            if (window.navigator.standalone === true) return true;
+        } catch(e) {}
+        return false;
+    }
+
+    function initBottomBar() {
+        try {
+            if (!isPwaMode()) return;
+            if (window.innerWidth > 900) return;
+            if (document.getElementById('pwa-bottom-nav')) return;
+            var bar = document.createElement('nav');
+            bar.id = 'pwa-bottom-nav';
+            bar.style.cssText = 'position:fixed;bottom:0;left:0;right:0;height:72px;background:' + cfg.bottom_bar.bg + ';border-top:1px solid #e5e7eb;display:flex;justify-content:space-around;align-items:center;font-family:-apple-system,BlinkMacSystemFont,system-ui,sans-serif;z-index:2147483647;padding-bottom:env(safe-area-inset-bottom,0);';
+            try {
+                var cp = window.getComputedStyle(document.body).paddingBottom || '0px';
+                document.body.style.paddingBottom = (parseInt(cp,10)||0) + 72 + 'px';
+            } catch(e) {}
+            function createItem(svgPath, label, href) {
+                var btn = document.createElement('button');
+                btn.style.cssText = 'background:none;border:none;display:flex;flex-direction:column;align-items:center;justify-content:center;gap:4px;color:' + cfg.bottom_bar.icon_color + ';cursor:pointer;';
+                btn.onclick = function() { try { if (href) window.location.href = href; } catch(e) {} };
+                var iw = document.createElement('div');
+                iw.style.cssText = 'width:28px;height:28px;display:flex;align-items:center;justify-content:center;';
+                var svg = document.createElementNS('http://www.w3.org/2000/svg','svg');
+                svg.setAttribute('viewBox','0 0 24 24');
+                svg.setAttribute('width','28');
+                svg.setAttribute('height','28');
+                svg.style.fill = 'currentColor';
+                var path = document.createElementNS('http://www.w3.org/2000/svg','path');
+                path.setAttribute('d', svgPath);
+                svg.appendChild(path);
+                iw.appendChild(svg);
+                var text = document.createElement('span');
+                text.textContent = label;
+                text.style.cssText = 'font-size:9px;font-weight:600;text-transform:uppercase;letter-spacing:0.04em;';
+                btn.appendChild(iw);
+                btn.appendChild(text);
+                return btn;
+            }
+            bar.appendChild(createItem('M10 20v-6h4v6h5v-8h3L12 3 2 12h3v8z','Inicio','/'));
+            bar.appendChild(createItem('M7 18c-1.1 0-2-.9-2-2V6h14v10c0 1.1-.9 2-2 2H7zm0-2h10V8H7v8zM9 4V2h6v2h5v2H4V4h5z','Loja','/produtos'));
+            bar.appendChild(createItem('M12 22c1.1 0 2-.9 2-2h-4a2 2 0 0 0 2 2zm6-6V11c0-3.07-1.63-5.64-4.5-6.32V4a1.5 1.5 0 0 0-3 0v.68C7.63 5.36 6 7.92 6 11v5l-1.5 1.5v.5h15v-.5L18 16z','Alertas','/notificacoes'));
+            bar.appendChild(createItem('M12 12c2.21 0 4-1.79 4-4s-1.79-4-4-4-4 1.79-4 4 1.79 4 4 4zm0 2c-2.67 0-8 1.34-8 4v2h16v-2c0-2.66-5.33-4-8-4z','Conta','/minha-conta'));
+            document.body.appendChild(bar);
+        } catch(e) { console.log('Bottom bar error:', e); }
+    }
+
+    function initMeta() {
+        var meta = document.createElement('meta');
+        meta.name = 'theme-color';
+        meta.content = cfg.theme_color;
+        document.head.appendChild(meta);
+    }
+
+    function buildVisitPayload() {
+        var payload = { store_id:storeId, pagina:window.location.pathname, is_pwa:isApp, visitor_id:visitorId };
+        try { if (window.LS && LS.store) payload.store_ls_id = LS.store.id; } catch(e) {}
+        try { if (window.LS && LS.product) { payload.product_id = LS.product.id; if (LS.product.name) payload.product_name = LS.product.name; } } catch(e) {}
+        try { if (window.LS && LS.cart) { if (typeof LS.cart.subtotal !== 'undefined') payload.cart_total = LS.cart.subtotal; if (Array.isArray(LS.cart.items)) payload.cart_items_count = LS.cart.items.length; } } catch(e) {}
+        return payload;
+    }
+
+    function trackVisit() {
+        sendEvent('/analytics/visita', buildVisitPayload());
+    }
+
+    function initAnalytics() {
+        trackVisit();
+        onLocationChange(trackVisit);
+    }
+
+{% if features.push %}
+    // =============================================
+    // IDENTITY — loga o cliente no OneSignal pelo e-mail
+    // Funciona quando a Nuvemshop expoe LS.customer
+    // =============================================
+    function initUserIdentity() {
+        try {
+            var email = null;
+            var customerId = null;
+
+            if (window.LS && window.LS.customer) {
+                email = window.LS.customer.email || null;
+                customerId = window.LS.customer.id ? String(window.LS.customer.id) : null;
+            }
+
+            if (!email) {
+                var emailInput = document.querySelector('input[type="email"]');
+                if (emailInput && emailInput.value && emailInput.value.includes('@')) {
+                    email = emailInput.value.trim();
+                }
+            }
+
+            if (!email && !customerId) {
+{% if debug %}
+                pwaLog('Identity: cliente anonimo');
+{% endif %}
+                return;
+            }
+
+            var externalId = email || ('ns_' + customerId);
+{% if debug %}
+            pwaLog('Identity: logando como ' + externalId);
+{% endif %}
+
+            window.OneSignalDeferred = window.OneSignalDeferred || [];
+            window.OneSignalDeferred.push(function(OneSignal) {
+                OneSignal.login(externalId).then(function() {
+{% if debug %}
+                    pwaLog('Identity: ok - ' + externalId);
+{% endif %}
+                    if (email) OneSignal.User.addTag('email', email);
+                    if (customerId) OneSignal.User.addTag('customer_id', customerId);
+                }).catch(function(e) {
+                    console.log('[PWA] Identity erro: ' + e.message);
+                });
+            });
+        } catch(e) {
+            console.log('[PWA] Identity erro: ' + e.message);
+        }
+    }
+
+{% if debug %}
+    function checkSubStatus() {
+        try {
+            var subId = window.OneSignal.User.PushSubscription.id;
+            var token = window.OneSignal.User.PushSubscription.token;
+            var optedIn = window.OneSignal.User.PushSubscription.optedIn;
+            pwaLog('--- STATUS SUBSCRIPTION ---');
+            pwaLog('optedIn: ' + optedIn);
+            pwaLog('id: ' + (subId || 'null'));
+            pwaLog('token: ' + (token ? token.substring(0,30)+'...' : 'null'));
+        } catch(e) { pwaLog('Erro checkSubStatus: ' + e.message); }
+    }
+
+{% endif %}
+    function optIn() {
+        window.OneSignal.User.PushSubscription.optIn().then(function() {
+{% if debug %}
+            pwaLog('optIn() concluido');
+            setTimeout(checkSubStatus, 3000);
+{% endif %}
+        }).catch(function(e) {
+            console.log('[PWA] optIn() erro: ' + e.message);
+        });
+    }
+
+    function requestPermission() {
+        try {
+            return new Promise(function(resolve) {
+                // Safari antigo usa callback em vez de Promise
+                var result = Notification.requestPermission(resolve);
+                if (result && result.then) result.then(resolve);
+            });
+        } catch(e) {
+            return Promise.resolve('default');
+        }
+    }
+
+    function showNotificationBar() {
+        if (document.getElementById('pwa-notification-bar')) return;
+
+        setTimeout(function() {
+            if (document.getElementById('pwa-notification-bar')) return;
+            var bar = document.createElement('div');
+            bar.id = 'pwa-notification-bar';
+            bar.style.cssText = 'position:fixed;bottom:80px;left:12px;right:12px;z-index:2147483647;' +
+                'background:#111827;color:#F9FAFB;padding:12px 14px;' +
+                'display:flex;align-items:center;justify-content:space-between;' +
+                'font-family:sans-serif;font-size:13px;' +
+                'box-shadow:0 4px 20px rgba(0,0,0,0.4);border-radius:12px;' +
+                'animation:pwaBannerUp 0.4s ease-out;';
+            bar.innerHTML =
+                '<style>@keyframes pwaBannerUp{from{transform:translateY(30px);opacity:0}to{transform:translateY(0);opacity:1}}</style>' +
+                '<div style="display:flex;align-items:center;gap:8px;flex:1;">' +
+                  '<span style="font-size:18px;">&#128276;</span>' +
+                  '<span style="line-height:1.3;">Ative notificacoes e receba cupons exclusivos!</span>' +
+                '</div>' +
+                '<div style="display:flex;gap:6px;margin-left:10px;">' +
+                  '<button id="pwa-notif-allow" style="padding:7px 12px;border-radius:8px;border:none;background:#22C55E;color:#fff;font-weight:bold;font-size:12px;cursor:pointer;white-space:nowrap;">Ativar</button>' +
+                  '<button id="pwa-notif-close" style="padding:7px 8px;border-radius:8px;border:none;background:transparent;color:#9CA3AF;font-size:18px;line-height:1;cursor:pointer;">x</button>' +
+                '</div>';
+            document.body.appendChild(bar);
+
+            document.getElementById('pwa-notif-allow').onclick = function() {
+                localStorage.setItem('notif_asked', '1');
+                bar.remove();
+                // Pede a permissao nativa ainda dentro do clique (gesto do usuario);
+                // o SDK so e baixado se o cliente aceitar
+                requestPermission().then(function(permission) {
+{% if debug %}
+                    pwaLog('requestPermission: ' + permission);
+{% endif %}
+                    if (permission === 'granted') loadOneSignal(optIn);
+                });
+            };
+            document.getElementById('pwa-notif-close').onclick = function() {
+                localStorage.setItem('notif_asked', '1');
+                bar.remove();
+            };
+        }, 3000);
+    }
+
+    function initOneSignalInApp() {
+        if (!isApp) return;
+
+        var appId = cfg.onesignal_app_id;
+        if (!appId) return;
+
+        // SDK do OneSignal sob demanda:
+        // - permissao negada, ou ja perguntamos e nao foi concedida: nem baixa
+        // - ja concedida: carrega no idle (login/tags/optIn)
+        // - nunca perguntada: mostra so a barra; o SDK vem no clique em "Ativar"
+        var permission = typeof Notification !== 'undefined' ? Notification.permission : 'unsupported';
+{% if debug %}
+        pwaLog('Notification.permission: ' + permission);
+{% endif %}
+        if (permission === 'unsupported' || permission === 'denied') return;
+        if (permission === 'granted') {
+            onIdle(function() { loadOneSignal(optIn); });
+            return;
+        }
+        if (localStorage.getItem('notif_asked')) {
+{% if debug %}
+            pwaLog('SDK nao carregado: notif_asked salvo');
+{% endif %}
+            return;
+        }
+        showNotificationBar();
+    }
+
+    var oneSignalRequested = false;
+
+    function loadOneSignal(onReady) {
+        if (oneSignalRequested) return;
+        oneSignalRequested = true;
+        var appId = cfg.onesignal_app_id;
+
+        window.OneSignalDeferred = window.OneSignalDeferred || [];
+        window.OneSignalDeferred.push(async function(OneSignal) {
+            try {
+                window.OneSignal = OneSignal;
+                await OneSignal.init({
+                    appId: appId,
+                    serviceWorkerPath: swPath,
+                    serviceWorkerParam: { scope: swScope() },
+                });
+{% if debug %}
+                pwaLog('OneSignal.init() concluido - appId: ' + appId.substring(0,8) + '...');
+                try {
+                    pwaLog('optedIn: ' + OneSignal.User.PushSubscription.optedIn);
+                    pwaLog('subscription id: ' + (OneSignal.User.PushSubscription.id || 'null'));
+                } catch(e) { pwaLog('Erro ao ler sub: ' + e.message); }
+{% endif %}
+
+                initUserIdentity();
+                if (onReady) onReady();
+            } catch(err) {
+                console.log('[PWA] Erro no OneSignal.init(): ' + err.message);
+            }
+        });
+
+        if (!document.querySelector('script[src*="OneSignalSDK.page.js"]')) {
+            var sdkScript = document.createElement('script');
+            sdkScript.src = 'https://cdn.onesignal.com/sdks/web/v16/OneSignalSDK.page.js';
+            sdkScript.async = true;
+            sdkScript.onerror = function() { console.log('[PWA] ERRO ao carregar SDK'); };
+            document.head.appendChild(sdkScript);
+{% if debug %}
+            pwaLog('SDK OneSignal injetado');
+{% endif %}
+        }
+    }
+
+    function initCartTracking() {
+        try {
+            if (window.location.href.includes('/checkout/success') || window.location.href.includes('/order-received')) {
+                window.OneSignalDeferred = window.OneSignalDeferred || [];
+                window.OneSignalDeferred.push(function(OneSignal) {
+                    OneSignal.User.addTag('carrinho_ativo', 'false');
+                });
+                return;
+            }
+
+            var lastCartCount = -1;
+            function checkCart() {
+                try {
+                    if (window.LS && window.LS.cart && Array.isArray(window.LS.cart.items)) {
+                        var currentCount = window.LS.cart.items.length;
+                        if (currentCount !== lastCartCount) {
+                            lastCartCount = currentCount;
+                            window.OneSignalDeferred = window.OneSignalDeferred || [];
+                            window.OneSignalDeferred.push(function(OneSignal) {
+                                OneSignal.User.addTag('carrinho_ativo', currentCount > 0 ? 'true' : 'false');
+{% if debug %}
+                                pwaLog('Carrinho: ' + (currentCount > 0 ? 'true (' + currentCount + ' itens)' : 'false (vazio)'));
+{% endif %}
+                            });
+                        }
+                    }
+                } catch(err) {}
+            }
+
+            // Em vez de polling: confere o carrinho quando algo pode te-lo mudado.
+            // O LS.cart e atualizado depois do request do tema, entao confere de novo um pouco depois.
+            function checkCartSoon() {
+                setTimeout(checkCart, 1000);
+                setTimeout(checkCart, 3000);
+            }
+            checkCart();
+            onLocationChange(checkCart);
+            window.addEventListener('pageshow', checkCart);
+            document.addEventListener('visibilitychange', function() {
+                if (document.visibilityState === 'visible') checkCart();
+            });
+            document.addEventListener('click', function(e) {
+                var el = e.target && e.target.closest ? e.target.closest(CART_ACTION_SELECTOR) : null;
+                if (el) checkCartSoon();
+            }, true);
+            document.addEventListener('submit', function(e) {
+                var form = e.target;
+                if (form && form.matches && (form.matches(CART_FORM_SELECTOR) || form.querySelector(CART_ACTION_SELECTOR))) checkCartSoon();
+            }, true);
+        } catch(e) {
+            console.log('[PWA] Erro Cart Tracking: ' + e.message);
+        }
+    }
+
+{% endif %}
+    function initVariantTracking() {
+        try {
+            if (window.LS && typeof LS.registerOnChangeVariant === 'function') {
+                LS.registerOnChangeVariant(function(variant) {
+                    try {
+                        var productId = null, productName = null;
+                        try { if (LS.product) { productId = LS.product.id||null; productName = LS.product.name||null; } } catch(e) {}
+                        var payload = { store_id:storeId, visitor_id:visitorId, product_id:productId?String(productId):'', variant_id:variant&&variant.id?String(variant.id):'', variant_name:variant&&variant.name?String(variant.name):productName||null, price:variant&&typeof variant.price!=='undefined'?String(variant.price):null, stock:variant&&typeof variant.stock!=='undefined'?variant.stock:null };
+                        if (!payload.variant_id) return;
+                        sendEvent('/analytics/variant', payload);
+                    } catch(err) {}
+                });
+            }
+        } catch(e) {}
+    }
+
+    function initSalesTracking() {
+        try {
+            if (window.location.href.includes('/checkout/success') || window.location.href.includes('/order-received')) {
+                var val = '0.00';
+                if (window.dataLayer) {
+                    for (var i = 0; i < window.dataLayer.length; i++) {
+                        if (window.dataLayer[i].transactionTotal) { val = window.dataLayer[i].transactionTotal; break; }
+                        if (window.dataLayer[i].value) { val = window.dataLayer[i].value; break; }
+                    }
+                }
+                var oid = window.location.href.split('/').pop();
+                if (!localStorage.getItem('venda_' + oid) && parseFloat(val) > 0) {
+                    sendEvent('/analytics/venda', {store_id:storeId,valor:val.toString(),visitor_id:visitorId});
+                    localStorage.setItem('venda_' + oid, 'true');
+                }
+            }
+        } catch(e) {}
+    }
+
+    // =============================================
+    // SERVICE WORKER — /apps/app-builder/ por padrao; "/" quando a loja liga
+    // o cache de navegacao (o SW precisa controlar as paginas da vitrine)
+    // =============================================
+    function swScope() {
+        return (cfg && cfg.sw_scope) || '/apps/app-builder/';
+    }
+
+    function syncServiceWorkers(scopeUrl) {
+        var legacyDone = !!localStorage.getItem('pwa_sw_cleanup_v1');
+        navigator.serviceWorker.getRegistrations().then(function(registrations) {
+            registrations.forEach(function(r) {
+                if (r.scope === scopeUrl) return;
+                var worker = r.active || r.waiting || r.installing;
+                var ours = !!worker && worker.scriptURL.indexOf('/apps/app-builder/') !== -1;
+                // SW do app em outro scope (estrategia de navegacao mudou) ou
+                // SW antigo na raiz da loja (versoes anteriores do app — uma vez por aparelho)
+                if (ours || (!legacyDone && r.scope.endsWith('/') && !r.scope.includes('/apps/'))) {
+{% if debug %}
+                    pwaLog('SW desregistrando: ' + r.scope);
+{% endif %}
+                    r.unregister();
+                }
+            });
+            localStorage.setItem('pwa_sw_cleanup_v1', '1');
+        });
+    }
+
+    function initServiceWorker() {
+        if (!isApp) return;
+        if (!('serviceWorker' in navigator)) return;
+        var scope = swScope();
+        syncServiceWorkers(new URL(scope, window.location.origin).href);
+        navigator.serviceWorker.register(swPath, { scope: scope })
+            .then(function(reg) {
+{% if debug %}
+                pwaLog('SW registrado: ' + reg.scope);
+{% endif %}
+                // Replay da fila offline (o Background Sync cobre isso onde existe)
+                if (navigator.onLine !== false && localStorage.getItem(QUEUED_FLAG) && reg.active) {
+                    localStorage.removeItem(QUEUED_FLAG);
+                    reg.active.postMessage({ type:'analytics-flush' });
+                }
+            })
+            .catch(function(err) {
+                console.log('[PWA] SW erro: ' + err.message);
+            });
+    }
+
+    // =============================================
+    // AGENDAMENTO / EVENTOS — nada de polling nem observer no body inteiro
+    // =============================================
+{% if features.push %}
+    // Cliques/submits do tema que mexem no carrinho
+    var CART_ACTION_SELECTOR = '.js-addtocart, .js-prod-submit-form, [data-store^="product-buy-button"], [name="add_to_cart"], .js-cart-item-delete, .js-cart-quantity-btn';
+    var CART_FORM_SELECTOR = '.js-product-form, form[action*="/comprar"]';
+
+{% endif %}
+    var locationListeners = null;
+
+    // SPA dos temas troca a URL via History API: embrulha pushState/replaceState
+    // e escuta popstate/hashchange, avisando so quando o href muda de fato
+    function onLocationChange(fn) {
+        if (!locationListeners) {
+            locationListeners = [];
+            var lastHref = window.location.href;
+            var notify = function() {
+                if (window.location.href === lastHref) return;
+                lastHref = window.location.href;
+                locationListeners.forEach(function(listener) {
+                    try { listener(); } catch(e) {}
+                });
+            };
+            ['pushState', 'replaceState'].forEach(function(method) {
+                var original = history[method];
+                if (typeof original !== 'function') return;
+                history[method] = function() {
+                    var result = original.apply(this, arguments);
+                    notify();
+                    return result;
+                };
+            });
+            window.addEventListener('popstate', notify);
+            window.addEventListener('hashchange', notify);
+        }
+        locationListeners.push(fn);
+    }
+
+    // Widgets e trackers secundarios esperam o navegador ficar ocioso
+    function onIdle(fn) {
+        if ('requestIdleCallback' in window) {
+            window.requestIdleCallback(fn, { timeout: 3000 });
+        } else {
+            setTimeout(fn, 800);
+        }
+    }
+
+    function whenReady(fn) {
+        if (document.readyState === 'loading') {
+            document.addEventListener('DOMContentLoaded', fn);
+        } else {
+            fn();
+        }
+    }
+
+    function run() {
+{% if debug %}
+        // So no build de debug: comeca sempre do zero, sem SW de sessoes anteriores
+        if ('serviceWorker' in navigator) {
+            navigator.serviceWorker.getRegistrations().then(function(regs) {
+                regs.forEach(function(r) { r.unregister(); });
+            });
+        }
+
+        initDebugLog();
+        pwaLog('Loader v11 - build de debug');
+        pwaLog('isApp: ' + isApp);
+        pwaLog('permission: ' + (typeof Notification !== 'undefined' ? Notification.permission : 'indisponivel'));
+        pwaLog('notif_asked: ' + localStorage.getItem('notif_asked'));
+        pwaLog('onesignal_app_id: ' + (cfg.onesignal_app_id || 'NAO CONFIGURADO'));
+
+{% endif %}
+        try {
+            initMeta();
+            initAnalytics();
+            initServiceWorker();
+{% if features.push %}
+            initOneSignalInApp();
+{% endif %}
+        } catch(e) {
+            console.log('[PWA] Erro critico: ' + e.message);
+        }
+
+        whenReady(function() {
+            try { initBottomBar(); } catch(e) {}
+        });
+
+        onIdle(function() {
+            try {
+{% if features.fab %}
+                initFab();
+{% endif %}
+{% if features.topbar %}
+                initTopbarWidget();
+{% endif %}
+{% if features.popup %}
+                initInstallPopup();
+{% endif %}
+                initVariantTracking();
+                initSalesTracking();
+{% if features.push %}
+                initCartTracking();
+{% endif %}
+            } catch(e) {}
+        });
+    }
+
+})();
@@ -0,0 +1,480 @@
+{# Service Worker por loja.
+   - cache_version: hash do proprio conteudo (render em duas passadas) — muda junto com
+     qualquer alteracao do SW ou da lista de precache, e o activate limpa a versao anterior
+   - precache_urls: manifest, icones e imagens configuradas da loja
+   - navigation_strategy: off | swr | app_shell (cache das paginas da vitrine) #}
+importScripts("https://cdn.onesignal.com/sdks/web/v16/OneSignalSDK.sw.js");
+
+const CACHE_PREFIX = 'app-builder-';
+const CACHE_NAME = CACHE_PREFIX + {{ cache_version|tojson }};
+const PRECACHE_URLS = {{ precache_urls|tojson }};
+
+// Caches "runtime" sobrevivem a troca de versao do SW (nao tem o hash no nome)
+const RUNTIME_PREFIX = CACHE_PREFIX + 'rt-';
+
+// Um cache por tipo, cada um com limite de entradas e de bytes (LRU via IndexedDB)
+const RUNTIME_BUCKETS = {
+    pages: { maxEntries: 30, maxBytes: 6 * 1024 * 1024 },
+    scripts: { maxEntries: 40, maxBytes: 6 * 1024 * 1024 },
+    styles: { maxEntries: 20, maxBytes: 2 * 1024 * 1024 },
+    images: { maxEntries: 120, maxBytes: 20 * 1024 * 1024 },
+    meta: { maxEntries: 10, maxBytes: 256 * 1024 },
+};
+// Resposta opaca (CDN sem CORS) nao expoe o tamanho — conta por estimativa
+const OPAQUE_ENTRY_BYTES = 256 * 1024;
+const META_DB = 'app-builder-rt';
+const META_STORE = 'entries';
+
+// Fila de analytics offline (eventos que a vitrine nao conseguiu enviar)
+const QUEUE_DB = 'app-builder-queue';
+const QUEUE_STORE = 'events';
+const QUEUE_MAX_EVENTS = 500;
+const QUEUE_MAX_AGE_MS = 7 * 24 * 60 * 60 * 1000;
+const BATCH_MAX_EVENTS = 200;
+const SYNC_TAG = 'analytics-replay';
+
+const NAVIGATION_STRATEGY = {{ navigation_strategy|tojson }};
+const NAVIGATION_TIMEOUT_MS = 3000;
+const SHELL_URL = '/';
+// Paginas com estado do cliente nunca vao para o cache
+const NAVIGATION_DENYLIST = /\/(checkout|carrinho|cart|comprar|account|minha-conta|login|logout|admin)(\/|$)/i;
+// Parametros de campanha nao mudam a pagina — mesma entrada de cache
+const IGNORED_PARAMS = /^(utm_|fbclid$|gclid$|store_id$)/;
+
+// Imagens de CDN sem CORS: tenta cors (resposta legivel) e cai para no-cors (opaca)
+function precacheOne(cache, url) {
+    return fetch(new Request(url, { mode: 'cors', credentials: 'omit' }))
+        .then((res) => {
+            if (!res.ok) throw new Error('HTTP ' + res.status);
+            return res;
+        })
+        .catch(() => fetch(new Request(url, { mode: 'no-cors', credentials: 'omit' })))
+        .then((res) => cache.put(url, res))
+        .catch((err) => {
+            console.warn('SW: erro no precache de ' + url, err);
+        });
+}
+
+self.addEventListener('install', (event) => {
+    event.waitUntil(Promise.all([
+        caches.open(CACHE_NAME).then((cache) => {
+            return Promise.all(PRECACHE_URLS.map((url) => precacheOne(cache, url)));
+        }),
+        // App shell ja quente para o primeiro launch do PWA
+        NAVIGATION_STRATEGY === 'off' ? null : fetch(SHELL_URL, { credentials: 'include' })
+            .then((res) => putPage(new Request(SHELL_URL), res))
+            .catch(() => {}),
+    ]));
+    self.skipWaiting();
+});
+
+self.addEventListener('activate', (event) => {
+    event.waitUntil(
+        caches.keys().then((keys) => {
+            return Promise.all(
+                keys.map((key) => {
+                    // So mexe nos caches do app (o OneSignal pode ter os dele)
+                    if (key.startsWith(CACHE_PREFIX) && !key.startsWith(RUNTIME_PREFIX) && key !== CACHE_NAME) {
+                        return caches.delete(key);
+                    }
+                    const bucket = key.slice(RUNTIME_PREFIX.length);
+                    if (key.startsWith(RUNTIME_PREFIX) && (!(bucket in RUNTIME_BUCKETS) ||
+                            (bucket === 'pages' && NAVIGATION_STRATEGY === 'off'))) {
+                        return caches.delete(key).then(() => forgetBucket(bucket));
+                    }
+                })
+            );
+        }).then(() => {
+            if (!self.registration.navigationPreload) return;
+            // Preload: o request da pagina sai em paralelo com o boot do SW
+            return NAVIGATION_STRATEGY === 'off'
+                ? self.registration.navigationPreload.disable()
+                : self.registration.navigationPreload.enable();
+        })
+    );
+    return self.clients.claim();
+});
+
+// =============================================
+// CACHE RUNTIME — buckets com limite e LRU
+// Metadados (tamanho, ultimo acesso) ficam no IndexedDB; sem IndexedDB
+// vale so o limite de entradas, na ordem de insercao do proprio cache.
+// =============================================
+// Conexoes abertas por nome de banco (uma por SW)
+const idbConnections = {};
+
+function idbOpen(name, upgrade) {
+    if (!idbConnections[name]) {
+        idbConnections[name] = new Promise((resolve, reject) => {
+            const open = indexedDB.open(name, 1);
+            open.onupgradeneeded = () => upgrade(open.result);
+            open.onsuccess = () => {
+                open.result.onversionchange = () => open.result.close();
+                resolve(open.result);
+            };
+            open.onerror = () => reject(open.error);
+        });
+    }
+    return idbConnections[name];
+}
+
+function idbTx(connection, storeName, mode, fn) {
+    return connection.then((db) => new Promise((resolve, reject) => {
+        const tx = db.transaction(storeName, mode);
+        const request = fn(tx.objectStore(storeName));
+        tx.oncomplete = () => resolve(request ? request.result : undefined);
+        tx.onerror = tx.onabort = () => reject(tx.error);
+    }));
+}
+
+function metaTx(mode, fn) {
+    const connection = idbOpen(META_DB, (db) => {
+        const store = db.createObjectStore(META_STORE, { keyPath: 'key' });
+        store.createIndex('bucket', 'bucket');
+    });
+    return idbTx(connection, META_STORE, mode, fn);
+}
+
+function metaKey(bucket, url) {
+    return bucket + '|' + url;
+}
+
+function recordEntry(bucket, url, size) {
+    return metaTx('readwrite', (store) => {
+        store.put({ key: metaKey(bucket, url), bucket, url, size, lastAccess: Date.now() });
+    }).catch(() => {});
+}
+
+function touchEntry(bucket, url) {
+    return metaTx('readwrite', (store) => {
+        const get = store.get(metaKey(bucket, url));
+        get.onsuccess = () => {
+            if (!get.result) return;
+            get.result.lastAccess = Date.now();
+            store.put(get.result);
+        };
+    }).catch(() => {});
+}
+
+function forgetBucket(bucket) {
+    return metaTx('readwrite', (store) => {
+        const cursor = store.index('bucket').openKeyCursor(IDBKeyRange.only(bucket));
+        cursor.onsuccess = () => {
+            if (!cursor.result) return;
+            store.delete(cursor.result.primaryKey);
+            cursor.result.continue();
+        };
+    }).catch(() => {});
+}
+
+function entrySize(res) {
+    if (res.type === 'opaque') return Promise.resolve(OPAQUE_ENTRY_BYTES);
+    return res.blob().then((blob) => blob.size);
+}
+
+function isPinned(bucket, url) {
+    // O shell e o fallback offline do app_shell — nao sai por LRU
+    return bucket === 'pages' && url === new URL(SHELL_URL, self.location.origin).href;
+}
+
+function trimBucket(bucket) {
+    const limits = RUNTIME_BUCKETS[bucket];
+    return caches.open(RUNTIME_PREFIX + bucket).then((cache) => Promise.all([
+        cache.keys(),
+        metaTx('readonly', (store) => store.index('bucket').getAll(bucket)).catch(() => []),
+    ]).then(([keys, records]) => {
+        const meta = new Map(records.map((record) => [record.url, record]));
+        // Sem metadado (IndexedDB indisponivel, cache antigo) conta como mais antiga, na ordem do cache
+        const entries = keys.map((req, index) => meta.get(req.url) || { url: req.url, size: 0, lastAccess: index });
+        const live = new Set(keys.map((req) => req.url));
+        const orphans = records.filter((record) => !live.has(record.url));
+
+        let count = entries.length;
+        let bytes = entries.reduce((sum, entry) => sum + entry.size, 0);
+        const evicted = [];
+        entries
+            .filter((entry) => !isPinned(bucket, entry.url))
+            .sort((a, b) => a.lastAccess - b.lastAccess)
+            .forEach((entry) => {
+                if (count <= limits.maxEntries && bytes <= limits.maxBytes) return;
+                evicted.push(entry);
+                count -= 1;
+                bytes -= entry.size;
+            });
+        if (!evicted.length && !orphans.length) return;
+
+        return Promise.all(evicted.map((entry) => cache.delete(entry.url))).then(() => {
+            return metaTx('readwrite', (store) => {
+                evicted.concat(orphans).forEach((entry) => store.delete(metaKey(bucket, entry.url)));
+            }).catch(() => {});
+        });
+    }));
+}
+
+// Um corte por bucket de cada vez; puts durante o corte pedem mais uma rodada
+const trimming = {};
+
+function scheduleTrim(bucket) {
+    if (trimming[bucket]) {
+        trimming[bucket].again = true;
+        return trimming[bucket].promise;
+    }
+    const state = { again: false };
+    state.promise = trimBucket(bucket)
+        .catch((err) => console.warn('SW: erro ao limitar cache ' + bucket, err))
+        .then(() => {
+            delete trimming[bucket];
+            if (state.again) return scheduleTrim(bucket);
+        });
+    trimming[bucket] = state;
+    return state.promise;
+}
+
+function putRuntime(bucket, url, res) {
+    const limits = RUNTIME_BUCKETS[bucket];
+    return entrySize(res.clone()).then((size) => {
+        // Uma entrada sozinha nao ocupa mais que 1/4 do bucket
+        if (size > limits.maxBytes / 4) return;
+        return caches.open(RUNTIME_PREFIX + bucket)
+            .then((cache) => cache.put(url, res))
+            .then(() => recordEntry(bucket, url, size))
+            .then(() => scheduleTrim(bucket));
+    }).catch((err) => {
+        console.warn('SW: erro ao gravar cache ' + bucket, err);
+    });
+}
+
+function matchRuntime(bucket, url) {
+    return caches.open(RUNTIME_PREFIX + bucket)
+        .then((cache) => cache.match(url))
+        .then((cached) => {
+            if (cached) touchEntry(bucket, url);
+            return cached;
+        });
+}
+
+function runtimeBucket(req) {
+    const path = new URL(req.url).pathname.toLowerCase();
+    if (path.includes('service-worker') || path.includes('onesignalsdk')) return null;
+    if (req.destination === 'manifest' || path.includes('/manifest')) return 'meta';
+    if (req.destination === 'script' || path.endsWith('.js')) return 'scripts';
+    if (req.destination === 'style' || path.endsWith('.css')) return 'styles';
+    if (req.destination === 'image' || /\.(png|jpe?g|gif|webp|avif|svg|ico)$/.test(path)) return 'images';
+    return null;
+}
+
+// Stale-while-revalidate: responde do bucket (ou do precache) e atualiza em background
+function handleRuntime(event, bucket) {
+    const req = event.request;
+    const network = fetch(req).then((res) => {
+        if (res.ok || res.type === 'opaque') event.waitUntil(putRuntime(bucket, req.url, res.clone()));
+        return res;
+    });
+    event.waitUntil(network.catch(() => {}));
+
+    return matchRuntime(bucket, req.url)
+        // Precache da versao atual (manifest, icones) antes de ir para a rede
+        .then((cached) => cached || caches.match(req.url, { cacheName: CACHE_NAME }))
+        .then((cached) => cached || network);
+}
+
+// =============================================
+// NAVEGACAO — paginas da vitrine
+// swr: responde do cache e atualiza em background
+// app_shell: launch do app (start_url) sai do cache; demais paginas
+//            vao na rede com timeout e caem para o cache/shell
+// =============================================
+function pageKey(url) {
+    const u = new URL(url);
+    [...u.searchParams.keys()].forEach((name) => {
+        if (IGNORED_PARAMS.test(name)) u.searchParams.delete(name);
+    });
+    u.hash = '';
+    return u.href;
+}
+
+function putPage(req, res) {
+    if (!res || !res.ok || res.type !== 'basic' || res.redirected) return Promise.resolve();
+    const cacheControl = res.headers.get('Cache-Control') || '';
+    if (cacheControl.includes('no-store')) return Promise.resolve();
+    return putRuntime('pages', pageKey(req.url), res);
+}
+
+function cachedPage(req) {
+    return matchRuntime('pages', pageKey(req.url));
+}
+
+function cachedShell() {
+    return matchRuntime('pages', new URL(SHELL_URL, self.location.origin).href);
+}
+
+function networkPage(event) {
+    const req = event.request;
+    const network = Promise.resolve(event.preloadResponse)
+        .then((preloaded) => preloaded || fetch(req))
+        .then((res) => {
+            event.waitUntil(putPage(req, res.clone()));
+            return res;
+        });
+    // Nao deixa o preload sem consumo se a resposta sair do cache
+    event.waitUntil(network.catch(() => {}));
+    return network;
+}
+
+function withTimeout(promise, ms) {
+    return new Promise((resolve, reject) => {
+        const timer = setTimeout(() => reject(new Error('timeout')), ms);
+        promise.then((value) => { clearTimeout(timer); resolve(value); },
+                     (err) => { clearTimeout(timer); reject(err); });
+    });
+}
+
+function isAppLaunch(req) {
+    const u = new URL(req.url);
+    return u.pathname === SHELL_URL && u.searchParams.get('utm_source') === 'pwa_app';
+}
+
+function handleNavigation(event) {
+    const req = event.request;
+    const network = networkPage(event);
+    const cacheFirst = NAVIGATION_STRATEGY === 'swr' || isAppLaunch(req);
+
+    return cachedPage(req).then((cached) => {
+        if (cached && cacheFirst) return cached;
+        // Rede com timeout; se nao vier a tempo, a rede segue em background atualizando o cache
+        return withTimeout(network, NAVIGATION_TIMEOUT_MS).catch((err) => {
+            if (cached) return cached;
+            return cachedShell().then((shell) => {
+                if (shell && NAVIGATION_STRATEGY === 'app_shell') return shell;
+                // Sem nada em cache: espera a rede de qualquer jeito
+                return network;
+            });
+        });
+    });
+}
+
+self.addEventListener('fetch', (event) => {
+    const req = event.request;
+    if (req.method !== 'GET') return;
+    if (req.mode === 'navigate') {
+        const url = new URL(req.url);
+        if (NAVIGATION_STRATEGY === 'off') return;
+        if (url.origin !== self.location.origin || NAVIGATION_DENYLIST.test(url.pathname)) {
+            // Com preload ligado, usa a resposta ja em voo (sem request duplicado)
+            event.respondWith(Promise.resolve(event.preloadResponse).then((res) => res || fetch(req)));
+            return;
+        }
+        event.respondWith(handleNavigation(event));
+        return;
+    }
+    const acceptHeader = req.headers.get('Accept') || '';
+    if (acceptHeader.includes('text/html')) return;
+    const bucket = runtimeBucket(req);
+    if (bucket) event.respondWith(handleRuntime(event, bucket));
+});
+
+// =============================================
+// FILA DE ANALYTICS — a vitrine manda (postMessage) o evento que falhou;
+// o replay sai num lote gzip unico pelo Background Sync, sem rajada de retries
+// =============================================
+function queueTx(mode, fn) {
+    const connection = idbOpen(QUEUE_DB, (db) => {
+        db.createObjectStore(QUEUE_STORE, { keyPath: 'id', autoIncrement: true });
+    });
+    return idbTx(connection, QUEUE_STORE, mode, fn);
+}
+
+// Id fixo por evento: o servidor ignora repeticao se o lote for reenviado
+// depois de gravado (resposta perdida no meio do caminho)
+function eventUid() {
+    if (self.crypto && self.crypto.randomUUID) return self.crypto.randomUUID();
+    return Date.now().toString(36) + '-' + Math.random().toString(36).slice(2) + Math.random().toString(36).slice(2);
+}
+
+function enqueueEvent(data) {
+    if (typeof data.path !== 'string' || data.path.indexOf('/analytics/') !== 0) return Promise.resolve();
+    if (typeof data.backend !== 'string' || !/^https?:\/\//.test(data.backend)) return Promise.resolve();
+    return queueTx('readwrite', (store) => {
+        store.add({ uid: eventUid(), backend: data.backend, path: data.path, payload: data.payload, at: data.at || Date.now() });
+        // Fila cheia: descarta os mais antigos
+        const keys = store.getAllKeys();
+        keys.onsuccess = () => {
+            const excess = keys.result.length - QUEUE_MAX_EVENTS;
+            keys.result.slice(0, Math.max(0, excess)).forEach((key) => store.delete(key));
+        };
+    }).then(() => {
+        // Sem Background Sync (Safari/Firefox) a vitrine pede o replay no proximo load online
+        if (self.registration.sync) return self.registration.sync.register(SYNC_TAG);
+    }).catch((err) => {
+        console.warn('SW: erro ao enfileirar evento', err);
+    });
+}
+
+function gzipBody(text) {
+    if (typeof CompressionStream === 'undefined') return Promise.resolve(null);
+    const stream = new Blob([text]).stream().pipeThrough(new CompressionStream('gzip'));
+    return new Response(stream).arrayBuffer();
+}
+
+function postBatch(backend, events) {
+    const json = JSON.stringify({ events });
+    return gzipBody(json).then((gzipped) => {
+        // text/plain: "simple request", sem preflight
+        return fetch(backend + '/analytics/batch' + (gzipped ? '?encoding=gzip' : ''), {
+            method: 'POST',
+            headers: { 'Content-Type': 'text/plain;charset=UTF-8' },
+            body: gzipped || json,
+            credentials: 'omit',
+        });
+    }).then((res) => {
+        // 4xx: lote invalido, repetir nao resolve; 5xx/429/rede: fica para o proximo sync
+        if (res.status >= 500 || res.status === 429) throw new Error('HTTP ' + res.status);
+    });
+}
+
+function sendQueued() {
+    return queueTx('readonly', (store) => store.getAll(null, BATCH_MAX_EVENTS)).then((records) => {
+        if (!records.length) return;
+        const now = Date.now();
+        const backend = records[0].backend;
+        const batch = records.filter((record) => record.backend === backend);
+        const events = batch
+            .filter((record) => now - record.at <= QUEUE_MAX_AGE_MS)
+            .map((record) => ({ id: record.uid, path: record.path, payload: record.payload, age_ms: Math.max(0, now - record.at) }));
+
+        return (events.length ? postBatch(backend, events) : Promise.resolve())
+            .then(() => queueTx('readwrite', (store) => {
+                batch.forEach((record) => store.delete(record.id));
+            }))
+            .then(() => {
+                if (records.length === BATCH_MAX_EVENTS || batch.length < records.length) return sendQueued();
+            });
+    });
+}
+
+// Um replay por vez (sync e pedido da vitrine podem chegar juntos)
+let replaying = null;
+
+function replayQueue() {
+    if (!replaying) {
+        replaying = sendQueued().then(() => { replaying = null; }, (err) => {
+            replaying = null;
+            throw err;
+        });
+    }
+    return replaying;
+}
+
+self.addEventListener('message', (event) => {
+    const data = event.data || {};
+    if (data.type === 'analytics-queue') {
+        event.waitUntil(enqueueEvent(data));
+    } else if (data.type === 'analytics-flush') {
+        event.waitUntil(replayQueue().catch(() => {}));
+    }
+});
+
+// Falha rejeita o waitUntil: o navegador reagenda o sync com backoff
+self.addEventListener('sync', (event) => {
+    if (event.tag === SYNC_TAG) event.waitUntil(replayQueue());
+});